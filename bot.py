@@ -1,17 +1,68 @@
 import os
 import sys
+import copy
+import csv
+import gzip
+import html
 import json
+import shutil
+import signal
+import tempfile
+import threading
 import logging
 import asyncio
+import bisect
+import heapq
+import mmap
+import operator
+import struct
+import time
 import traceback
-from typing import Dict, Optional, List
-from io import BytesIO
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, InputFile, BotCommand
-from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, ContextTypes, filters
+from array import array
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from types import MappingProxyType
+from typing import Dict, Optional, List, Mapping
+from io import BytesIO, StringIO
+from urllib.parse import unquote
+
+# Начало запуска - от него отсчитываются этапы в журнале (см. StartupTimer)
+STARTUP_STARTED_AT = time.perf_counter()
+
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, InputFile, InputMediaPhoto, InputMediaDocument, BotCommand
+from telegram.ext import Application, CallbackContext, CommandHandler, MessageHandler, CallbackQueryHandler, TypeHandler, ContextTypes, filters
 from telegram.constants import ParseMode, ChatMemberStatus
-import aiohttp
+from telegram.error import BadRequest, NetworkError, TimedOut
+from telegram.request import BaseRequest, HTTPXRequest, RequestData
 from dotenv import load_dotenv
 
+# Необязательные ускоренные сериализаторы: без них используется стандартный json
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# С numpy массивы ID обрабатываются векторно и читаются из файла через mmap без копирования
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# HTTP/2 для запросов к Telegram (TELEGRAM_HTTP2=1) доступен, только если установлен h2
+try:
+    import h2
+except ImportError:
+    h2 = None
+
 # Загружаем переменные окружения из .env файла
 load_dotenv()
 
@@ -22,9 +73,19 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Файл для хранения данных
+# Файл с настройками бота (каналы, ссылки, тексты, админы)
 DATA_FILE = "bot_data.json"
 
+# Файл со списками пользователей и банов (может быть большим, хранится отдельно от настроек).
+# Расширение зависит от формата, см. USERS_STORAGE_FORMAT
+USERS_FILE_BASE = "bot_users"
+
+# Формат файла со списками: int64 (двоичный массив), json, msgpack
+USERS_STORAGE_FORMAT = os.getenv("USERS_STORAGE_FORMAT", "int64")
+
+# Ключи, которые хранятся в файле списков, а не в DATA_FILE
+USERS_KEYS = ('users', 'banned_users')
+
 # ID каналов для проверки подписки (загружаются из файла)
 CHANNEL_IDS = [-1002209682372, -1002787956505]  # G1dra канал и новый канал
 
@@ -37,164 +98,3254 @@ CHANNEL_LINKS = [
 # ID главного администратора (по умолчанию)
 MAIN_ADMIN_ID = 8211610309
 
+# ID администраторов (загружаются из файла)
+ADMIN_IDS = [MAIN_ADMIN_ID]
+
 # Ссылка на файл для загрузки (загружается из файла)
 FILE_URL = "http://pvpnext123.temp.swtest.ru/Pro%20Tweaker%20Installer.exe"
 
+# Файл для оперативного состояния (последние сообщения, состояния админов)
+RUNTIME_STATE_FILE = "bot_state.json"
+
+# Как часто сохранять оперативное состояние на диск (секунды)
+RUNTIME_STATE_SAVE_INTERVAL = 30
+
+
+class BoundedStore:
+    """
+    Ограниченное хранилище key -> value с вытеснением по LRU и сроком жизни записей.
+    
+    - Не больше max_size записей: при переполнении удаляется давно не использованная
+    - Запись старше ttl секунд считается отсутствующей
+    - Присваивание None удаляет запись
+    """
+
+    _MISSING = object()
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._items: OrderedDict = OrderedDict()  # key -> (value, expires_at)
+        self.dirty = False
+
+    def get(self, key, default=None):
+        """Возвращает значение, если запись существует и не устарела"""
+        item = self._items.get(key)
+        if item is None:
+            return default
+        value, expires_at = item
+        if expires_at <= time.time():
+            del self._items[key]
+            self.dirty = True
+            return default
+        self._items.move_to_end(key)
+        return value
+
+    def __getitem__(self, key):
+        value = self.get(key, self._MISSING)
+        if value is self._MISSING:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        if value is None:
+            self.pop(key)
+            return
+        self._items[key] = (value, time.time() + self.ttl)
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+        self.dirty = True
+
+    def __contains__(self, key) -> bool:
+        return self.get(key, self._MISSING) is not self._MISSING
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def pop(self, key, default=None):
+        """Удаляет запись и возвращает ее значение"""
+        item = self._items.pop(key, None)
+        if item is None:
+            return default
+        self.dirty = True
+        return item[0]
+
+    def purge_expired(self) -> int:
+        """Удаляет все устаревшие записи, возвращает их количество"""
+        now = time.time()
+        expired = [key for key, (_, expires_at) in self._items.items() if expires_at <= now]
+        for key in expired:
+            del self._items[key]
+        if expired:
+            self.dirty = True
+        return len(expired)
+
+    def to_records(self) -> List[list]:
+        """Компактное представление для сохранения: [[key, value, expires_at], ...]"""
+        now = time.time()
+        return [[key, value, int(expires_at)] for key, (value, expires_at) in self._items.items() if expires_at > now]
+
+    def load_records(self, records: List[list]):
+        """Восстанавливает записи из сохраненного представления"""
+        now = time.time()
+        for key, value, expires_at in records:
+            if expires_at > now:
+                self._items[key] = (value, expires_at)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+        self.dirty = False
+
+
 # Хранилище для предыдущих сообщений (user_id -> message_id)
-user_messages: Dict[int, Optional[int]] = {}
+# Бот может удалять свои сообщения только в течение 48 часов, дольше хранить их нет смысла
+user_messages = BoundedStore(max_size=100_000, ttl=48 * 3600)
 
 # Состояния для админ-панели (user_id -> state)
-admin_states: Dict[int, Optional[str]] = {}
+admin_states = BoundedStore(max_size=1_000, ttl=6 * 3600)
 
-# Хранилище для логов действий
-action_logs: List[Dict] = []
+# Каталог для журнала действий администраторов
+ACTION_LOG_DIR = "action_logs"
 
+# Записей в одном сегменте журнала и максимальное количество сегментов
+ACTION_LOG_SEGMENT_SIZE = 5000
+ACTION_LOG_MAX_SEGMENTS = 100
 
-def load_data():
-    """Загружает данные из файла"""
-    global CHANNEL_IDS, CHANNEL_LINKS, FILE_URL
+
+class ActionLogStore:
+    """
+    Журнал действий администраторов на диске.
+    
+    - Записи дописываются в текущий сегмент (NDJSON), заполненный сегмент
+      сжимается в gzip и больше не изменяется
+    - index.json хранит для каждого сегмента количество записей, диапазон времени
+      и список admin_id - по нему пропускаются сегменты при листании и фильтрации
+    - Старые сегменты удаляются сверх ACTION_LOG_MAX_SEGMENTS
+    - Вся работа с диском и все состояние журнала (включая счетчик записей) - в одном
+      фоновом потоке, поэтому запись не блокирует event loop, а чтение всегда видит
+      все ранее добавленные записи
+    - Поток запускается и индекс читается при первом обращении, а не при импорте
+    """
+
+    ACTIVE_FILE = "current.ndjson"
+    INDEX_FILE = "index.json"
+
+    def __init__(self, directory: str, segment_size: int = ACTION_LOG_SEGMENT_SIZE,
+                 max_segments: int = ACTION_LOG_MAX_SEGMENTS):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.max_segments = max_segments
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._segments: List[Dict] = []
+        self._next_seq = 1
+        self._active = self._new_segment_meta(self.ACTIVE_FILE)
+        self._total = 0
+
+    def _submit(self, func, *args):
+        """Ставит операцию в очередь потока журнала"""
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="action-log")
+            self._executor.submit(self._load)
+        return self._executor.submit(func, *args)
+
+    # ---------- Вызывается из обработчиков ----------
+
+    def append(self, admin_id: int, action: str):
+        """Добавляет запись (не блокирует, запись на диск выполняется в фоне)"""
+        now = datetime.now()
+        entry = {
+            'ts': int(now.timestamp()),
+            'timestamp': now.strftime('%Y-%m-%d %H:%M:%S'),
+            'admin_id': admin_id,
+            'action': action
+        }
+        self._submit(self._append, entry)
+
+    async def count(self) -> int:
+        """Количество записей в журнале (с учетом всех ранее добавленных)"""
+        return await self.run(self._count)
+
+    async def run(self, func, *args):
+        """Выполняет операцию в потоке журнала после всех ранее добавленных записей"""
+        return await asyncio.wrap_future(self._submit(func, *args))
+
+    def close(self):
+        """Дожидается записи всех добавленных записей"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+
+    # ---------- Выполняется в потоке журнала ----------
+
+    @staticmethod
+    def _new_segment_meta(file_name: str) -> Dict:
+        return {'file': file_name, 'count': 0, 'ts_min': None, 'ts_max': None, 'admins': []}
+
+    def _path(self, file_name: str) -> str:
+        return os.path.join(self.directory, file_name)
+
+    def _load(self):
+        try:
+            index_path = self._path(self.INDEX_FILE)
+            if os.path.exists(index_path):
+                with open(index_path, 'r', encoding='utf-8') as f:
+                    index = json.load(f)
+                self._segments = index.get('segments', [])
+                self._next_seq = index.get('next_seq', len(self._segments) + 1)
+            # Текущий сегмент ограничен segment_size записями - пересчитываем его метаданные
+            for entry in self._read_segment(self._active):
+                self._update_meta(self._active, entry)
+            self._total = sum(seg['count'] for seg in self._segments) + self._active['count']
+        except Exception as e:
+            logger.error(f"Ошибка при загрузке журнала действий: {e}")
+
+    def _count(self) -> int:
+        return self._total
+
+    @staticmethod
+    def _update_meta(meta: Dict, entry: Dict):
+        ts = entry.get('ts', 0)
+        meta['count'] += 1
+        meta['ts_min'] = ts if meta['ts_min'] is None else min(meta['ts_min'], ts)
+        meta['ts_max'] = ts if meta['ts_max'] is None else max(meta['ts_max'], ts)
+        if entry.get('admin_id') not in meta['admins']:
+            meta['admins'].append(entry.get('admin_id'))
+
+    def _append(self, entry: Dict):
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(self._path(self.ACTIVE_FILE), 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry, ensure_ascii=False, separators=(',', ':')) + "\n")
+            self._update_meta(self._active, entry)
+            self._total += 1
+            if self._active['count'] >= self.segment_size:
+                self._rotate()
+        except Exception as e:
+            logger.error(f"Ошибка при записи журнала действий: {e}")
+
+    def _rotate(self):
+        """Сжимает текущий сегмент и начинает новый"""
+        file_name = f"segment-{self._next_seq:06d}.ndjson.gz"
+        with open(self._path(self.ACTIVE_FILE), 'rb') as src, gzip.open(self._path(file_name), 'wb') as dst:
+            shutil.copyfileobj(src, dst)
+        meta = dict(self._active, file=file_name)
+        self._segments.append(meta)
+        self._next_seq += 1
+
+        # Удаляем самые старые сегменты сверх лимита
+        while len(self._segments) > self.max_segments:
+            old = self._segments.pop(0)
+            self._total -= old['count']
+            try:
+                os.remove(self._path(old['file']))
+            except OSError:
+                pass
+
+        self._save_index()
+        os.remove(self._path(self.ACTIVE_FILE))
+        self._active = self._new_segment_meta(self.ACTIVE_FILE)
+
+    def _save_index(self):
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_path = self._path(self.INDEX_FILE + ".tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'segments': self._segments, 'next_seq': self._next_seq}, f, separators=(',', ':'))
+        os.replace(tmp_path, self._path(self.INDEX_FILE))
+
+    def _read_segment(self, meta: Dict) -> List[Dict]:
+        path = self._path(meta['file'])
+        if not os.path.exists(path):
+            return []
+        opener = gzip.open if meta['file'].endswith('.gz') else open
+        entries = []
+        with opener(path, 'rt', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    try:
+                        entries.append(json.loads(line))
+                    except ValueError:
+                        continue
+        return entries
+
+    def _all_segments(self) -> List[Dict]:
+        return self._segments + [self._active]
+
+    def page(self, offset: int, limit: int) -> List[Dict]:
+        """Записи от новых к старым, начиная с offset. Читаются только нужные сегменты"""
+        result = []
+        for meta in reversed(self._all_segments()):
+            if offset >= meta['count']:
+                offset -= meta['count']
+                continue
+            entries = self._read_segment(meta)
+            entries.reverse()
+            result.extend(entries[offset:offset + limit - len(result)])
+            offset = 0
+            if len(result) >= limit:
+                break
+        return result
+
+    @staticmethod
+    def _matches(entry: Dict, admin_id: Optional[int], since: Optional[int]) -> bool:
+        if admin_id is not None and entry.get('admin_id') != admin_id:
+            return False
+        if since is not None and entry.get('ts', 0) < since:
+            return False
+        return True
+
+    def entries(self):
+        """Все записи журнала от старых к новым, по одному сегменту в памяти"""
+        for meta in self._all_segments():
+            if meta['count']:
+                yield from self._read_segment(meta)
+
+    def export(self, fileobj, admin_id: Optional[int] = None, since: Optional[int] = None) -> int:
+        """Потоково пишет подходящие записи в файл как JSON-массив, возвращает их количество"""
+        written = 0
+        fileobj.write(b"[\n")
+        for meta in self._all_segments():
+            if not meta['count']:
+                continue
+            if admin_id is not None and admin_id not in meta['admins']:
+                continue
+            if since is not None and meta['ts_max'] is not None and meta['ts_max'] < since:
+                continue
+            for entry in self._read_segment(meta):
+                if not self._matches(entry, admin_id, since):
+                    continue
+                if written:
+                    fileobj.write(b",\n")
+                fileobj.write(json.dumps(entry, ensure_ascii=False, indent=2).encode('utf-8'))
+                written += 1
+        fileobj.write(b"\n]\n")
+        return written
+
+    def import_entries(self, entries: List[Dict], replace: bool = False) -> int:
+        """Добавляет импортированные записи, пропуская уже имеющиеся. Возвращает количество добавленных"""
+        if replace:
+            self.clear()
+            existing = set()
+        else:
+            existing = {(e.get('ts'), e.get('admin_id'), e.get('action')) for e in self.entries()}
+        added = 0
+        for entry in entries:
+            key = (entry.get('ts'), entry.get('admin_id'), entry.get('action'))
+            if key in existing:
+                continue
+            existing.add(key)
+            self._append(entry)
+            added += 1
+        return added
+
+    def clear(self):
+        """Удаляет все записи журнала"""
+        for meta in self._all_segments():
+            try:
+                os.remove(self._path(meta['file']))
+            except OSError:
+                pass
+        self._segments = []
+        self._active = self._new_segment_meta(self.ACTIVE_FILE)
+        self._save_index()
+        self._total = 0
+
+
+# Журнал действий администраторов
+action_log = ActionLogStore(ACTION_LOG_DIR)
+
+
+# ==================== ХРАНЕНИЕ ID ====================
+
+class CompactIdSet:
+    """
+    Множество ID в отсортированном массиве int64: 8 байт на ID вместо ~36 у списка int.
+    
+    - Проверка наличия - бинарный поиск (bisect или numpy.searchsorted)
+    - Добавления и удаления копятся в небольших буферах и вливаются в массив пачкой
+      при превышении DELTA_LIMIT или перед упорядоченным чтением
+    - С numpy массив может ссылаться на отображенный в память файл - он не читается
+      целиком при запуске
+    """
+
+    DELTA_LIMIT = 4096
+
+    def __init__(self, values=(), presorted: bool = False):
+        self._base = self._normalize(values, presorted)
+        self._added = set()
+        self._removed = set()
+
+    @staticmethod
+    def _normalize(values, presorted: bool):
+        """Отсортированный массив без повторов"""
+        if numpy is not None:
+            base = numpy.asarray(values, dtype=numpy.int64)
+            if presorted and (len(base) < 2 or bool(numpy.all(base[1:] > base[:-1]))):
+                return base
+            base = numpy.sort(base)
+            if len(base) > 1:
+                base = base[numpy.concatenate(([True], base[1:] != base[:-1]))]
+            return base
+        base = values if isinstance(values, array) else array('q', values)
+        if presorted and all(map(operator.lt, base, islice(base, 1, None))):
+            return base
+        return array('q', sorted(set(base)))
+
+    @classmethod
+    def _from_sorted(cls, base) -> 'CompactIdSet':
+        """Множество поверх уже отсортированного массива без повторов (без проверки)"""
+        id_set = cls.__new__(cls)
+        id_set._base = base
+        id_set._added = set()
+        id_set._removed = set()
+        return id_set
+
+    @classmethod
+    def from_buffer(cls, buffer, offset: int, count: int) -> 'CompactIdSet':
+        """
+        Множество из little-endian int64 в буфере (с numpy - без копирования).
+        
+        Буфер - файл, который записал сам бот из CompactIdSet, поэтому порядок не проверяется:
+        иначе при запуске пришлось бы прочитать весь отображенный в память файл.
+        """
+        if numpy is not None:
+            return cls._from_sorted(numpy.frombuffer(buffer, dtype='<i8', count=count, offset=offset))
+        values = array('q')
+        values.frombytes(memoryview(buffer)[offset:offset + count * 8])
+        if sys.byteorder == 'big':
+            values.byteswap()
+        return cls._from_sorted(values)
+
+    def _base_index(self, item_id: int) -> int:
+        if numpy is not None:
+            return int(numpy.searchsorted(self._base, item_id))
+        return bisect.bisect_left(self._base, item_id)
+
+    def _base_contains(self, item_id: int) -> bool:
+        i = self._base_index(item_id)
+        return i < len(self._base) and self._base[i] == item_id
+
+    def __contains__(self, item_id: int) -> bool:
+        if item_id in self._added:
+            return True
+        if item_id in self._removed:
+            return False
+        return self._base_contains(item_id)
+
+    def __len__(self) -> int:
+        return len(self._base) + len(self._added) - len(self._removed)
+
+    def add(self, item_id: int) -> bool:
+        """Добавляет ID. Возвращает False, если он уже был"""
+        if item_id in self._removed:
+            self._removed.discard(item_id)
+            return True
+        if item_id in self._added or self._base_contains(item_id):
+            return False
+        self._added.add(item_id)
+        if len(self._added) > self.DELTA_LIMIT:
+            self.compact()
+        return True
+
+    def discard(self, item_id: int) -> bool:
+        """Удаляет ID. Возвращает False, если его не было"""
+        if item_id in self._added:
+            self._added.discard(item_id)
+            return True
+        if item_id in self._removed or not self._base_contains(item_id):
+            return False
+        self._removed.add(item_id)
+        if len(self._removed) > self.DELTA_LIMIT:
+            self.compact()
+        return True
+
+    def compact(self):
+        """Вливает буферы изменений в отсортированный массив"""
+        if not self._added and not self._removed:
+            return
+        added = sorted(self._added)
+        removed = self._removed
+        if numpy is not None:
+            base = self._base
+            if removed:
+                base = base[~numpy.isin(base, numpy.fromiter(removed, dtype=numpy.int64, count=len(removed)))]
+            if added:
+                added_array = numpy.array(added, dtype=numpy.int64)
+                base = numpy.insert(base, numpy.searchsorted(base, added_array), added_array)
+            self._base = base
+        else:
+            kept = (item for item in self._base if item not in removed) if removed else self._base
+            self._base = array('q', heapq.merge(kept, added))
+        self._added = set()
+        self._removed = set()
+
+    def bisect_left(self, item_id: int) -> int:
+        self.compact()
+        return self._base_index(item_id)
+
+    def bisect_right(self, item_id: int) -> int:
+        self.compact()
+        if numpy is not None:
+            return int(numpy.searchsorted(self._base, item_id, side='right'))
+        return bisect.bisect_right(self._base, item_id)
+
+    def slice(self, start: int, end: int) -> List[int]:
+        """ID с позиции start до end в порядке возрастания"""
+        self.compact()
+        return [int(item) for item in self._base[start:end]]
+
+    def __iter__(self):
+        self.compact()
+        base = self._base
+        for start in range(0, len(base), 65536):
+            yield from self.slice(start, start + 65536)
+
+    def tolist(self) -> List[int]:
+        self.compact()
+        return [int(item) for item in self._base] if numpy is None else self._base.tolist()
+
+    def intersection_count(self, other: 'CompactIdSet') -> int:
+        """Количество общих ID (для numpy - векторно)"""
+        self.compact()
+        other.compact()
+        if numpy is not None:
+            return int(numpy.count_nonzero(numpy.isin(other._base, self._base, assume_unique=True)))
+        small, large = (self, other) if len(self) <= len(other) else (other, self)
+        return sum(1 for item in small._base if large._base_contains(item))
+
+    def difference_count(self, other: 'CompactIdSet') -> int:
+        """Количество ID, которых нет в other (например, пользователи без забаненных)"""
+        return len(self) - self.intersection_count(other)
+
+    def union(self, values) -> 'CompactIdSet':
+        """Новое множество из этих ID и values (для numpy - векторно)"""
+        self.compact()
+        if isinstance(values, CompactIdSet):
+            values.compact()
+            values = values._base
+        if numpy is not None:
+            return self._from_sorted(numpy.union1d(self._base, numpy.asarray(values, dtype=numpy.int64)))
+        return self._from_sorted(array('q', sorted(set(self._base).union(values))))
+
+    def frozen(self) -> 'CompactIdSet':
+        """
+        Копия на текущий момент без копирования массива: compact всегда создает новый
+        массив, поэтому дальнейшие изменения исходного множества копию не затрагивают
+        """
+        self.compact()
+        return self._from_sorted(self._base)
+
+    def difference(self, other: 'CompactIdSet') -> List[int]:
+        """ID, которых нет в other, по возрастанию (для numpy - векторно)"""
+        self.compact()
+        other.compact()
+        if self._base is other._base:
+            return []
+        if numpy is not None:
+            return numpy.setdiff1d(self._base, other._base, assume_unique=True).tolist()
+        return [item for item in self._base if not other._base_contains(item)]
+
+    def tobytes(self) -> bytes:
+        """Массив в виде little-endian int64"""
+        self.compact()
+        if numpy is not None:
+            return self._base.astype('<i8', copy=False).tobytes()
+        values = self._base
+        if sys.byteorder == 'big':
+            values = array('q', values)
+            values.byteswap()
+        return values.tobytes()
+
+
+# ==================== СЕРИАЛИЗАЦИЯ ====================
+
+def json_dumps(obj, indent: bool = False) -> bytes:
+    """JSON в UTF-8 (через orjson, если он установлен)"""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else 0)
+    if indent:
+        return json.dumps(obj, ensure_ascii=False, indent=2).encode('utf-8')
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def json_loads(raw: bytes):
+    """Разбирает JSON (через orjson, если он установлен)"""
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+
+def _id_lists(users_data: Dict[str, CompactIdSet]) -> Dict[str, List[int]]:
+    return {key: ids.tolist() if isinstance(ids, CompactIdSet) else list(ids) for key, ids in users_data.items()}
+
+
+class JsonIdsSerializer:
+    """Списки ID в JSON"""
+
+    name = "json"
+    extension = "json"
+
+    def dumps(self, users_data: Dict[str, CompactIdSet]) -> bytes:
+        return json_dumps(_id_lists(users_data))
+
+    def loads(self, raw: bytes) -> Dict[str, List[int]]:
+        return json_loads(raw)
+
+    def load_path(self, path: str) -> Dict[str, List[int]]:
+        with open(path, 'rb') as f:
+            return self.loads(f.read())
+
+
+class MsgpackIdsSerializer:
+    """Списки ID в msgpack (доступен, если установлен пакет msgpack)"""
+
+    name = "msgpack"
+    extension = "msgpack"
+
+    def dumps(self, users_data: Dict[str, CompactIdSet]) -> bytes:
+        return msgpack.packb(_id_lists(users_data))
+
+    def loads(self, raw: bytes) -> Dict[str, List[int]]:
+        return msgpack.unpackb(raw)
+
+    def load_path(self, path: str) -> Dict[str, List[int]]:
+        with open(path, 'rb') as f:
+            return self.loads(f.read())
+
+
+class Int64IdsSerializer:
+    """
+    Списки ID как отсортированные двоичные массивы int64 (little-endian).
+    
+    Формат: сигнатура IDS1, количество списков, затем для каждого списка длина имени,
+    имя, количество ID и сами ID по 8 байт. Запись и чтение - копирование памяти
+    без разбора текста; с numpy файл отображается в память и не копируется.
+    """
+
+    name = "int64"
+    extension = "ids"
+    MAGIC = b"IDS1"
+
+    def dumps(self, users_data: Dict[str, CompactIdSet]) -> bytes:
+        chunks = [self.MAGIC, struct.pack('<I', len(users_data))]
+        for key, ids in users_data.items():
+            if not isinstance(ids, CompactIdSet):
+                ids = CompactIdSet(ids)
+            name = key.encode('utf-8')
+            chunks.append(struct.pack('<H', len(name)))
+            chunks.append(name)
+            chunks.append(struct.pack('<Q', len(ids)))
+            chunks.append(ids.tobytes())
+        return b"".join(chunks)
+
+    def loads(self, raw) -> Dict[str, CompactIdSet]:
+        if bytes(raw[:4]) != self.MAGIC:
+            raise ValueError("неверная сигнатура файла ID")
+        (count,) = struct.unpack_from('<I', raw, 4)
+        offset = 8
+        users_data = {}
+        for _ in range(count):
+            (name_len,) = struct.unpack_from('<H', raw, offset)
+            offset += 2
+            key = bytes(raw[offset:offset + name_len]).decode('utf-8')
+            offset += name_len
+            (ids_count,) = struct.unpack_from('<Q', raw, offset)
+            offset += 8
+            if offset + ids_count * 8 > len(raw):
+                raise ValueError("файл ID обрезан")
+            users_data[key] = CompactIdSet.from_buffer(raw, offset, ids_count)
+            offset += ids_count * 8
+        return users_data
+
+    def load_path(self, path: str) -> Dict[str, CompactIdSet]:
+        with open(path, 'rb') as f:
+            # На Windows отображенный файл нельзя заменить при сохранении, поэтому он читается
+            if numpy is None or sys.platform == 'win32' or os.path.getsize(path) == 0:
+                return self.loads(f.read())
+            return self.loads(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+
+# Доступные форматы файла списков
+ID_SERIALIZERS = {serializer.name: serializer for serializer in (
+    Int64IdsSerializer(),
+    JsonIdsSerializer(),
+    *((MsgpackIdsSerializer(),) if msgpack is not None else ())
+)}
+
+if USERS_STORAGE_FORMAT not in ID_SERIALIZERS:
+    logger.warning(f"Формат {USERS_STORAGE_FORMAT} недоступен, используется int64")
+    USERS_STORAGE_FORMAT = "int64"
+
+users_serializer = ID_SERIALIZERS[USERS_STORAGE_FORMAT]
+USERS_FILE = f"{USERS_FILE_BASE}.{users_serializer.extension}"
+
+
+def benchmark_storage(sizes: List[int] = (10_000, 100_000, 1_000_000)):
+    """Сравнивает форматы файла списков: время сохранения и загрузки, размер файла"""
+    import random
+    
+    print(f"orjson: {'да' if orjson else 'нет'}, msgpack: {'да' if msgpack else 'нет'}")
+    print(f"{'пользователей':>14} {'формат':>16} {'запись, мс':>11} {'чтение, мс':>11} {'размер, КБ':>11}")
+    with tempfile.TemporaryDirectory() as directory:
+        for size in sizes:
+            users_data = {
+                'users': sorted(random.sample(range(100_000_000, 8_000_000_000), size)),
+                'banned_users': sorted(random.sample(range(100_000_000, 8_000_000_000), size // 100))
+            }
+            # В памяти бот хранит списки как CompactIdSet
+            ids_data = {key: CompactIdSet(ids, presorted=True) for key, ids in users_data.items()}
+            variants = [(name, serializer) for name, serializer in ID_SERIALIZERS.items()]
+            # Исходный формат: json.dump с отступами внутри bot_data.json
+            variants.append(("json indent=2", None))
+            for name, serializer in variants:
+                path = os.path.join(directory, "users")
+                started = time.perf_counter()
+                if serializer is None:
+                    with open(path, 'w', encoding='utf-8') as f:
+                        json.dump(users_data, f, ensure_ascii=False, indent=2)
+                else:
+                    with open(path, 'wb') as f:
+                        f.write(serializer.dumps(ids_data))
+                saved = time.perf_counter()
+                if serializer is None:
+                    with open(path, 'r', encoding='utf-8') as f:
+                        loaded = json.load(f)
+                else:
+                    loaded = serializer.load_path(path)
+                finished = time.perf_counter()
+                assert len(loaded['users']) == size
+                print(f"{size:>14} {name:>16} {(saved - started) * 1000:>11.1f} "
+                      f"{(finished - saved) * 1000:>11.1f} {os.path.getsize(path) / 1024:>11.0f}")
+
+
+# Версия списков пользователей: увеличивается при каждом сохранении и при изменении файла извне
+data_version = 0
+_users_mtime: Optional[float] = None
+
+# Списки пользователей и банов в памяти (перечитываются только при изменении файла,
+# которое замечает config_watch_job)
+_users_data: Optional[Dict[str, CompactIdSet]] = None
+
+# Счетчик изменений списков в памяти и его значение на момент последней записи файла.
+# Отдельные добавления и удаления пишутся на диск пачкой (users_flush_job), а не каждое
+_users_changes = 0
+_users_saved = 0
+_users_file_lock = threading.Lock()
+
+# Как часто записывать изменения списков пользователей на диск (секунды)
+USERS_FLUSH_INTERVAL = 10
+
+
+def _track_users_file(changed_by_us: bool) -> bool:
+    """Обновляет версию списков по времени изменения файла. Возвращает True, если версия изменилась"""
+    global data_version, _users_mtime
     try:
-        if os.path.exists(DATA_FILE):
-            with open(DATA_FILE, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                CHANNEL_IDS = data.get('channel_ids', CHANNEL_IDS)
-                CHANNEL_LINKS = data.get('channel_links', CHANNEL_LINKS)
-                FILE_URL = data.get('file_url', FILE_URL)
-                
-                # Убеждаемся, что главный админ всегда в списке
-                admins = data.get('admins', [])
-                if MAIN_ADMIN_ID not in admins:
-                    admins.append(MAIN_ADMIN_ID)
-                    data['admins'] = admins
-                    save_data(data)
-                
-                return data
-    except Exception as e:
-        logger.error(f"Ошибка при загрузке данных: {e}")
+        mtime = os.path.getmtime(USERS_FILE)
+    except OSError:
+        mtime = None
+    if changed_by_us or mtime != _users_mtime:
+        data_version += 1
+        _users_mtime = mtime
+        return True
+    return False
+
+
+def _write_bytes_atomic(path: str, payload: bytes):
+    """Записывает файл атомарно: временный файл, fsync и переименование"""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(payload)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def _write_users_file(users_data: Dict[str, CompactIdSet], changes: int) -> bool:
+    """
+    Записывает списки, сделанные на момент changes изменений, если на диске еще нет
+    более нового состояния. Можно вызывать из другого потока с замороженными множествами.
+    """
+    global _users_saved
+    with _users_file_lock:
+        if changes <= _users_saved:
+            return False
+        _write_bytes_atomic(USERS_FILE, users_serializer.dumps(users_data))
+        _users_saved = changes
+        return True
+
+
+def _apply_config(config: dict):
+    """Обновляет глобальные переменные из настроек"""
+    global CHANNEL_IDS, CHANNEL_LINKS, FILE_URL, ADMIN_IDS
+    CHANNEL_IDS = config.get('channel_ids', CHANNEL_IDS)
+    CHANNEL_LINKS = config.get('channel_links', CHANNEL_LINKS)
+    FILE_URL = config.get('file_url', FILE_URL)
+    ADMIN_IDS = config.get('admins', ADMIN_IDS)
+    render_cache.update_sources(CHANNEL_LINKS, config.get('messages', {}), config.get('settings', {}))
+
+
+def _migrate_users_data(config: dict) -> dict:
+    """
+    Переносит списки пользователей из bot_data.json старого формата в отдельный файл.
+    
+    Списки объединяются с уже имеющимися (старый файл настроек после деплоя или из
+    резервной копии не стирает пользователей, собранных позже). Сначала записывается
+    файл списков, затем настройки без них - при сбое между этими шагами миграция
+    просто повторится при следующей загрузке.
+    """
+    global _users_data, _users_changes
+    legacy = {key: config.pop(key, []) for key in USERS_KEYS}
+    current = load_users_data()
+    users_data = {key: current[key].union(legacy[key]) for key in USERS_KEYS}
+    _users_changes += 1
+    _write_users_file(users_data, _users_changes)
+    _track_users_file(changed_by_us=True)
+    _users_data = users_data
+    _write_bytes_atomic(DATA_FILE, json_dumps(config, indent=True))
+    logger.info(f"📦 Списки пользователей перенесены в {USERS_FILE}: "
+                f"{len(legacy['users'])} пользователей, {len(legacy['banned_users'])} банов "
+                f"(всего {len(users_data['users'])} и {len(users_data['banned_users'])})")
+    return config
+
+
+# Как часто проверять, не изменился ли файл настроек извне (секунды)
+CONFIG_RELOAD_INTERVAL = 5
+
+# Текущие настройки - неизменяемый снимок, который целиком заменяется при сохранении
+# или при изменении файла извне. Чтение настроек - просто обращение к этой переменной
+_config: Mapping = MappingProxyType({})
+_config_signature: Optional[tuple] = None
+
+
+def _file_signature(path: str) -> Optional[tuple]:
+    """inode, время изменения и размер файла (None, если файла нет)"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+
+def _set_config(config: dict, signature: Optional[tuple]):
+    """Подменяет снимок настроек"""
+    global _config, _config_signature
+    snapshot = MappingProxyType(copy.deepcopy(config))
+    _apply_config(snapshot)
+    _config, _config_signature = snapshot, signature
+
+
+def current_config() -> Mapping:
+    """Текущие настройки только для чтения"""
+    return _config
+
+
+def load_config() -> dict:
+    """Копия текущих настроек, которую можно изменить и передать в save_data"""
+    return copy.deepcopy(dict(_config))
+
+
+def reload_config(force: bool = False) -> bool:
+    """Перечитывает файл настроек, если он изменился. Возвращает True, если снимок обновлен"""
+    global _config_signature
+    signature = _file_signature(DATA_FILE)
+    if not force and signature == _config_signature:
+        return False
+    
+    if signature is not None:
+        try:
+            with open(DATA_FILE, 'rb') as f:
+                config = json_loads(f.read())
+            if any(key in config for key in USERS_KEYS):
+                config = _migrate_users_data(config)
+                signature = _file_signature(DATA_FILE)
+        except Exception as e:
+            # Файл может быть недописан - оставляем прежние настройки до следующего изменения
+            logger.error(f"Ошибка при загрузке данных: {e}")
+            _config_signature = signature
+            return False
+        
+        # Главный админ всегда в списке (добавляется в памяти, в файл попадет при следующем сохранении)
+        admins = config.get('admins', [])
+        if MAIN_ADMIN_ID not in admins:
+            config['admins'] = admins + [MAIN_ADMIN_ID]
+        
+        if _config_signature is not None:
+            logger.info("🔄 Файл настроек изменился - настройки перечитаны")
+        _set_config(config, signature)
+        return True
     
-    # Если файла нет, создаем с главным админом
-    default_data = {
+    # Если файла нет, работаем с настройками по умолчанию - файл создаст первое сохранение
+    default_config = {
         'admins': [MAIN_ADMIN_ID], 
-        'users': [], 
         'channel_ids': CHANNEL_IDS, 
         'channel_links': CHANNEL_LINKS, 
         'file_url': FILE_URL,
-        'banned_users': [],
         'messages': {},
         'images': {},
         'settings': {}
     }
-    save_data(default_data)
-    return default_data
+    _set_config(default_config, None)
+    return True
 
 
-def save_data(data: dict):
-    """Сохраняет данные в файл"""
+async def config_watch_job(context: ContextTypes.DEFAULT_TYPE):
+    """Периодически проверяет файлы настроек и списков и подхватывает правки, сделанные вручную или при деплое"""
+    reload_config()
+    reload_users_data()
+
+
+def _convert_users_file():
+    """Переводит файл списков, сохраненный в другом формате, в текущий USERS_STORAGE_FORMAT"""
+    for serializer in ID_SERIALIZERS.values():
+        path = f"{USERS_FILE_BASE}.{serializer.extension}"
+        if serializer is users_serializer or not os.path.exists(path):
+            continue
+        users_data = serializer.load_path(path)
+        _write_bytes_atomic(USERS_FILE, users_serializer.dumps(users_data))
+        os.remove(path)
+        logger.info(f"📦 Файл списков {path} преобразован в формат {users_serializer.name}")
+        return
+
+
+def _read_users_file() -> Dict[str, CompactIdSet]:
+    """Читает множества пользователей и банов из USERS_FILE"""
+    users_data = {key: CompactIdSet() for key in USERS_KEYS}
+    try:
+        if os.path.exists(USERS_FILE):
+            for key, ids in users_serializer.load_path(USERS_FILE).items():
+                users_data[key] = ids if isinstance(ids, CompactIdSet) else CompactIdSet(ids)
+    except Exception as e:
+        logger.error(f"Ошибка при загрузке списков пользователей: {e}")
+    return users_data
+
+
+def load_users_data() -> Dict[str, CompactIdSet]:
+    """Множества пользователей и банов (изменяются только через функции ниже)"""
+    global _users_data
+    if _users_data is None:
+        if not os.path.exists(USERS_FILE):
+            try:
+                _convert_users_file()
+            except Exception as e:
+                logger.error(f"Ошибка при преобразовании файла списков: {e}")
+        _track_users_file(changed_by_us=True)
+        _users_data = _read_users_file()
+    return _users_data
+
+
+def reload_users_data() -> bool:
+    """
+    Перечитывает файл списков, если он изменился извне. Возвращает True, если списки обновлены.
+    Пока в памяти есть незаписанные изменения, файл не перечитывается - они его перезапишут.
+    """
+    global _users_data
+    if _users_data is None or _users_changes != _users_saved:
+        return False
+    if not _track_users_file(changed_by_us=False):
+        return False
+    _users_data = _read_users_file()
+    logger.info("🔄 Файл списков пользователей изменился - списки перечитаны")
+    return True
+
+
+def load_data():
+    """Загружает все данные: настройки вместе с копиями списков пользователей и банов"""
+    data = load_config()
+    users_data = load_users_data()
+    for key in USERS_KEYS:
+        data[key] = users_data[key].tolist()
+    return data
+
+
+def save_users_data(users_data: Dict[str, CompactIdSet]) -> bool:
+    """Сохраняет списки пользователей и банов сразу (ключи, которых нет, не меняются)"""
+    global _users_data, _users_changes
     try:
-        with open(DATA_FILE, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
-        # Обновляем глобальные переменные
-        global CHANNEL_IDS, CHANNEL_LINKS, FILE_URL
-        CHANNEL_IDS = data.get('channel_ids', CHANNEL_IDS)
-        CHANNEL_LINKS = data.get('channel_links', CHANNEL_LINKS)
-        FILE_URL = data.get('file_url', FILE_URL)
+        merged = dict(load_users_data())
+        for key in USERS_KEYS:
+            if key in users_data:
+                ids = users_data[key]
+                merged[key] = ids if isinstance(ids, CompactIdSet) else CompactIdSet(ids)
+        _users_changes += 1
+        _write_users_file(merged, _users_changes)
+        _track_users_file(changed_by_us=True)
+        _users_data = merged
         return True
+    except Exception as e:
+        logger.error(f"Ошибка при сохранении списков пользователей: {e}")
+        return False
+
+
+def _users_snapshot() -> tuple:
+    """Замороженные копии списков и счетчик изменений на этот момент (для записи в другом потоке)"""
+    return {key: ids.frozen() for key, ids in load_users_data().items()}, _users_changes
+
+
+def flush_users_data():
+    """Записывает изменения списков синхронно (при остановке бота)"""
+    if _users_changes == _users_saved:
+        return
+    try:
+        if _write_users_file(*_users_snapshot()):
+            _track_users_file(changed_by_us=True)
+    except Exception as e:
+        logger.error(f"Ошибка при сохранении списков пользователей: {e}")
+
+
+async def users_flush_job(context: ContextTypes.DEFAULT_TYPE):
+    """Периодически записывает накопленные изменения списков пользователей в отдельном потоке"""
+    if _users_changes == _users_saved:
+        return
+    try:
+        if await asyncio.to_thread(_write_users_file, *_users_snapshot()):
+            _track_users_file(changed_by_us=True)
+    except Exception as e:
+        logger.error(f"Ошибка при сохранении списков пользователей: {e}")
+
+
+def _ids_changed(ids, current: CompactIdSet) -> bool:
+    """Отличается ли набор ID от текущего множества (для CompactIdSet - векторно)"""
+    if not isinstance(ids, CompactIdSet):
+        ids = CompactIdSet(ids)
+    return len(ids) != len(current) or ids.intersection_count(current) != len(ids)
+
+
+def save_data(data: dict):
+    """
+    Сохраняет данные. Настройки пишутся в DATA_FILE, а списки пользователей и банов -
+    в USERS_FILE, и только если они есть в data и изменились.
+    """
+    try:
+        config = {key: value for key, value in data.items() if key not in USERS_KEYS}
+        _write_bytes_atomic(DATA_FILE, json_dumps(config, indent=True))
+        _set_config(config, _file_signature(DATA_FILE))
     except Exception as e:
         logger.error(f"Ошибка при сохранении данных: {e}")
         return False
+    
+    current = load_users_data()
+    changed = {key: data[key] for key in USERS_KEYS
+               if key in data and _ids_changed(data[key], current[key])}
+    if changed:
+        return save_users_data(changed)
+    return True
 
 
 def is_admin(user_id: int) -> bool:
     """Проверяет, является ли пользователь администратором"""
-    data = load_data()
+    data = current_config()
     admins = data.get('admins', [])
     return user_id in admins
 
 
-def add_admin(user_id: int) -> bool:
-    """Добавляет администратора"""
-    data = load_data()
-    admins = data.get('admins', [])
-    if user_id not in admins:
-        admins.append(user_id)
-        data['admins'] = admins
-        return save_data(data)
-    return False
+def add_admin(user_id: int) -> bool:
+    """Добавляет администратора"""
+    data = load_config()
+    admins = data.get('admins', [])
+    if user_id not in admins:
+        admins.append(user_id)
+        data['admins'] = admins
+        return save_data(data)
+    return False
+
+
+def remove_admin(user_id: int) -> bool:
+    """Удаляет администратора"""
+    data = load_config()
+    admins = data.get('admins', [])
+    if user_id in admins:
+        admins.remove(user_id)
+        data['admins'] = admins
+        return save_data(data)
+    return False
+
+
+def _update_ids(key: str, user_id: int, add: bool) -> bool:
+    """Добавляет или удаляет ID в множестве в памяти (на диск изменения пишет users_flush_job)"""
+    global data_version, _users_changes
+    ids = load_users_data()[key]
+    if not (ids.add(user_id) if add else ids.discard(user_id)):
+        return False
+    data_version += 1
+    _users_changes += 1
+    return True
+
+
+def add_user(user_id: int) -> bool:
+    """Добавляет пользователя в список (для рассылки)"""
+    if _update_ids('users', user_id, add=True):
+        bot_stats.record('new_users')
+        return True
+    return False
+
+
+def remove_user(user_id: int) -> bool:
+    """Удаляет пользователя из списка рассылки"""
+    return _update_ids('users', user_id, add=False)
+
+
+def remove_users(user_ids: List[int]) -> int:
+    """Удаляет пачку пользователей из списка рассылки, возвращает количество удаленных"""
+    return sum(1 for user_id in user_ids if _update_ids('users', user_id, add=False))
+
+
+def log_action(admin_id: int, action: str):
+    """Логирует действие администратора"""
+    action_log.append(admin_id, action)
+
+
+def is_banned(user_id: int) -> bool:
+    """Проверяет, забанен ли пользователь"""
+    return user_id in banned_index
+
+
+def ban_user(user_id: int) -> bool:
+    """Банит пользователя"""
+    return _update_ids('banned_users', user_id, add=True)
+
+
+def unban_user(user_id: int) -> bool:
+    """Разбанивает пользователя"""
+    return _update_ids('banned_users', user_id, add=False)
+
+
+def get_all_users() -> List[int]:
+    """Возвращает список всех пользователей"""
+    return load_users_data()['users'].tolist()
+
+
+# ==================== ПОСТРАНИЧНЫЙ ПРОСМОТР ====================
+
+class SortedIdIndex:
+    """
+    Постраничный просмотр списка ID.
+    
+    Работает прямо с CompactIdSet из load_users_data(): множество уже отсортировано
+    и обновляется на месте, поэтому отдельная копия для листания не нужна.
+    version совпадает с версией списков на момент последнего обращения.
+    """
+
+    def __init__(self, key: str):
+        self.key = key
+        self.version = -1
+
+    def ensure(self) -> CompactIdSet:
+        """Возвращает актуальное множество ID"""
+        ids = load_users_data()[self.key]
+        self.version = data_version
+        return ids
+
+    def __len__(self) -> int:
+        return len(self.ensure())
+
+    def __contains__(self, item_id: int) -> bool:
+        return item_id in self.ensure()
+
+    def page_after(self, cursor: Optional[int], size: int) -> List[int]:
+        """Страница ID строго больше cursor (первая страница, если cursor=None)"""
+        ids = self.ensure()
+        start = 0 if cursor is None else ids.bisect_right(cursor)
+        return ids.slice(start, start + size)
+
+    def page_before(self, cursor: int, size: int) -> List[int]:
+        """Страница ID строго меньше cursor"""
+        ids = self.ensure()
+        end = ids.bisect_left(cursor)
+        return ids.slice(max(0, end - size), end)
+
+    def has_after(self, cursor: int) -> bool:
+        ids = self.ensure()
+        return ids.bisect_right(cursor) < len(ids)
+
+    def has_before(self, cursor: int) -> bool:
+        return self.ensure().bisect_left(cursor) > 0
+
+
+# Индексы пользователей и забаненных для постраничного просмотра
+users_index = SortedIdIndex('users')
+banned_index = SortedIdIndex('banned_users')
+
+# Записей на одной странице списка
+LIST_PAGE_SIZE = 50
+
+_CURSOR_ALPHABET = "0123456789abcdefghijklmnopqrstuvwxyz"
+
+
+def encode_cursor(direction: str, value: int) -> str:
+    """Компактный курсор для callback_data: направление (n/p) + ID в base36"""
+    sign = "-" if value < 0 else ""
+    value = abs(value)
+    digits = ""
+    while True:
+        value, rest = divmod(value, 36)
+        digits = _CURSOR_ALPHABET[rest] + digits
+        if not value:
+            break
+    return f"{direction}{sign}{digits}"
+
+
+def decode_cursor(cursor: str):
+    """Разбирает курсор, возвращает (направление, ID)"""
+    direction, raw = cursor[0], cursor[1:]
+    if direction not in ("n", "p") or not raw:
+        raise ValueError(f"Неверный курсор: {cursor}")
+    return direction, int(raw, 36)
+
+
+def render_id_page(index: SortedIdIndex, cursor: Optional[str], callback_prefix: str):
+    """Возвращает (ID на странице, кнопки навигации) для курсора из callback_data"""
+    if cursor is None:
+        ids = index.page_after(None, LIST_PAGE_SIZE)
+    else:
+        direction, value = decode_cursor(cursor)
+        if direction == "n":
+            ids = index.page_after(value, LIST_PAGE_SIZE)
+        else:
+            ids = index.page_before(value, LIST_PAGE_SIZE)
+    
+    navigation = []
+    if ids and index.has_before(ids[0]):
+        navigation.append(InlineKeyboardButton("⬅️ Назад", callback_data=f"{callback_prefix}{encode_cursor('p', ids[0])}"))
+    if ids and index.has_after(ids[-1]):
+        navigation.append(InlineKeyboardButton("Далее ➡️", callback_data=f"{callback_prefix}{encode_cursor('n', ids[-1])}"))
+    return ids, navigation
+
+
+# ==================== КЭШ МЕНЮ ====================
+
+# Тексты по умолчанию (могут быть переопределены в разделе "Управление текстами")
+DEFAULT_MESSAGES = {
+    'welcome': (
+        "👋 <b>Добро пожаловать!</b>\n\n"
+        "⚠️ Для использования бота необходимо подписаться на наши каналы.\n\n"
+        "Пожалуйста, подпишитесь на каналы ниже и нажмите кнопку проверки:"
+    ),
+    'success': (
+        "✅ <b>Отлично!</b>\n\n"
+        "Вы подписаны на все необходимые каналы!\n\n"
+        "Нажмите кнопку ниже для скачивания:"
+    ),
+    'error': (
+        "❌ <b>Подписка не найдена</b>\n\n"
+        "Пожалуйста, подпишитесь на каналы выше и нажмите кнопку проверки."
+    ),
+}
+
+
+class RenderCache:
+    """
+    Кэш готовых клавиатур и подписей для часто показываемых меню.
+
+    Элементы строятся один раз и сбрасываются только при изменении
+    channel_links, messages или settings.
+    """
+
+    def __init__(self):
+        self._items: Dict[str, object] = {}
+        self._sources = None
+        self.messages: Dict[str, str] = {}
+        self.settings: Dict = {}
+
+    def update_sources(self, channel_links: List[str], messages: Dict[str, str], settings: Dict):
+        """Сбрасывает кэш, если исходные данные изменились"""
+        sources = (channel_links, messages, settings)
+        if sources == self._sources:
+            return
+        self._sources = copy.deepcopy(sources)
+        self.messages = self._sources[1]
+        self.settings = self._sources[2]
+        self._items.clear()
+
+    def get(self, key: str, builder):
+        """Возвращает готовый элемент, при необходимости строит его"""
+        item = self._items.get(key)
+        if item is None:
+            item = builder()
+            self._items[key] = item
+        return item
+
+    def text(self, key: str) -> str:
+        """Текст из настроек или текст по умолчанию"""
+        return self.messages.get(key) or DEFAULT_MESSAGES[key]
+
+
+render_cache = RenderCache()
+
+
+def _build_subscribe_keyboard() -> InlineKeyboardMarkup:
+    """Строит клавиатуру с кнопками подписки и проверки"""
+    keyboard = []
+    for i, channel_link in enumerate(CHANNEL_LINKS, 1):
+        keyboard.append([InlineKeyboardButton(
+            f"📢 Подписаться на канал {i}",
+            url=channel_link
+        )])
+    
+    keyboard.append([InlineKeyboardButton("✅ Проверить подписку", callback_data="check_subscription")])
+    return InlineKeyboardMarkup(keyboard)
+
+
+def _build_admin_panel_keyboard() -> InlineKeyboardMarkup:
+    """Строит клавиатуру главного меню админ-панели"""
+    keyboard = [
+        [InlineKeyboardButton("📊 Статистика", callback_data="admin_stats")],
+        [InlineKeyboardButton("📢 Управление каналами", callback_data="admin_channels")],
+        [InlineKeyboardButton("🔗 Управление ссылками", callback_data="admin_links")],
+        [InlineKeyboardButton("📁 Управление файлами", callback_data="admin_files")],
+        [InlineKeyboardButton("👥 Управление админами", callback_data="admin_admins")],
+        [InlineKeyboardButton("👤 Просмотр пользователей", callback_data="admin_users")],
+        [InlineKeyboardButton("🚫 Бан/Разбан пользователей", callback_data="admin_ban")],
+        [InlineKeyboardButton("📝 Управление текстами", callback_data="admin_texts")],
+        [InlineKeyboardButton("🖼️ Управление изображениями", callback_data="admin_images")],
+        [InlineKeyboardButton("📨 Рассылка", callback_data="admin_broadcast")],
+        [InlineKeyboardButton("📋 Логи действий", callback_data="admin_logs")],
+        [InlineKeyboardButton("⚙️ Настройки бота", callback_data="admin_settings")],
+        [InlineKeyboardButton("💾 Экспорт/Импорт данных", callback_data="admin_export")],
+        [InlineKeyboardButton("🔙 Главное меню", callback_data="main_menu")]
+    ]
+    return InlineKeyboardMarkup(keyboard)
+
+
+def get_subscribe_keyboard() -> InlineKeyboardMarkup:
+    """Клавиатура с кнопками подписки и проверки"""
+    return render_cache.get('subscribe_keyboard', _build_subscribe_keyboard)
+
+
+def get_admin_panel_keyboard() -> InlineKeyboardMarkup:
+    """Клавиатура главного меню админ-панели"""
+    return render_cache.get('admin_panel_keyboard', _build_admin_panel_keyboard)
+
+
+def get_download_keyboard() -> InlineKeyboardMarkup:
+    """Клавиатура с кнопкой скачивания"""
+    return render_cache.get('download_keyboard', lambda: InlineKeyboardMarkup(
+        [[InlineKeyboardButton("📥 Скачать через бота", callback_data="download_here")]]
+    ))
+
+
+def get_back_to_main_keyboard() -> InlineKeyboardMarkup:
+    """Клавиатура с кнопкой возврата в главное меню"""
+    return render_cache.get('back_to_main_keyboard', lambda: InlineKeyboardMarkup(
+        [[InlineKeyboardButton("🔙 Главное меню", callback_data="main_menu")]]
+    ))
+
+
+def get_main_menu_render():
+    """Готовые подпись, клавиатура и изображение главного меню"""
+    return render_cache.get('main_menu', lambda: (
+        render_cache.text('welcome'),
+        get_subscribe_keyboard(),
+        "Preview.png"
+    ))
+
+
+# Загружаем настройки при запуске (только чтение: файл пишется, лишь если данные меняются)
+reload_config()
+
+
+def write_runtime_state(state: dict):
+    """Атомарно записывает оперативное состояние в файл"""
+    tmp_path = RUNTIME_STATE_FILE + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f, ensure_ascii=False, separators=(',', ':'))
+    os.replace(tmp_path, RUNTIME_STATE_FILE)
+
+
+def collect_runtime_state() -> Optional[dict]:
+    """
+    Снимок оперативного состояния, если оно изменилось с момента последнего сохранения.
+    Флаги изменений не сбрасываются: это делает mark_runtime_state_saved.
+    """
+    user_messages.purge_expired()
+    admin_states.purge_expired()
+    if not (user_messages.dirty or admin_states.dirty):
+        return None
+    return {
+        'user_messages': user_messages.to_records(),
+        'admin_states': admin_states.to_records()
+    }
+
+
+def mark_runtime_state_saved(saved: bool = True):
+    """Сбрасывает (или снова выставляет, если запись не удалась) флаги изменений"""
+    user_messages.dirty = not saved
+    admin_states.dirty = not saved
+
+
+def save_runtime_state() -> bool:
+    """Сохраняет оперативное состояние (синхронно, при остановке бота)"""
+    try:
+        state = collect_runtime_state()
+        if state is not None:
+            write_runtime_state(state)
+            mark_runtime_state_saved()
+        return True
+    except Exception as e:
+        logger.error(f"Ошибка при сохранении оперативного состояния: {e}")
+        return False
+
+
+def load_runtime_state():
+    """Восстанавливает последние сообщения и состояния админов после перезапуска"""
+    try:
+        if os.path.exists(RUNTIME_STATE_FILE):
+            with open(RUNTIME_STATE_FILE, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+            user_messages.load_records(state.get('user_messages', []))
+            admin_states.load_records(state.get('admin_states', []))
+            logger.info(f"Восстановлено состояние: {len(user_messages)} сообщений, {len(admin_states)} состояний админов")
+    except Exception as e:
+        logger.error(f"Ошибка при загрузке оперативного состояния: {e}")
+
+
+async def persist_runtime_state_job(context: ContextTypes.DEFAULT_TYPE):
+    """Периодически сохраняет оперативное состояние, запись выполняется в отдельном потоке"""
+    state = collect_runtime_state()
+    if state is None:
+        return
+    # Флаги сбрасываются до записи, чтобы изменения во время записи попали в следующий снимок
+    mark_runtime_state_saved()
+    try:
+        await asyncio.to_thread(write_runtime_state, state)
+    except Exception as e:
+        logger.error(f"Ошибка при сохранении оперативного состояния: {e}")
+        mark_runtime_state_saved(False)
+
+
+# ==================== СНИМКИ ДАННЫХ ====================
+
+# Каталог со снимками данных
+SNAPSHOT_DIR = "snapshots"
+
+# Как часто проверять изменения и дописывать дельту (секунды)
+SNAPSHOT_INTERVAL = 600
+
+# После скольких дельт делать новый полный снимок (компактизация)
+SNAPSHOT_COMPACT_DELTAS = 36
+
+# Сколько полных снимков (вместе с их дельтами) хранить
+SNAPSHOT_KEEP = 7
+
+# Списки, изменения которых хранятся в дельтах как добавленные/удаленные ID
+SNAPSHOT_LIST_KEYS = ('users', 'banned_users', 'admins')
+
+
+def fsync_dir(path: str):
+    """Сбрасывает на диск запись каталога (после переименования файла)"""
+    if sys.platform == 'win32':
+        return
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class SnapshotStore:
+    """
+    Периодические снимки bot_data.json.
+    
+    - Полный снимок (snapshot-<время>.json.gz) пишется атомарно: временный файл,
+      fsync и переименование
+    - Между полными снимками в snapshot-<время>.deltas.ndjson дописываются только
+      изменения: добавленные/удаленные ID для больших списков и новые значения настроек
+    - Каждые SNAPSHOT_COMPACT_DELTAS дельт делается новый полный снимок, старые
+      снимки сверх SNAPSHOT_KEEP удаляются
+    - Состояние последней точки хранит списки пользователей и банов как неизменяемые
+      CompactIdSet (см. snapshot_data): если списки не менялись, они ссылаются на тот же
+      массив, и сравнение не стоит ничего, иначе дельта - векторная разность массивов
+    Все методы, кроме list_points, работают с диском и вызываются в отдельном потоке.
+    """
+
+    def __init__(self, directory: str, compact_deltas: int = SNAPSHOT_COMPACT_DELTAS, keep: int = SNAPSHOT_KEEP):
+        self.directory = directory
+        self.compact_deltas = compact_deltas
+        self.keep = keep
+        self._state: Optional[dict] = None  # данные на момент последней точки восстановления
+        self._base: Optional[str] = None  # имя текущего полного снимка (без расширения)
+        self._deltas = 0
+        self._lock = threading.Lock()
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def _bases(self) -> List[str]:
+        """Имена полных снимков от старых к новым"""
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(name[:-len(".json.gz")] for name in os.listdir(self.directory)
+                      if name.startswith("snapshot-") and name.endswith(".json.gz"))
+
+    @staticmethod
+    def diff(old: dict, new: dict) -> dict:
+        """Изменения между двумя состояниями данных"""
+        delta = {}
+        lists = {}
+        for key in SNAPSHOT_LIST_KEYS:
+            old_items, new_items = old.get(key, []), new.get(key, [])
+            if isinstance(new_items, CompactIdSet):
+                if not isinstance(old_items, CompactIdSet):
+                    old_items = CompactIdSet(old_items)
+                added, removed = new_items.difference(old_items), old_items.difference(new_items)
+                if added or removed:
+                    lists[key] = {'add': added, 'remove': removed}
+                continue
+            if old_items == new_items:
+                continue
+            old_set, new_set = set(old_items), set(new_items)
+            lists[key] = {
+                'add': [item for item in new_items if item not in old_set],
+                'remove': [item for item in old_items if item not in new_set]
+            }
+        if lists:
+            delta['lists'] = lists
+        changed = {key: value for key, value in new.items()
+                   if key not in SNAPSHOT_LIST_KEYS and old.get(key) != value}
+        if changed:
+            delta['set'] = changed
+        removed = [key for key in old if key not in new and key not in SNAPSHOT_LIST_KEYS]
+        if removed:
+            delta['delete'] = removed
+        return delta
+
+    @staticmethod
+    def apply(state: dict, delta: dict) -> dict:
+        """Применяет дельту к состоянию"""
+        for key, change in delta.get('lists', {}).items():
+            if isinstance(state.get(key), CompactIdSet):
+                ids = state[key].frozen()
+                for item in change.get('remove', []):
+                    ids.discard(item)
+                for item in change.get('add', []):
+                    ids.add(item)
+                ids.compact()
+                state[key] = ids
+                continue
+            removed = set(change.get('remove', []))
+            items = [item for item in state.get(key, []) if item not in removed]
+            present = set(items)
+            items.extend(item for item in change.get('add', []) if item not in present)
+            state[key] = items
+        state.update(copy.deepcopy(delta.get('set', {})))
+        for key in delta.get('delete', []):
+            state.pop(key, None)
+        return state
+
+    def _read_full(self, base: str) -> dict:
+        """Полный снимок; списки пользователей и банов - в виде CompactIdSet"""
+        with gzip.open(self._path(base + ".json.gz"), 'rt', encoding='utf-8') as f:
+            state = json.load(f)
+        for key in USERS_KEYS:
+            state[key] = CompactIdSet(state.get(key, []))
+        return state
+
+    def _read_deltas(self, base: str) -> List[dict]:
+        path = self._path(base + ".deltas.ndjson")
+        if not os.path.exists(path):
+            return []
+        deltas = []
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    deltas.append(json.loads(line))
+                except ValueError:
+                    # Недописанная последняя строка после сбоя - дальше данных нет
+                    break
+        return deltas
+
+    def _write_full(self, data: dict):
+        os.makedirs(self.directory, exist_ok=True)
+        base = f"snapshot-{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}"
+        path = self._path(base + ".json.gz")
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'wb') as raw:
+            with gzip.GzipFile(fileobj=raw, mode='wb') as gz:
+                payload = {key: value.tolist() if isinstance(value, CompactIdSet) else value
+                           for key, value in data.items()}
+                gz.write(json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
+                del payload
+            raw.flush()
+            os.fsync(raw.fileno())
+        os.replace(tmp_path, path)
+        fsync_dir(self.directory)
+        
+        self._state = data
+        self._base = base
+        self._deltas = 0
+        self._prune()
+        logger.info(f"💾 Полный снимок данных: {base}")
+
+    def _append_delta(self, delta: dict):
+        delta['ts'] = int(time.time())
+        with open(self._path(self._base + ".deltas.ndjson"), 'a', encoding='utf-8') as f:
+            f.write(json.dumps(delta, ensure_ascii=False, separators=(',', ':')) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self._deltas += 1
+
+    def _prune(self):
+        """Удаляет снимки сверх лимита вместе с их дельтами"""
+        for base in self._bases()[:-self.keep]:
+            for suffix in (".json.gz", ".deltas.ndjson"):
+                try:
+                    os.remove(self._path(base + suffix))
+                except OSError:
+                    pass
+
+    def _resume(self):
+        """Восстанавливает цепочку последнего снимка после перезапуска"""
+        bases = self._bases()
+        if not bases:
+            return
+        base = bases[-1]
+        state = self._read_full(base)
+        deltas = self._read_deltas(base)
+        for delta in deltas:
+            self.apply(state, delta)
+        self._state, self._base, self._deltas = state, base, len(deltas)
+
+    def checkpoint(self, data: dict, full: bool = False) -> str:
+        """
+        Сохраняет точку восстановления. Возвращает 'full', 'delta' или 'unchanged'.
+        data - результат snapshot_data(), после вызова он принадлежит хранилищу.
+        """
+        with self._lock:
+            if self._state is None:
+                try:
+                    self._resume()
+                except Exception as e:
+                    logger.error(f"Ошибка при чтении последнего снимка: {e}")
+            if full or self._state is None or self._deltas >= self.compact_deltas:
+                self._write_full(data)
+                return 'full'
+            delta = self.diff(self._state, data)
+            if not delta:
+                return 'unchanged'
+            self._append_delta(delta)
+            self._state = data
+            return 'delta'
+
+    def list_points(self) -> List[tuple]:
+        """Точки восстановления от новых к старым: (снимок, количество дельт, время)"""
+        points = []
+        for base in self._bases():
+            stamp = datetime.strptime(base[len("snapshot-"):], '%Y%m%d-%H%M%S-%f')
+            points.append((base, 0, int(stamp.timestamp())))
+            for number, delta in enumerate(self._read_deltas(base), 1):
+                points.append((base, number, delta.get('ts', 0)))
+        points.reverse()
+        return points
+
+    def restore(self, base: str, delta_count: int) -> dict:
+        """Данные на момент точки восстановления"""
+        state = self._read_full(base)
+        for delta in self._read_deltas(base)[:delta_count]:
+            self.apply(state, delta)
+        return state
+
+
+snapshot_store = SnapshotStore(SNAPSHOT_DIR)
+
+
+def snapshot_data() -> dict:
+    """
+    Данные для точки восстановления: неизменяемый снимок настроек и замороженные
+    копии множеств пользователей и банов (без превращения в списки int).
+    Вызывается в потоке событий, результат можно передать в другой поток.
+    """
+    data = dict(current_config())
+    users_data = load_users_data()
+    for key in USERS_KEYS:
+        data[key] = users_data[key].frozen()
+    return data
+
+
+async def snapshot_job(context: ContextTypes.DEFAULT_TYPE):
+    """Периодически сохраняет дельту или полный снимок данных в отдельном потоке"""
+    try:
+        data = snapshot_data()
+        await asyncio.to_thread(snapshot_store.checkpoint, data)
+    except Exception as e:
+        logger.error(f"Ошибка при создании снимка данных: {e}")
+
+
+# ==================== ПРОФИЛИ ПОЛЬЗОВАТЕЛЕЙ ====================
+
+# Файл с профилями пользователей (имя, username, язык, первое и последнее появление)
+USER_PROFILES_FILE = "user_profiles.json"
+
+# Журнал изменений профилей: между полными сохранениями дописываются только измененные профили
+USER_PROFILES_JOURNAL = "user_profiles.changes.ndjson"
+
+# Как часто сохранять профили на диск (секунды)
+USER_PROFILES_SAVE_INTERVAL = 60
+
+
+class UserProfileStore:
+    """
+    Профили пользователей, собранные из входящих обновлений.
+    
+    Профиль: [username, first_name, last_name, language_code, first_seen, last_seen].
+    - Для поиска по префиксу поддерживается отсортированный список ключей (username
+      и слова имени в нижнем регистре). Ключи меняются только при смене имени или
+      username, обновление last_seen индекс не затрагивает
+    - Новые и удаленные ключи копятся в буферах и вливаются в список пачкой при
+      превышении KEY_BUFFER_LIMIT или перед поиском
+    - На диск пишутся только измененные профили (в журнал изменений); когда журнал
+      становится больше числа профилей, все профили переписываются в основной файл
+    """
+
+    USERNAME, FIRST_NAME, LAST_NAME, LANGUAGE, FIRST_SEEN, LAST_SEEN = range(6)
+
+    KEY_BUFFER_LIMIT = 1024
+
+    def __init__(self):
+        self._profiles: Dict[int, list] = {}
+        self._keys: List[tuple] = []  # (ключ, user_id), отсортирован
+        self._new_keys: List[tuple] = []  # добавленные ключи, еще не влитые в _keys
+        self._stale_keys: set = set()  # удаленные ключи, еще остающиеся в _keys
+        self._changed: set = set()  # ID профилей, измененных после последнего сохранения
+        self._journal_records = 0  # записей в журнале изменений после полного сохранения
+
+    @staticmethod
+    def _search_keys(profile: list) -> List[str]:
+        keys = []
+        if profile[0]:
+            keys.append(profile[0].lower())
+        for part in (profile[1], profile[2]):
+            if part:
+                keys.extend(word.lower() for word in part.split())
+        return keys
+
+    def _index(self, user_id: int, profile: list):
+        self._new_keys.extend((key, user_id) for key in self._search_keys(profile))
+        if len(self._new_keys) > self.KEY_BUFFER_LIMIT:
+            self._merge_keys()
+
+    def _unindex(self, user_id: int, profile: list):
+        for key in self._search_keys(profile):
+            try:
+                self._new_keys.remove((key, user_id))
+            except ValueError:
+                self._stale_keys.add((key, user_id))
+        if len(self._stale_keys) > self.KEY_BUFFER_LIMIT:
+            self._merge_keys()
+
+    def _merge_keys(self):
+        """Вливает буферы ключей в отсортированный список"""
+        if not self._new_keys and not self._stale_keys:
+            return
+        keys = self._keys
+        if self._stale_keys:
+            keys = [item for item in keys if item not in self._stale_keys]
+        self._keys = list(heapq.merge(keys, sorted(self._new_keys)))
+        self._new_keys = []
+        self._stale_keys = set()
+
+    def touch(self, user_id: int, username: Optional[str], first_name: Optional[str],
+              last_name: Optional[str], language_code: Optional[str]):
+        """Обновляет профиль по данным из обновления"""
+        now = int(time.time())
+        profile = self._profiles.get(user_id)
+        if profile is None:
+            profile = [username, first_name, last_name, language_code, now, now]
+            self._profiles[user_id] = profile
+            self._index(user_id, profile)
+        else:
+            if profile[0] != username or profile[1] != first_name or profile[2] != last_name:
+                self._unindex(user_id, profile)
+                profile[0], profile[1], profile[2] = username, first_name, last_name
+                self._index(user_id, profile)
+            profile[3] = language_code or profile[3]
+            profile[5] = now
+        self._changed.add(user_id)
+
+    def get(self, user_id: int) -> Optional[list]:
+        """Профиль пользователя или None"""
+        return self._profiles.get(user_id)
+
+    def __len__(self) -> int:
+        return len(self._profiles)
+
+    def search(self, text: str, limit: int = 20) -> List[int]:
+        """ID пользователей, у которых username или слово имени начинается с text"""
+        prefix = text.strip().lstrip('@').lower()
+        if not prefix:
+            return []
+        self._merge_keys()
+        found = []
+        i = bisect.bisect_left(self._keys, (prefix,))
+        while i < len(self._keys) and len(found) < limit:
+            key, user_id = self._keys[i]
+            if not key.startswith(prefix):
+                break
+            if user_id not in found:
+                found.append(user_id)
+            i += 1
+        return found
+
+    def snapshot(self) -> Optional[tuple]:
+        """
+        Изменения для сохранения: (full, записи) или None, если профили не менялись.
+        full=True - записи всех профилей для основного файла, иначе только измененные.
+        """
+        if not self._changed:
+            return None
+        full = self._journal_records + len(self._changed) >= len(self._profiles)
+        user_ids = self._profiles if full else self._changed
+        records = [[user_id] + self._profiles[user_id] for user_id in user_ids]
+        self._journal_records = 0 if full else self._journal_records + len(records)
+        self._changed = set()
+        return full, records
+
+    def requeue(self, records: list):
+        """Возвращает несохраненные записи в очередь на сохранение"""
+        self._changed.update(record[0] for record in records)
+
+    @staticmethod
+    def write(full: bool, records: list):
+        """Атомарно переписывает основной файл (и удаляет журнал) или дописывает изменения в журнал"""
+        if not full:
+            with open(USER_PROFILES_JOURNAL, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(records, ensure_ascii=False, separators=(',', ':')) + "\n")
+            return
+        tmp_path = USER_PROFILES_FILE + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(records, f, ensure_ascii=False, separators=(',', ':'))
+        os.replace(tmp_path, USER_PROFILES_FILE)
+        try:
+            os.remove(USER_PROFILES_JOURNAL)
+        except OSError:
+            pass
+
+    @staticmethod
+    def _read_journal() -> List[list]:
+        """Записи журнала изменений, сделанные после записи основного файла"""
+        try:
+            journal_mtime = os.stat(USER_PROFILES_JOURNAL).st_mtime_ns
+        except OSError:
+            return []
+        # Журнал старше основного файла - сбой между записью файла и удалением журнала
+        if os.path.exists(USER_PROFILES_FILE) and journal_mtime < os.stat(USER_PROFILES_FILE).st_mtime_ns:
+            return []
+        records = []
+        with open(USER_PROFILES_JOURNAL, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    records.extend(json.loads(line))
+                except ValueError:
+                    # Недописанная последняя строка после сбоя - дальше данных нет
+                    break
+        return records
+
+    def load(self):
+        """Загружает профили из файла и журнала изменений и строит индекс поиска"""
+        try:
+            records = []
+            if os.path.exists(USER_PROFILES_FILE):
+                with open(USER_PROFILES_FILE, 'r', encoding='utf-8') as f:
+                    records = json.load(f)
+            journal = self._read_journal()
+            self._profiles = {record[0]: record[1:] for record in records}
+            self._profiles.update((record[0], record[1:]) for record in journal)
+            self._keys = sorted(
+                (key, user_id)
+                for user_id, profile in self._profiles.items()
+                for key in self._search_keys(profile)
+            )
+            self._new_keys = []
+            self._stale_keys = set()
+            self._changed = set()
+            self._journal_records = len(journal)
+            if self._profiles:
+                logger.info(f"Загружено профилей пользователей: {len(self._profiles)}")
+        except Exception as e:
+            logger.error(f"Ошибка при загрузке профилей пользователей: {e}")
+
+    def save(self):
+        """Сохраняет профили синхронно (при остановке бота)"""
+        changes = self.snapshot()
+        if changes is None:
+            return
+        try:
+            self.write(*changes)
+        except Exception as e:
+            logger.error(f"Ошибка при сохранении профилей пользователей: {e}")
+
+
+user_profiles = UserProfileStore()
+
+
+async def track_user_profile(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Запоминает профиль отправителя каждого обновления"""
+    user = update.effective_user
+    if user is None or user.is_bot:
+        return
+    user_profiles.touch(user.id, user.username, user.first_name, user.last_name, user.language_code)
+    bot_stats.record_active(user.id)
+
+
+async def persist_user_profiles_job(context: ContextTypes.DEFAULT_TYPE):
+    """Периодически сохраняет измененные профили пользователей в отдельном потоке"""
+    changes = user_profiles.snapshot()
+    if changes is None:
+        return
+    try:
+        await asyncio.to_thread(UserProfileStore.write, *changes)
+    except Exception as e:
+        logger.error(f"Ошибка при сохранении профилей пользователей: {e}")
+        user_profiles.requeue(changes[1])
+
+
+def format_user_profile(user_id: int) -> str:
+    """Строки с данными профиля для карточки пользователя"""
+    profile = user_profiles.get(user_id)
+    if profile is None:
+        return ""
+    text = ""
+    full_name = " ".join(part for part in (profile[1], profile[2]) if part)
+    if full_name:
+        text += f"📛 Имя: {html.escape(full_name)}\n"
+    if profile[0]:
+        text += f"👤 Username: @{profile[0]}\n"
+    if profile[3]:
+        text += f"🌐 Язык: {profile[3]}\n"
+    text += f"🕐 Первый визит: {datetime.fromtimestamp(profile[4]).strftime('%Y-%m-%d %H:%M')}\n"
+    text += f"🕑 Последний визит: {datetime.fromtimestamp(profile[5]).strftime('%Y-%m-%d %H:%M')}\n"
+    return text
+
+
+class ChatInfoCache:
+    """
+    Общий кэш результатов get_chat с ограниченным сроком жизни.
+    
+    Одновременные запросы одного чата объединяются в один вызов API,
+    неудачные запросы кэшируются на короткое время.
+    """
+
+    def __init__(self, ttl: float = 600, error_ttl: float = 60, max_size: int = 5000):
+        self._chats = BoundedStore(max_size=max_size, ttl=ttl)
+        self._errors = BoundedStore(max_size=max_size, ttl=error_ttl)
+        self._pending: Dict[int, asyncio.Future] = {}
+
+    async def get(self, bot, chat_id: int):
+        """Возвращает Chat или None, если получить информацию не удалось"""
+        chat = self._chats.get(chat_id)
+        if chat is not None:
+            return chat
+        if chat_id in self._errors:
+            return None
+        
+        pending = self._pending.get(chat_id)
+        if pending is None:
+            pending = asyncio.ensure_future(self._fetch(bot, chat_id))
+            self._pending[chat_id] = pending
+            pending.add_done_callback(lambda _: self._pending.pop(chat_id, None))
+        return await asyncio.shield(pending)
+
+    async def _fetch(self, bot, chat_id: int):
+        try:
+            chat = await bot.get_chat(chat_id)
+        except Exception as e:
+            logger.warning(f"Не удалось получить информацию о пользователе {chat_id}: {e}")
+            self._errors[chat_id] = True
+            return None
+        self._chats[chat_id] = chat
+        return chat
+
+    async def get_many(self, bot, chat_ids: List[int]) -> Dict[int, object]:
+        """Получает информацию о нескольких чатах параллельно"""
+        results = await asyncio.gather(*(self.get(bot, chat_id) for chat_id in chat_ids))
+        return dict(zip(chat_ids, results))
+
+    def invalidate(self, chat_id: int):
+        """Удаляет чат из кэша"""
+        self._chats.pop(chat_id)
+        self._errors.pop(chat_id)
+
+
+# Кэш get_chat для меню админов, добавления админа и поиска пользователя
+chat_info_cache = ChatInfoCache()
+
+
+# ==================== СТАТИСТИКА ====================
+
+# Файл со счетчиками статистики
+STATS_FILE = "bot_stats.json"
+
+# Как часто сохранять статистику на диск (секунды)
+STATS_SAVE_INTERVAL = 60
+
+
+class RingSeries:
+    """Кольцевой буфер счетчиков по интервалам времени фиксированной длины"""
+
+    def __init__(self, width: int, size: int):
+        self.width = width
+        self.size = size
+        self._counts = [0] * size
+        self._bucket: Optional[int] = None  # номер текущего интервала
+
+    def _advance(self, now: float) -> bool:
+        """Переходит к интервалу, содержащему now. Возвращает True, если интервал сменился"""
+        bucket = int(now // self.width)
+        if self._bucket is None:
+            self._bucket = bucket
+            return True
+        gap = bucket - self._bucket
+        if gap <= 0:
+            return False
+        for i in range(1, min(gap, self.size) + 1):
+            self._counts[(self._bucket + i) % self.size] = 0
+        self._bucket = bucket
+        return True
+
+    def add(self, n: int = 1, now: Optional[float] = None):
+        """Увеличивает счетчик текущего интервала"""
+        self._advance(time.time() if now is None else now)
+        self._counts[self._bucket % self.size] += n
+
+    def values(self, now: Optional[float] = None) -> List[int]:
+        """Значения от самого старого интервала к текущему"""
+        self._advance(time.time() if now is None else now)
+        return [self._counts[(self._bucket - i) % self.size] for i in range(self.size - 1, -1, -1)]
+
+    def total(self, last: Optional[int] = None) -> int:
+        """Сумма за последние last интервалов (или за все)"""
+        values = self.values()
+        return sum(values[-last:] if last else values)
+
+    def current(self) -> int:
+        """Значение текущего интервала"""
+        return self.values()[-1]
+
+    def to_dict(self) -> dict:
+        return {'bucket': self._bucket, 'counts': self._counts}
+
+    def load_dict(self, state: dict):
+        counts = state.get('counts', [])
+        if len(counts) == self.size:
+            self._counts = counts
+            self._bucket = state.get('bucket')
+
+
+class UniqueRingSeries(RingSeries):
+    """Кольцевой буфер количества уникальных пользователей за интервал"""
+
+    def __init__(self, width: int, size: int):
+        super().__init__(width, size)
+        self._seen = set()  # пользователи текущего интервала (сохраняются вместе со счетчиками)
+
+    def _advance(self, now: float) -> bool:
+        changed = super()._advance(now)
+        if changed:
+            self._seen = set()
+        return changed
+
+    def add_unique(self, user_id: int, now: Optional[float] = None):
+        """Учитывает пользователя один раз за интервал"""
+        self._advance(time.time() if now is None else now)
+        if user_id not in self._seen:
+            self._seen.add(user_id)
+            self._counts[self._bucket % self.size] += 1
+
+    def to_dict(self) -> dict:
+        state = super().to_dict()
+        state['seen'] = list(self._seen)
+        return state
+
+    def load_dict(self, state: dict):
+        super().load_dict(state)
+        if self._bucket == state.get('bucket'):
+            self._seen = set(state.get('seen', []))
+
+
+class BotStats:
+    """
+    Счетчики событий бота.
+    
+    Для каждого события хранятся поминутный буфер за последний час и посуточный
+    за последние 30 дней, так что экран статистики не перебирает данные.
+    """
+
+    EVENTS = ('new_users', 'sub_pass', 'sub_fail', 'downloads', 'broadcasts')
+
+    def __init__(self):
+        self.started_at = time.time()
+        self.minute = {name: RingSeries(60, 60) for name in self.EVENTS}
+        self.day = {name: RingSeries(86400, 30) for name in self.EVENTS}
+        self.active_minute = UniqueRingSeries(60, 60)
+        self.active_day = UniqueRingSeries(86400, 30)
+        self.dirty = False
+        self._active_key = None
+        self._active_count = 0
+
+    def record(self, event: str, n: int = 1):
+        """Учитывает событие"""
+        self.minute[event].add(n)
+        self.day[event].add(n)
+        self.dirty = True
+
+    def record_active(self, user_id: int):
+        """Учитывает активность пользователя"""
+        self.active_minute.add_unique(user_id)
+        self.active_day.add_unique(user_id)
+        self.dirty = True
+
+    def active_users(self) -> int:
+        """Пользователи, которые не забанены (пересчитывается только при изменении списков)"""
+        users = users_index.ensure()
+        banned = banned_index.ensure()
+        key = (users_index.version, banned_index.version)
+        if key != self._active_key:
+            self._active_count = users.difference_count(banned)
+            self._active_key = key
+        return self._active_count
+
+    def snapshot(self) -> Optional[dict]:
+        """Состояние для сохранения, если счетчики изменились"""
+        if not self.dirty:
+            return None
+        self.dirty = False
+        return {
+            'minute': {name: series.to_dict() for name, series in self.minute.items()},
+            'day': {name: series.to_dict() for name, series in self.day.items()},
+            'active_minute': self.active_minute.to_dict(),
+            'active_day': self.active_day.to_dict()
+        }
+
+    @staticmethod
+    def write(state: dict):
+        """Атомарно записывает счетчики в файл"""
+        tmp_path = STATS_FILE + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(state, f, separators=(',', ':'))
+        os.replace(tmp_path, STATS_FILE)
+
+    def load(self):
+        """Загружает счетчики из файла"""
+        try:
+            if not os.path.exists(STATS_FILE):
+                return
+            with open(STATS_FILE, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+            for name, series in self.minute.items():
+                series.load_dict(state.get('minute', {}).get(name, {}))
+            for name, series in self.day.items():
+                series.load_dict(state.get('day', {}).get(name, {}))
+            self.active_minute.load_dict(state.get('active_minute', {}))
+            self.active_day.load_dict(state.get('active_day', {}))
+        except Exception as e:
+            logger.error(f"Ошибка при загрузке статистики: {e}")
+
+    def save(self):
+        """Сохраняет счетчики синхронно (при остановке бота)"""
+        try:
+            state = self.snapshot()
+            if state is not None:
+                self.write(state)
+        except Exception as e:
+            logger.error(f"Ошибка при сохранении статистики: {e}")
+
+
+bot_stats = BotStats()
+
+
+async def persist_stats_job(context: ContextTypes.DEFAULT_TYPE):
+    """Периодически сохраняет статистику в отдельном потоке"""
+    state = bot_stats.snapshot()
+    if state is None:
+        return
+    try:
+        await asyncio.to_thread(BotStats.write, state)
+    except Exception as e:
+        logger.error(f"Ошибка при сохранении статистики: {e}")
+        bot_stats.dirty = True
+
+
+# Файл с данными воронки
+FUNNEL_FILE = "funnel_stats.json"
+
+# Сколько дней хранить данные воронки
+FUNNEL_RETENTION_DAYS = 90
+
+# Этапы воронки по порядку
+FUNNEL_STAGES = ('start', 'check', 'pass', 'download')
+
+FUNNEL_STAGE_NAMES = {
+    'start': "🚀 Старт",
+    'check': "🔍 Проверка",
+    'pass': "✅ Подписан",
+    'download': "📥 Скачивание"
+}
+
+
+class FunnelStats:
+    """
+    Воронка конверсии: старт → проверка подписки → подписан → скачивание.
+    
+    События копятся в словарях в памяти (одно увеличение счетчика на событие)
+    и периодически переносятся в посуточные итоги, которые сохраняются на диск.
+    """
+
+    def __init__(self):
+        self.pending = dict.fromkeys(FUNNEL_STAGES, 0)
+        self.pending_channels: Dict[tuple, int] = {}  # (канал, подписан) -> количество
+        self.days: Dict[str, dict] = {}  # 'YYYY-MM-DD' -> {'stages': {...}, 'channels': {канал: [подписан, всего]}}
+        self.dirty = False
+
+    def record(self, stage: str):
+        """Учитывает прохождение этапа"""
+        self.pending[stage] += 1
+
+    def record_channel(self, channel, subscribed: bool):
+        """Учитывает результат проверки подписки на канал"""
+        key = (str(channel), subscribed)
+        self.pending_channels[key] = self.pending_channels.get(key, 0) + 1
+
+    def flush(self) -> bool:
+        """Переносит накопленные события в итоги текущего дня. Возвращает True, если были события"""
+        pending, self.pending = self.pending, dict.fromkeys(FUNNEL_STAGES, 0)
+        pending_channels, self.pending_channels = self.pending_channels, {}
+        if not any(pending.values()) and not pending_channels:
+            return False
+        
+        today = datetime.now().strftime('%Y-%m-%d')
+        day = self.days.setdefault(today, {'stages': dict.fromkeys(FUNNEL_STAGES, 0), 'channels': {}})
+        for stage, count in pending.items():
+            day['stages'][stage] = day['stages'].get(stage, 0) + count
+        for (channel, subscribed), count in pending_channels.items():
+            totals = day['channels'].setdefault(channel, [0, 0])
+            if subscribed:
+                totals[0] += count
+            totals[1] += count
+        
+        # Удаляем старые дни
+        if len(self.days) > FUNNEL_RETENTION_DAYS:
+            for old_day in sorted(self.days)[:-FUNNEL_RETENTION_DAYS]:
+                del self.days[old_day]
+        self.dirty = True
+        return True
+
+    def totals(self, days: int) -> tuple:
+        """Итоги по этапам и каналам за последние days дней (включая еще не перенесенные события)"""
+        self.flush()
+        stages = dict.fromkeys(FUNNEL_STAGES, 0)
+        channels: Dict[str, list] = {}
+        for day in sorted(self.days)[-days:]:
+            for stage, count in self.days[day]['stages'].items():
+                stages[stage] = stages.get(stage, 0) + count
+            for channel, (passed, total) in self.days[day]['channels'].items():
+                channel_totals = channels.setdefault(channel, [0, 0])
+                channel_totals[0] += passed
+                channel_totals[1] += total
+        return stages, channels
+
+    def to_csv(self) -> bytes:
+        """Посуточные данные воронки в формате CSV"""
+        self.flush()
+        output = StringIO()
+        writer = csv.writer(output)
+        writer.writerow(['date', 'kind', 'name', 'count', 'passed'])
+        for day in sorted(self.days):
+            for stage in FUNNEL_STAGES:
+                writer.writerow([day, 'stage', stage, self.days[day]['stages'].get(stage, 0), ''])
+            for channel, (passed, total) in sorted(self.days[day]['channels'].items()):
+                writer.writerow([day, 'channel', channel, total, passed])
+        return output.getvalue().encode('utf-8-sig')
+
+    def snapshot(self) -> Optional[dict]:
+        """Состояние для сохранения, если были новые события"""
+        self.flush()
+        if not self.dirty:
+            return None
+        self.dirty = False
+        return {'days': copy.deepcopy(self.days)}
+
+    @staticmethod
+    def write(state: dict):
+        """Атомарно записывает данные воронки в файл"""
+        tmp_path = FUNNEL_FILE + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(state, f, ensure_ascii=False, separators=(',', ':'))
+        os.replace(tmp_path, FUNNEL_FILE)
+
+    def load(self):
+        """Загружает данные воронки из файла"""
+        try:
+            if not os.path.exists(FUNNEL_FILE):
+                return
+            with open(FUNNEL_FILE, 'r', encoding='utf-8') as f:
+                self.days = json.load(f).get('days', {})
+        except Exception as e:
+            logger.error(f"Ошибка при загрузке данных воронки: {e}")
+
+    def save(self):
+        """Сохраняет данные воронки синхронно (при остановке бота)"""
+        try:
+            state = self.snapshot()
+            if state is not None:
+                self.write(state)
+        except Exception as e:
+            logger.error(f"Ошибка при сохранении данных воронки: {e}")
+
+
+funnel_stats = FunnelStats()
+
+
+async def persist_funnel_job(context: ContextTypes.DEFAULT_TYPE):
+    """Периодически переносит события воронки в итоги и сохраняет их в отдельном потоке"""
+    state = funnel_stats.snapshot()
+    if state is None:
+        return
+    try:
+        await asyncio.to_thread(FunnelStats.write, state)
+    except Exception as e:
+        logger.error(f"Ошибка при сохранении данных воронки: {e}")
+        funnel_stats.dirty = True
+
+
+def sparkline(values: List[int]) -> str:
+    """Мини-график из символов для ряда значений"""
+    blocks = "▁▂▃▄▅▆▇█"
+    peak = max(values) if values else 0
+    if not peak:
+        return blocks[0] * len(values)
+    return "".join(blocks[min(len(blocks) - 1, value * (len(blocks) - 1) // peak)] for value in values)
+
+
+def format_uptime(seconds: float) -> str:
+    """Время работы в виде 1д 2ч 3м"""
+    minutes, _ = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    days, hours = divmod(hours, 24)
+    if days:
+        return f"{days}д {hours}ч {minutes}м"
+    if hours:
+        return f"{hours}ч {minutes}м"
+    return f"{minutes}м"
+
+
+# ==================== МАРШРУТИЗАЦИЯ CALLBACK ====================
+
+# Нажатия, на которые уже ответили (query.id -> True): Telegram принимает один ответ на нажатие
+answered_queries = BoundedStore(max_size=10_000, ttl=60)
+
+
+async def answer_query(query, text: Optional[str] = None, show_alert: bool = False) -> bool:
+    """Отвечает на нажатие, если на него еще не отвечали. Возвращает True, если ответ отправлен"""
+    if query.id in answered_queries:
+        return False
+    answered_queries[query.id] = True
+    try:
+        await query.answer(text, show_alert=show_alert)
+        return True
+    except Exception as e:
+        logger.warning(f"Ошибка при ответе на callback query: {e}")
+        return False
+
+
+class CallbackRoute:
+    """Маршрут callback_data: обработчик, параметр и статистика вызовов"""
+
+    __slots__ = ('pattern', 'handler', 'admin', 'answer', 'param', 'converter', 'calls', 'total_time', 'max_time')
+
+    def __init__(self, pattern: str, handler, admin: bool = False, answer: bool = True,
+                 param: Optional[str] = None, converter=None):
+        self.pattern = pattern
+        self.handler = handler
+        self.admin = admin
+        self.answer = answer
+        self.param = param
+        self.converter = converter
+        self.calls = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+
+    def record(self, elapsed: float):
+        """Учитывает время одного вызова"""
+        self.calls += 1
+        self.total_time += elapsed
+        if elapsed > self.max_time:
+            self.max_time = elapsed
+
+
+class CallbackRouter:
+    """
+    Маршрутизатор callback_data.
+
+    - Точные маршруты ("admin_stats") хранятся в словаре - поиск за O(1)
+    - Маршруты с параметром ("admin_remove_{admin_id:int}") хранятся в префиксном дереве,
+      выбирается самый длинный подходящий префикс, остаток строки разбирается в параметр
+    - admin=True - маршрут доступен только администраторам, проверка делается здесь
+    - На нажатие отвечает маршрутизатор до вызова обработчика. answer=False - обработчик
+      сам отвечает через answer_query (например, всплывающим уведомлением), а если не
+      ответил, маршрутизатор ответит после него
+    """
+
+    CONVERTERS = {'int': int, 'str': str}
+
+    def __init__(self):
+        self._exact: Dict[str, CallbackRoute] = {}
+        self._trie: Dict = {}
+        self.lookups = 0
+        self.lookup_time = 0.0
+
+    def route(self, pattern: str, admin: bool = False, answer: bool = True):
+        """Декоратор для декларативной регистрации обработчика"""
+        def decorator(handler):
+            self.add(pattern, handler, admin=admin, answer=answer)
+            return handler
+        return decorator
+
+    def add(self, pattern: str, handler, admin: bool = False, answer: bool = True):
+        """Регистрирует обработчик для шаблона callback_data"""
+        if '{' not in pattern:
+            if pattern in self._exact:
+                raise ValueError(f"Маршрут {pattern} уже зарегистрирован")
+            self._exact[pattern] = CallbackRoute(pattern, handler, admin, answer)
+            return
+
+        prefix, _, spec = pattern.partition('{')
+        if not prefix or not spec.endswith('}'):
+            raise ValueError(f"Неверный шаблон маршрута: {pattern}")
+        param, _, converter_name = spec[:-1].partition(':')
+        converter = self.CONVERTERS[converter_name or 'str']
+
+        node = self._trie
+        for char in prefix:
+            node = node.setdefault(char, {})
+        if None in node:
+            raise ValueError(f"Маршрут {pattern} уже зарегистрирован")
+        node[None] = CallbackRoute(pattern, handler, admin, answer, param, converter)
+
+    def resolve(self, data: str):
+        """Находит маршрут и параметры для callback_data, либо None"""
+        route = self._exact.get(data)
+        if route is not None:
+            return route, {}
+
+        # Спускаемся по дереву, запоминая все префиксы, у которых есть маршрут
+        matches = []
+        node = self._trie
+        for i, char in enumerate(data):
+            node = node.get(char)
+            if node is None:
+                break
+            if None in node:
+                matches.append((node[None], i + 1))
+
+        # Пробуем от самого длинного префикса к короткому
+        for route, end in reversed(matches):
+            raw_value = data[end:]
+            if not raw_value:
+                continue
+            try:
+                return route, {route.param: route.converter(raw_value)}
+            except ValueError:
+                continue
+        return None
+
+    async def dispatch(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> bool:
+        """Вызывает обработчик для нажатой кнопки. Возвращает False, если маршрут не найден"""
+        query = update.callback_query
+        started = time.perf_counter()
+        resolved = self.resolve(query.data or "")
+        self.lookups += 1
+        self.lookup_time += time.perf_counter() - started
+
+        if resolved is None:
+            logger.warning(f"Неизвестный callback: {query.data}")
+            await answer_query(query)
+            return False
+
+        route, params = resolved
+        if route.admin and not is_admin(query.from_user.id):
+            await answer_query(query, "❌ У вас нет доступа", show_alert=True)
+            return True
+
+        if route.answer:
+            await answer_query(query)
+        try:
+            await route.handler(update, context, **params)
+        finally:
+            if not route.answer:
+                await answer_query(query)
+            elapsed = time.perf_counter() - started
+            route.record(elapsed)
+            if elapsed > 1.0:
+                logger.warning(f"Медленный callback {route.pattern}: {elapsed:.2f} сек")
+        return True
+
+    def routes(self) -> List[CallbackRoute]:
+        """Возвращает все зарегистрированные маршруты"""
+        result = list(self._exact.values())
+        stack = [self._trie]
+        while stack:
+            node = stack.pop()
+            for key, value in node.items():
+                if key is None:
+                    result.append(value)
+                else:
+                    stack.append(value)
+        return result
+
+    def format_stats(self, limit: int = 5) -> str:
+        """Текстовая сводка по самым медленным маршрутам"""
+        avg_lookup_us = (self.lookup_time / self.lookups * 1_000_000) if self.lookups else 0.0
+        lines = [f"   • Поиск маршрута: <b>{avg_lookup_us:.1f}</b> мкс (вызовов: {self.lookups})"]
+        called = [r for r in self.routes() if r.calls]
+        called.sort(key=lambda r: r.total_time / r.calls, reverse=True)
+        for route in called[:limit]:
+            avg_ms = route.total_time / route.calls * 1000
+            lines.append(f"   • {route.pattern}: {avg_ms:.0f} мс (макс. {route.max_time * 1000:.0f} мс, x{route.calls})")
+        return "\n".join(lines)
+
+
+# Таблица маршрутов для всех inline-кнопок
+callback_router = CallbackRouter()
+
+
+# ==================== ЗАЩИТА ВЫЗОВОВ TELEGRAM ====================
+
+# Таймауты ответа по методам Bot API (секунды): проверки и меню - короткие, долгие - только загрузки.
+# Для остальных методов - TELEGRAM_READ_TIMEOUT
+API_TIMEOUTS = {
+    'getChatMember': 3.0,
+    'getChat': 5.0,
+    'answerCallbackQuery': 3.0,
+    'sendMessage': 10.0,
+    'editMessageText': 10.0,
+    'editMessageCaption': 10.0,
+    'editMessageReplyMarkup': 10.0,
+    'deleteMessage': 10.0,
+    'getFile': 10.0,
+    'sendPhoto': 30.0,
+    'editMessageMedia': 60.0,
+    'sendDocument': 120.0
+}
+
+# Сколько сбоев подряд открывают автомат и на сколько секунд
+CIRCUIT_FAILURE_THRESHOLD = 5
+CIRCUIT_RESET_TIMEOUT = 30.0
+
+# Сообщение пользователю, когда вызовы Telegram временно приостановлены
+API_UNAVAILABLE_TEXT = "⏳ Telegram сейчас отвечает с задержками. Попробуйте еще раз через минуту."
+
+
+class CircuitOpenError(NetworkError):
+    """Вызов отклонен без обращения к Telegram: автомат защиты открыт"""
+
+    def __init__(self, name: str):
+        super().__init__(f"вызовы {name} временно приостановлены после серии сбоев")
+        self.name = name
+
+
+class CircuitBreaker:
+    """
+    Автомат защиты для одного метода Bot API или канала.
+    
+    - closed: вызовы проходят, сбои подряд считаются
+    - open: после failure_threshold сбоев подряд вызовы сразу отклоняются
+    - half-open: через reset_timeout пропускается один пробный вызов,
+      успех закрывает автомат, сбой снова открывает
+    """
+
+    def __init__(self, name: str, failure_threshold: int = CIRCUIT_FAILURE_THRESHOLD,
+                 reset_timeout: float = CIRCUIT_RESET_TIMEOUT):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = 'closed'
+        self.failures = 0
+        self.trips = 0
+        self.opened_at = 0.0
+        self._probing = False
+
+    def is_open(self) -> bool:
+        """Вызов сейчас был бы отклонен"""
+        if self.state == 'closed':
+            return False
+        if self.state == 'open':
+            return time.monotonic() - self.opened_at < self.reset_timeout
+        return self._probing
+
+    def allow(self) -> bool:
+        """Разрешает вызов (в half-open - только один пробный)"""
+        if self.state == 'closed':
+            return True
+        if self.state == 'open':
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                return False
+            self.state = 'half-open'
+        if self._probing:
+            return False
+        self._probing = True
+        return True
+
+    def success(self):
+        """Вызов завершился (Telegram ответил)"""
+        if self.state != 'closed':
+            logger.info(f"✅ {self.name}: вызовы Telegram восстановлены")
+        self.state = 'closed'
+        self.failures = 0
+        self._probing = False
+
+    def failure(self):
+        """Вызов не удался из-за сети или Telegram"""
+        self.failures += 1
+        self._probing = False
+        if self.state == 'half-open' or self.failures >= self.failure_threshold:
+            if self.state != 'open':
+                self.trips += 1
+                logger.warning(f"🔌 {self.name}: {self.failures} сбоев подряд - "
+                               f"вызовы приостановлены на {self.reset_timeout:.0f} с")
+            self.state = 'open'
+            self.opened_at = time.monotonic()
+
+    def cancel(self):
+        """Вызов отменен - пробный вызов можно повторить"""
+        self._probing = False
+
+
+class ApiGuard:
+    """Автоматы защиты по методам Bot API и по каналам"""
+
+    def __init__(self):
+        self.breakers: Dict[str, CircuitBreaker] = {}
+
+    def breaker(self, key: str) -> CircuitBreaker:
+        """Автомат для метода или канала"""
+        breaker = self.breakers.get(key)
+        if breaker is None:
+            breaker = self.breakers[key] = CircuitBreaker(key)
+        return breaker
+
+    @staticmethod
+    def channel_key(chat_id) -> Optional[str]:
+        """Ключ автомата канала (None для личных чатов)"""
+        if isinstance(chat_id, str) and chat_id.startswith('@'):
+            return f"chat:{chat_id.lower()}"
+        try:
+            if int(chat_id) < 0:
+                return f"chat:{int(chat_id)}"
+        except (TypeError, ValueError):
+            pass
+        return None
+
+    def breakers_for(self, endpoint: str, chat_id) -> List[CircuitBreaker]:
+        """Автоматы, через которые проходит вызов"""
+        breakers = [self.breaker(endpoint)]
+        channel_key = self.channel_key(chat_id)
+        if channel_key:
+            breakers.append(self.breaker(channel_key))
+        return breakers
+
+    def is_open(self, key: str) -> bool:
+        """Вызовы метода или канала сейчас отклоняются"""
+        breaker = self.breakers.get(key)
+        return breaker is not None and breaker.is_open()
+
+    def is_channel_open(self, chat_id) -> bool:
+        """Вызовы к каналу сейчас отклоняются"""
+        channel_key = self.channel_key(chat_id)
+        return channel_key is not None and self.is_open(channel_key)
+
+    def check(self, key: str):
+        """Сразу отклоняет операцию, если вызовы метода приостановлены"""
+        if self.is_open(key):
+            raise CircuitOpenError(key)
+
+    def format_status(self) -> str:
+        """Текстовая сводка по автоматам для экрана статистики"""
+        opened = [b for b in self.breakers.values() if b.state != 'closed']
+        trips = sum(b.trips for b in self.breakers.values())
+        lines = [f"   • Срабатываний защиты: <b>{trips}</b>"]
+        for breaker in opened:
+            lines.append(f"   • 🔌 {breaker.name}: {breaker.state} ({breaker.failures} сбоев)")
+        return "\n".join(lines)
+
+
+api_guard = ApiGuard()
+
+
+def is_dependency_failure(error: BaseException) -> bool:
+    """Сбой сети или Telegram (а не ошибка запроса вроде BadRequest или нехватка своих соединений)"""
+    return (isinstance(error, NetworkError)
+            and not isinstance(error, (BadRequest, PoolExhaustedError)))
+
+
+# ==================== ОЧЕРЕДЬ ИСХОДЯЩИХ ВЫЗОВОВ ====================
+
+# Классы исходящих вызовов в порядке приоритета
+PRIORITY_INTERACTIVE = 0  # ответы пользователям и админам
+PRIORITY_CHECKS = 1       # проверки подписки и каналов
+PRIORITY_BULK = 2         # рассылка
+PRIORITY_NAMES = {PRIORITY_INTERACTIVE: "ответы", PRIORITY_CHECKS: "проверки", PRIORITY_BULK: "рассылка"}
+
+# Общий бюджет отправки сообщений (сообщений в секунду и допустимый всплеск) - лимит Telegram
+OUTBOUND_RATE = 30.0
+OUTBOUND_BURST = 30
+
+# Методы, которые расходуют бюджет: лимит Telegram касается только отправки сообщений,
+# проверки подписки, ответы на кнопки и редактирование проходят без очереди
+RATE_LIMITED_METHODS = frozenset({
+    'sendMessage', 'sendPhoto', 'sendDocument', 'sendMediaGroup', 'copyMessage', 'forwardMessage'
+})
+
+# Каждый N-й вызов при очереди отдается самому низкому классу, чтобы рассылка не стояла совсем
+OUTBOUND_FAIR_SHARE = 10
+
+# Сколько вызовов рассылки одновременно могут занимать соединения из пула
+OUTBOUND_BULK_IN_FLIGHT = 4
+
+# Класс вызовов текущей задачи (по умолчанию - ответ пользователю)
+outbound_priority: ContextVar[int] = ContextVar('outbound_priority', default=PRIORITY_INTERACTIVE)
+
+
+@contextmanager
+def outbound_class(priority: int):
+    """Все вызовы Telegram внутри блока идут с указанным приоритетом"""
+    token = outbound_priority.set(priority)
+    try:
+        yield
+    finally:
+        outbound_priority.reset(token)
+
+
+class OutboundScheduler:
+    """
+    Планировщик исходящих вызовов Telegram.
+    
+    - Общий бюджет OUTBOUND_RATE отправок сообщений в секунду (token bucket),
+      остальные вызовы (RATE_LIMITED_METHODS не входят) бюджет не расходуют
+    - Когда бюджета не хватает, отправки ждут в очередях по классам: ответы раньше
+      проверок, проверки раньше рассылки, внутри класса - по порядку
+    - Каждый OUTBOUND_FAIR_SHARE-й вызов отдается самому низкому ждущему классу
+    - Рассылка занимает не больше OUTBOUND_BULK_IN_FLIGHT соединений одновременно
+    """
+
+    def __init__(self, rate: float = OUTBOUND_RATE, burst: int = OUTBOUND_BURST,
+                 fair_share: int = OUTBOUND_FAIR_SHARE, bulk_in_flight: int = OUTBOUND_BULK_IN_FLIGHT):
+        self.rate = rate
+        self.burst = burst
+        self.fair_share = fair_share
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.queues = {priority: deque() for priority in PRIORITY_NAMES}
+        self.grants = 0
+        self.waits = {priority: [0, 0.0, 0.0] for priority in PRIORITY_NAMES}  # вызовов, суммарное и макс. ожидание
+        self._bulk_in_flight = bulk_in_flight
+        self._bulk_slots = None
+        self._dispatcher = None
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def _next_queue(self) -> deque:
+        waiting = [queue for queue in self.queues.values() if queue]
+        self.grants += 1
+        if len(waiting) > 1 and self.grants % self.fair_share == 0:
+            return waiting[-1]
+        return waiting[0]
+
+    async def _dispatch(self):
+        """Раздает бюджет ждущим вызовам по приоритету"""
+        while any(self.queues.values()):
+            self._refill()
+            if self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                continue
+            waiter = self._next_queue().popleft()
+            if waiter.done():
+                continue
+            self.tokens -= 1
+            waiter.set_result(None)
+
+    async def acquire(self, priority: int):
+        """Ждет своей очереди в бюджете вызовов"""
+        started = time.monotonic()
+        self._refill()
+        if self.tokens >= 1 and not any(self.queues.values()):
+            self.tokens -= 1
+        else:
+            waiter = asyncio.get_running_loop().create_future()
+            self.queues[priority].append(waiter)
+            if self._dispatcher is None or self._dispatcher.done():
+                self._dispatcher = asyncio.create_task(self._dispatch())
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter in self.queues[priority]:
+                    self.queues[priority].remove(waiter)
+                raise
+        waited = time.monotonic() - started
+        stats = self.waits[priority]
+        stats[0] += 1
+        stats[1] += waited
+        stats[2] = max(stats[2], waited)
+
+    @asynccontextmanager
+    async def slot(self, priority: int, limited: bool = True):
+        """Разрешение на один вызов Telegram (limited - вызов расходует бюджет отправки)"""
+        if priority != PRIORITY_BULK:
+            if limited:
+                await self.acquire(priority)
+            yield
+            return
+        if self._bulk_slots is None:
+            self._bulk_slots = asyncio.Semaphore(self._bulk_in_flight)
+        async with self._bulk_slots:
+            if limited:
+                await self.acquire(priority)
+            yield
+
+    def format_status(self) -> str:
+        """Текстовая сводка по ожиданию в очередях для экрана статистики"""
+        lines = []
+        for priority, (calls, total_wait, max_wait) in self.waits.items():
+            avg_ms = total_wait / calls * 1000 if calls else 0.0
+            lines.append(f"   • {PRIORITY_NAMES[priority]}: {calls} вызовов, ожидание "
+                         f"{avg_ms:.0f} мс (макс. {max_wait * 1000:.0f} мс), в очереди {len(self.queues[priority])}")
+        return "\n".join(lines)
+
+
+outbound_scheduler = OutboundScheduler()
+
+
+# ==================== ПУЛЫ СОЕДИНЕНИЙ ====================
+
+
+def _env_number(name: str, default, cast=float):
+    """Числовая настройка из переменной окружения"""
+    value = os.getenv(name)
+    if not value:
+        return default
+    try:
+        return cast(value)
+    except ValueError:
+        logger.warning(f"Неверное значение {name}={value!r}, используется {default}")
+        return default
+
+
+# Соединения для ответов, проверок и рассылки (все, кроме загрузки файлов и getUpdates)
+TELEGRAM_POOL_SIZE = _env_number("TELEGRAM_POOL_SIZE", 8, int)
+
+# Отдельные соединения для загрузки файлов, чтобы долгие загрузки не занимали общий пул
+TELEGRAM_MEDIA_POOL_SIZE = _env_number("TELEGRAM_MEDIA_POOL_SIZE", 4, int)
+
+# Сколько ждать свободного соединения, прежде чем вызов завершится ошибкой (секунды)
+TELEGRAM_POOL_TIMEOUT = _env_number("TELEGRAM_POOL_TIMEOUT", 10.0)
+
+# Таймаут установки соединения (секунды). Для методов, у которых таймаут ответа
+# в API_TIMEOUTS меньше, соединение ждется не дольше этого таймаута ответа
+TELEGRAM_CONNECT_TIMEOUT = _env_number("TELEGRAM_CONNECT_TIMEOUT", 5.0)
+
+# Таймаут ответа для методов, которых нет в API_TIMEOUTS (секунды)
+TELEGRAM_READ_TIMEOUT = _env_number("TELEGRAM_READ_TIMEOUT", 15.0)
+
+# Таймаут отправки запроса (секунды)
+TELEGRAM_WRITE_TIMEOUT = _env_number("TELEGRAM_WRITE_TIMEOUT", 60.0)
+
+# Таймаут отправки файла при загрузке (секунды)
+TELEGRAM_MEDIA_WRITE_TIMEOUT = _env_number("TELEGRAM_MEDIA_WRITE_TIMEOUT", 120.0)
+
+# Таймаут ответа на getUpdates сверх времени long polling (секунды)
+TELEGRAM_POLL_READ_TIMEOUT = _env_number("TELEGRAM_POLL_READ_TIMEOUT", 10.0)
+
+# HTTP/2 для ответов и загрузок (нужен пакет h2: pip install httpx[http2])
+TELEGRAM_HTTP2 = os.getenv("TELEGRAM_HTTP2", "0").lower() in ("1", "true", "yes")
+
+# Все пулы соединений - для экрана статистики
+connection_pools: List['MeteredRequest'] = []
+
+
+class PoolExhaustedError(TimedOut):
+    """Все соединения пула заняты, запрос не отправлялся (Telegram тут ни при чем)"""
+
+
+class MeteredRequest(HTTPXRequest):
+    """
+    HTTPXRequest, который учитывает занятость своего пула соединений.
+    
+    Вызов сначала ждет свободное соединение (не дольше pool_timeout), время ожидания
+    и пиковая занятость пула показываются на экране статистики.
+    """
+
+    def __init__(self, name: str, connection_pool_size: int, pool_timeout: Optional[float], **kwargs):
+        super().__init__(connection_pool_size=connection_pool_size, pool_timeout=pool_timeout, **kwargs)
+        self.name = name
+        self.size = connection_pool_size
+        self.pool_timeout = pool_timeout
+        self.in_flight = 0
+        self.peak = 0
+        self.calls = 0
+        self.waited = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.timeouts = 0
+        self._slots = None
+        connection_pools.append(self)
+
+    async def do_request(self, url: str, method: str, request_data: Optional[RequestData] = None,
+                         read_timeout=BaseRequest.DEFAULT_NONE, write_timeout=BaseRequest.DEFAULT_NONE,
+                         connect_timeout=BaseRequest.DEFAULT_NONE, pool_timeout=BaseRequest.DEFAULT_NONE):
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.size)
+        wait_limit = self.pool_timeout if pool_timeout is BaseRequest.DEFAULT_NONE else pool_timeout
+        
+        started = time.monotonic()
+        try:
+            await asyncio.wait_for(self._slots.acquire(), wait_limit)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise PoolExhaustedError(f"все {self.size} соединений пула «{self.name}» заняты, запрос не отправлен")
+        waited = time.monotonic() - started
+        
+        self.calls += 1
+        if waited > 0.001:
+            self.waited += 1
+            self.total_wait += waited
+            self.max_wait = max(self.max_wait, waited)
+        self.in_flight += 1
+        self.peak = max(self.peak, self.in_flight)
+        try:
+            return await super().do_request(
+                url,
+                method,
+                request_data,
+                read_timeout=read_timeout,
+                write_timeout=write_timeout,
+                connect_timeout=connect_timeout,
+                pool_timeout=pool_timeout
+            )
+        finally:
+            self.in_flight -= 1
+            self._slots.release()
+
+    def format_status(self) -> str:
+        """Строка статистики пула"""
+        avg_ms = self.total_wait / self.waited * 1000 if self.waited else 0.0
+        return (f"   • {self.name}: занято {self.in_flight}/{self.size} (пик {self.peak}), "
+                f"ждали соединения {self.waited} из {self.calls} "
+                f"({avg_ms:.0f} мс, макс. {self.max_wait * 1000:.0f} мс), таймаутов {self.timeouts}")
+
+
+def format_pools_status() -> str:
+    """Сводка по всем пулам соединений для экрана статистики"""
+    return "\n".join(pool.format_status() for pool in connection_pools) or "   • нет данных"
+
+
+class GuardedRequest(MeteredRequest):
+    """
+    HTTPXRequest с таймаутами по методам, автоматами защиты и общей очередью вызовов.
+    
+    Вызовы метода или канала, который несколько раз подряд не ответил, отклоняются
+    сразу (CircuitOpenError), не занимая соединения из пула. Остальные проходят через
+    outbound_scheduler с приоритетом текущей задачи (outbound_priority). Запросы
+    с файлами уходят через отдельный пул media_request, если он задан.
+    """
+
+    def __init__(self, name: str, connection_pool_size: int, pool_timeout: Optional[float],
+                 media_request: Optional[MeteredRequest] = None, **kwargs):
+        super().__init__(name, connection_pool_size, pool_timeout, **kwargs)
+        self.media_request = media_request
+
+    async def initialize(self):
+        await super().initialize()
+        if self.media_request:
+            await self.media_request.initialize()
+
+    async def shutdown(self):
+        await super().shutdown()
+        if self.media_request:
+            await self.media_request.shutdown()
+
+    async def post(self, url: str, request_data: Optional[RequestData] = None,
+                   read_timeout=BaseRequest.DEFAULT_NONE, write_timeout=BaseRequest.DEFAULT_NONE,
+                   connect_timeout=BaseRequest.DEFAULT_NONE, pool_timeout=BaseRequest.DEFAULT_NONE):
+        endpoint = url.rsplit('/', 1)[-1]
+        if read_timeout is BaseRequest.DEFAULT_NONE:
+            read_timeout = API_TIMEOUTS.get(endpoint, TELEGRAM_READ_TIMEOUT)
+        if connect_timeout is BaseRequest.DEFAULT_NONE:
+            connect_timeout = min(TELEGRAM_CONNECT_TIMEOUT, read_timeout or TELEGRAM_CONNECT_TIMEOUT)
+        
+        chat_id = request_data.parameters.get('chat_id') if request_data else None
+        breakers = api_guard.breakers_for(endpoint, chat_id)
+        allowed = []
+        for breaker in breakers:
+            if not breaker.allow():
+                for taken in allowed:
+                    taken.cancel()
+                raise CircuitOpenError(breaker.name)
+            allowed.append(breaker)
+        
+        try:
+            # Загрузки файлов идут через свой пул и не занимают соединения для ответов
+            if self.media_request and request_data is not None and request_data.contains_files:
+                post = self.media_request.post
+            else:
+                post = super().post
+            async with outbound_scheduler.slot(outbound_priority.get(), endpoint in RATE_LIMITED_METHODS):
+                result = await post(
+                    url,
+                    request_data,
+                    read_timeout=read_timeout,
+                    write_timeout=write_timeout,
+                    connect_timeout=connect_timeout,
+                    pool_timeout=pool_timeout
+                )
+        except asyncio.CancelledError:
+            for breaker in breakers:
+                breaker.cancel()
+            raise
+        except Exception as e:
+            for breaker in breakers:
+                if is_dependency_failure(e):
+                    breaker.failure()
+                elif isinstance(e, PoolExhaustedError):
+                    # Запрос не дошел до Telegram - пробный вызов можно повторить
+                    breaker.cancel()
+                else:
+                    breaker.success()
+            raise
+        for breaker in breakers:
+            breaker.success()
+        return result
+
+
+async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE):
+    """Логирует ошибки обработчиков; если Telegram недоступен - вежливо сообщает об этом пользователю"""
+    error = context.error
+    if not isinstance(error, CircuitOpenError):
+        logger.error(f"Ошибка при обработке обновления: {error}", exc_info=error)
+        return
+    
+    logger.warning(f"🔌 Обновление не обработано: {error}")
+    if not isinstance(update, Update):
+        return
+    # Если на нажатие уже ответили - сообщаем обычным сообщением
+    if update.callback_query and await answer_query(update.callback_query, API_UNAVAILABLE_TEXT, show_alert=True):
+        return
+    if update.effective_chat:
+        try:
+            await context.bot.send_message(chat_id=update.effective_chat.id, text=API_UNAVAILABLE_TEXT)
+        except Exception as e:
+            logger.warning(f"Не удалось сообщить пользователю о недоступности Telegram: {e}")
+
+
+# ==================== СОСТОЯНИЕ КАНАЛОВ ====================
+
+# Файл с результатами проверки каналов
+CHANNEL_HEALTH_FILE = "channel_health.json"
+
+# Как часто проверять, что бот администратор в каждом канале (секунды)
+CHANNEL_HEALTH_INTERVAL = 300
+
+# Канал, который проверяется вместе с CHANNEL_IDS
+MAIN_CHANNEL = '@pro_tweaks'
+
+# Ошибки Telegram, которые означают проблему с каналом, а не с пользователем
+CHANNEL_FAILURE_MARKERS = (
+    "chat not found",
+    "not enough rights",
+    "member list is inaccessible",
+    "bot is not a member",
+    "bot was kicked",
+    "administrator"
+)
+
+
+def subscription_channels() -> list:
+    """
+    Каналы для проверки подписки.
+    
+    Имена каналов (@username) заменяются числовыми ID, как только они известны,
+    чтобы Telegram не искал канал по имени при каждой проверке; повторы убираются.
+    """
+    channels = []
+    for channel in [MAIN_CHANNEL] + CHANNEL_IDS:
+        channel = channel_health.resolve(channel)
+        if channel not in channels:
+            channels.append(channel)
+    return channels
+
+
+def is_channel_failure(error: Exception) -> bool:
+    """Ошибка говорит о том, что бот не может проверять подписчиков канала"""
+    error_msg = str(error).lower()
+    return any(marker in error_msg for marker in CHANNEL_FAILURE_MARKERS)
+
+
+class ChannelHealth:
+    """
+    Состояние каналов для проверки подписки.
+    
+    - channel_health_job периодически проверяет, что бот состоит в каждом канале
+      администратором; сломанные каналы пропускаются при проверке подписки
+    - Ошибка доступа при проверке пользователя сразу помечает канал сломанным,
+      вернуть его может только следующая периодическая проверка
+    - Админы получают одно уведомление при поломке канала и одно при восстановлении
+    - Имена каналов (@username) один раз переводятся в числовые ID и сохраняются;
+      заново имя ищется, только если канал по сохраненному ID стал недоступен
+    """
+
+    def __init__(self):
+        self.channels: Dict[str, dict] = {}
+        self.resolved: Dict[str, int] = {}
+        self.dirty = False
+
+    def resolve(self, channel):
+        """Числовой ID канала, если имя уже известно, иначе сам канал"""
+        if isinstance(channel, str) and channel.startswith('@'):
+            return self.resolved.get(channel.lower(), channel)
+        return channel
 
+    async def resolve_usernames(self, bot, channels: list):
+        """Находит числовые ID каналов, заданных по имени"""
+        for channel in channels:
+            if not isinstance(channel, str) or not channel.startswith('@') or channel.lower() in self.resolved:
+                continue
+            try:
+                chat = await bot.get_chat(channel)
+                self.resolved[channel.lower()] = chat.id
+                self.dirty = True
+                logger.info(f"🔗 Канал {channel} -> {chat.id}")
+            except Exception as e:
+                logger.warning(f"Не удалось найти канал {channel}: {e}")
 
-def remove_admin(user_id: int) -> bool:
-    """Удаляет администратора"""
-    data = load_data()
-    admins = data.get('admins', [])
-    if user_id in admins:
-        admins.remove(user_id)
-        data['admins'] = admins
-        return save_data(data)
-    return False
+    def forget(self, channel):
+        """Сбрасывает сохраненный ID канала, чтобы имя было найдено заново"""
+        for username, chat_id in list(self.resolved.items()):
+            if str(chat_id) == str(channel):
+                del self.resolved[username]
+                self.dirty = True
+                logger.info(f"🔗 Канал {username} будет найден заново")
 
+    def _state(self, channel) -> dict:
+        return self.channels.setdefault(str(channel), {
+            'ok': True, 'reason': "", 'title': None, 'checked_at': None, 'notified': None
+        })
 
-def add_user(user_id: int) -> bool:
-    """Добавляет пользователя в список (для рассылки)"""
-    data = load_data()
-    users = data.get('users', [])
-    if user_id not in users:
-        users.append(user_id)
-        data['users'] = users
-        return save_data(data)
-    return False
+    def is_degraded(self, channel) -> bool:
+        """Канал сломан и пропускается при проверке подписки"""
+        state = self.channels.get(str(channel))
+        return state is not None and not state['ok']
 
+    def healthy(self, channels: list) -> list:
+        """Каналы, которые можно проверять"""
+        return [channel for channel in channels if not self.is_degraded(channel)]
 
-def log_action(admin_id: int, action: str):
-    """Логирует действие администратора"""
-    from datetime import datetime
-    log_entry = {
-        'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-        'admin_id': admin_id,
-        'action': action
-    }
-    action_logs.append(log_entry)
-    # Ограничиваем количество логов (последние 1000)
-    if len(action_logs) > 1000:
-        action_logs.pop(0)
+    def mark(self, channel, ok: bool, reason: str = "", title: Optional[str] = None):
+        """Запоминает результат проверки канала"""
+        state = self._state(channel)
+        if state['ok'] != ok:
+            if ok:
+                logger.info(f"✅ Канал {channel} снова доступен")
+            else:
+                logger.warning(f"⚠️ Канал {channel} недоступен ({reason}) - проверка подписки его пропускает")
+        state.update(ok=ok, reason=reason, checked_at=time.time())
+        if title:
+            state['title'] = title
+        self.dirty = True
 
+    def report_failure(self, channel, error: Exception):
+        """Помечает канал сломанным по ошибке, полученной при проверке пользователя"""
+        if not self.is_degraded(channel):
+            self.mark(channel, False, str(error))
+        self.forget(channel)
 
-def is_banned(user_id: int) -> bool:
-    """Проверяет, забанен ли пользователь"""
-    data = load_data()
-    banned = data.get('banned_users', [])
-    return user_id in banned
+    async def probe(self, bot, channels: list):
+        """Проверяет членство и права бота в каждом канале"""
+        for key in [key for key in self.channels if key not in {str(channel) for channel in channels}]:
+            del self.channels[key]
+            self.dirty = True
+        for channel in channels:
+            try:
+                chat = await bot.get_chat(channel)
+                member = await bot.get_chat_member(chat_id=channel, user_id=bot.id)
+                if member.status in (ChatMemberStatus.ADMINISTRATOR, ChatMemberStatus.OWNER):
+                    self.mark(channel, True, title=chat.title)
+                else:
+                    self.mark(channel, False, f"бот не администратор канала (статус: {member.status})", chat.title)
+            except Exception as e:
+                if is_channel_failure(e):
+                    self.mark(channel, False, str(e))
+                    self.forget(channel)
+                else:
+                    # Сетевые и временные ошибки не меняют состояние канала
+                    logger.warning(f"Не удалось проверить канал {channel}: {e}")
 
+    def pending_alerts(self) -> List[tuple]:
+        """Каналы, о смене состояния которых админы еще не знают: (канал, состояние)"""
+        alerts = []
+        for key, state in self.channels.items():
+            if not state['ok'] and state['notified'] != 'degraded':
+                alerts.append((key, state))
+            elif state['ok'] and state['notified'] == 'degraded':
+                alerts.append((key, state))
+        return alerts
 
-def ban_user(user_id: int) -> bool:
-    """Банит пользователя"""
-    data = load_data()
-    banned = data.get('banned_users', [])
-    if user_id not in banned:
-        banned.append(user_id)
-        data['banned_users'] = banned
-        return save_data(data)
-    return False
+    def mark_notified(self, channel):
+        """Запоминает, что админы получили уведомление о текущем состоянии канала"""
+        state = self._state(channel)
+        state['notified'] = 'ok' if state['ok'] else 'degraded'
+        self.dirty = True
 
+    def load(self):
+        """Загружает состояние каналов из файла"""
+        try:
+            if os.path.exists(CHANNEL_HEALTH_FILE):
+                with open(CHANNEL_HEALTH_FILE, 'rb') as f:
+                    state = json_loads(f.read())
+                self.channels = state.get('channels', {})
+                self.resolved = state.get('resolved', {})
+        except Exception as e:
+            logger.error(f"Ошибка при загрузке состояния каналов: {e}")
 
-def unban_user(user_id: int) -> bool:
-    """Разбанивает пользователя"""
-    data = load_data()
-    banned = data.get('banned_users', [])
-    if user_id in banned:
-        banned.remove(user_id)
-        data['banned_users'] = banned
-        return save_data(data)
-    return False
+    def save(self):
+        """Сохраняет состояние каналов, если оно изменилось"""
+        if not self.dirty:
+            return
+        try:
+            self.dirty = False
+            _write_bytes_atomic(CHANNEL_HEALTH_FILE, json_dumps({'channels': self.channels, 'resolved': self.resolved}))
+        except Exception as e:
+            self.dirty = True
+            logger.error(f"Ошибка при сохранении состояния каналов: {e}")
 
 
-def get_all_users() -> List[int]:
-    """Возвращает список всех пользователей"""
-    data = load_data()
-    return data.get('users', [])
+channel_health = ChannelHealth()
 
 
-# Загружаем данные при запуске
-load_data()
+async def channel_health_job(context: ContextTypes.DEFAULT_TYPE):
+    """Периодически проверяет каналы и один раз уведомляет админов о поломке или восстановлении"""
+    with outbound_class(PRIORITY_CHECKS):
+        await channel_health.resolve_usernames(context.bot, [MAIN_CHANNEL] + CHANNEL_IDS)
+        await channel_health.probe(context.bot, subscription_channels())
+    
+    for channel, state in channel_health.pending_alerts():
+        name = html.escape(state.get('title') or channel)
+        if state['ok']:
+            text = f"✅ <b>Канал снова доступен</b>\n\n{name} (<code>{channel}</code>) снова участвует в проверке подписки."
+        else:
+            text = (
+                f"⚠️ <b>Канал недоступен</b>\n\n"
+                f"{name} (<code>{channel}</code>): {html.escape(state['reason'])}\n\n"
+                f"Проверка подписки пропускает этот канал. Назначьте бота администратором канала."
+            )
+        for admin_id in ADMIN_IDS:
+            try:
+                await context.bot.send_message(chat_id=admin_id, text=text, parse_mode=ParseMode.HTML)
+            except Exception as e:
+                logger.warning(f"Не удалось уведомить админа {admin_id} о канале {channel}: {e}")
+        channel_health.mark_notified(channel)
+    
+    await asyncio.to_thread(channel_health.save)
 
 
 async def check_subscription(user_id: int, context: ContextTypes.DEFAULT_TYPE) -> bool:
@@ -207,11 +3358,23 @@ async def check_subscription(user_id: int, context: ContextTypes.DEFAULT_TYPE) -
     - Если статус 'left', 'kicked', 'restricted' или любой другой - пользователь НЕ ПОДПИСАН (возвращает False)
     - Если ошибка доступа (бот не админ) - пользователь НЕ ПОДПИСАН (возвращает False)
     """
+    # Проверки уступают очередь ответам пользователям, но идут раньше рассылки
+    priority_token = outbound_priority.set(PRIORITY_CHECKS)
     try:
-        # Список каналов для проверки
-        channels_to_check = ['@pro_tweaks'] + CHANNEL_IDS
+        # Если Telegram не отвечает на проверки, сразу сообщаем об этом пользователю
+        api_guard.check('getChatMember')
+        
+        # Список каналов для проверки (сломанные и временно недоступные каналы пропускаются)
+        all_channels = subscription_channels()
+        channels_to_check = [
+            channel for channel in channel_health.healthy(all_channels)
+            if not api_guard.is_channel_open(channel)
+        ]
         
         logger.info(f"🔍 Проверка подписки пользователя {user_id} на каналы: {channels_to_check}")
+        if len(channels_to_check) < len(all_channels):
+            skipped = [channel for channel in all_channels if channel not in channels_to_check]
+            logger.info(f"⏭️ Пропускаем недоступные каналы: {skipped}")
         
         subscribed_channels = []
         not_subscribed_channels = []
@@ -250,6 +3413,7 @@ async def check_subscription(user_id: int, context: ContextTypes.DEFAULT_TYPE) -
                 else:
                     logger.warning(f"   Статус: {status} - неизвестный статус")
                 
+                funnel_stats.record_channel(channel, is_subscribed)
                 if is_subscribed:
                     logger.info(f"✅ Пользователь {user_id} ПОДПИСАН на канал {channel} (статус: {status})")
                     subscribed_channels.append(channel)
@@ -257,6 +3421,9 @@ async def check_subscription(user_id: int, context: ContextTypes.DEFAULT_TYPE) -
                     logger.info(f"❌ Пользователь {user_id} НЕ ПОДПИСАН на канал {channel} (статус: {status})")
                     not_subscribed_channels.append(f"{channel} (статус: {status})")
                     
+            except CircuitOpenError as e:
+                logger.warning(f"⏭️ Канал {channel} пропущен: {e}")
+                continue
             except Exception as e:
                 error_msg = str(e).lower()
                 logger.error(f"⚠️ Ошибка при проверке канала {channel}: {error_msg}")
@@ -271,7 +3438,12 @@ async def check_subscription(user_id: int, context: ContextTypes.DEFAULT_TYPE) -
                 
                 logger.warning(f"   Считаем, что пользователь НЕ ПОДПИСАН на канал {channel}")
                 
+                # Бот не может проверять этот канал - следующие проверки его пропустят
+                if is_channel_failure(e):
+                    channel_health.report_failure(channel, e)
+                
                 # При ЛЮБОЙ ошибке считаем, что пользователь НЕ подписан
+                funnel_stats.record_channel(channel, False)
                 not_subscribed_channels.append(f"{channel} (ошибка доступа)")
                 continue
         
@@ -283,21 +3455,30 @@ async def check_subscription(user_id: int, context: ContextTypes.DEFAULT_TYPE) -
         # Если подписан хотя бы на один канал - возвращаем True
         if subscribed_channels:
             logger.info(f"✅ ИТОГ: Пользователь {user_id} ПОДПИСАН (на каналы: {subscribed_channels})")
+            bot_stats.record('sub_pass')
             return True
         else:
             logger.warning(f"❌ ИТОГ: Пользователь {user_id} НЕ ПОДПИСАН ни на один канал")
+            bot_stats.record('sub_fail')
             return False
-            
+    
+    except CircuitOpenError:
+        raise
     except Exception as e:
         logger.error(f"❌ Критическая ошибка при проверке подписки: {e}")
         logger.error(f"   Полный traceback: {traceback.format_exc()}")
         # При критической ошибке считаем, что не подписан (безопаснее)
         return False
+    finally:
+        outbound_priority.reset(priority_token)
 
 
-async def delete_previous_message(user_id: int, chat_id: int, context: ContextTypes.DEFAULT_TYPE):
-    """Удаляет предыдущее сообщение бота пользователю"""
+async def delete_previous_message(user_id: int, chat_id: int, context: ContextTypes.DEFAULT_TYPE,
+                                  keep_message_id: Optional[int] = None):
+    """Удаляет предыдущее сообщение бота пользователю (кроме keep_message_id, которое будет отредактировано)"""
     if user_id in user_messages and user_messages[user_id] is not None:
+        if user_messages[user_id] == keep_message_id:
+            return
         try:
             await context.bot.delete_message(chat_id=chat_id, message_id=user_messages[user_id])
         except Exception as e:
@@ -307,29 +3488,147 @@ async def delete_previous_message(user_id: int, chat_id: int, context: ContextTy
             user_messages[user_id] = None
 
 
-async def get_main_menu(user_id: int, context: ContextTypes.DEFAULT_TYPE):
-    """Создает главное меню - всегда показывает кнопки подписки и проверки"""
-    logger.info(f"🔍 Getting main menu for user {user_id}")
+# Кэш file_id изображений (путь -> (file_id, file_unique_id)), чтобы не загружать файл при каждом показе
+photo_file_ids: Dict[str, tuple] = {}
+
+
+def remember_photo(image_path: str, message) -> None:
+    """Запоминает file_id изображения из отправленного сообщения"""
+    if message is not None and not isinstance(message, bool) and message.photo:
+        photo = message.photo[-1]
+        photo_file_ids[image_path] = (photo.file_id, photo.file_unique_id)
+
+
+def shows_photo(message, image_path: str) -> bool:
+    """Проверяет, что сообщение уже показывает это изображение"""
+    cached = photo_file_ids.get(image_path)
+    return bool(cached and message.photo and message.photo[-1].file_unique_id == cached[1])
+
+
+async def send_screen(chat_id: int, context: ContextTypes.DEFAULT_TYPE, caption: str,
+                      reply_markup: Optional[InlineKeyboardMarkup], image_path: Optional[str] = None):
+    """Отправляет новое сообщение-экран: с изображением, если оно есть, иначе текстом"""
+    if image_path:
+        cached = photo_file_ids.get(image_path)
+        try:
+            if cached:
+                return await context.bot.send_photo(
+                    chat_id=chat_id,
+                    photo=cached[0],
+                    caption=caption,
+                    reply_markup=reply_markup,
+                    parse_mode=ParseMode.HTML
+                )
+            with open(image_path, "rb") as photo:
+                sent_message = await context.bot.send_photo(
+                    chat_id=chat_id,
+                    photo=photo,
+                    caption=caption,
+                    reply_markup=reply_markup,
+                    parse_mode=ParseMode.HTML
+                )
+            remember_photo(image_path, sent_message)
+            return sent_message
+        except FileNotFoundError:
+            # Если файл не найден, отправляем текстовое сообщение
+            pass
+        except Exception as e:
+            logger.error(f"Ошибка при отправке изображения: {e}")
+            photo_file_ids.pop(image_path, None)
     
-    # Всегда показываем кнопки подписки и проверки (не проверяем подписку сразу)
-    keyboard = []
-    for i, channel_link in enumerate(CHANNEL_LINKS, 1):
-        keyboard.append([InlineKeyboardButton(
-            f"📢 Подписаться на канал {i}",
-            url=channel_link
-        )])
+    return await context.bot.send_message(
+        chat_id=chat_id,
+        text=caption,
+        reply_markup=reply_markup,
+        parse_mode=ParseMode.HTML
+    )
+
+
+async def show_screen(message, context: ContextTypes.DEFAULT_TYPE, caption: str,
+                      reply_markup: Optional[InlineKeyboardMarkup], image_path: Optional[str] = None):
+    """
+    Показывает экран на месте существующего сообщения.
     
-    keyboard.append([InlineKeyboardButton("✅ Проверить подписку", callback_data="check_subscription")])
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    Подпись редактируется через edit_caption/edit_text, изображение заменяется через
+    edit_media (по кэшированному file_id, без повторной загрузки). Если редактирование
+    невозможно (например, текст нельзя превратить в фото), отправляется новое сообщение,
+    а старое удаляется.
+    """
+    has_media = bool(message.photo or message.document)
+    try:
+        if image_path is None or shows_photo(message, image_path):
+            if has_media:
+                return await message.edit_caption(caption=caption, reply_markup=reply_markup, parse_mode=ParseMode.HTML)
+            return await message.edit_text(caption, reply_markup=reply_markup, parse_mode=ParseMode.HTML)
+        
+        if has_media:
+            cached = photo_file_ids.get(image_path)
+            if cached:
+                return await message.edit_media(
+                    InputMediaPhoto(cached[0], caption=caption, parse_mode=ParseMode.HTML),
+                    reply_markup=reply_markup
+                )
+            with open(image_path, "rb") as photo:
+                edited = await message.edit_media(
+                    InputMediaPhoto(photo, caption=caption, parse_mode=ParseMode.HTML),
+                    reply_markup=reply_markup
+                )
+            remember_photo(image_path, edited)
+            return edited
+    except BadRequest as e:
+        if "not modified" in str(e).lower():
+            return message
+        logger.warning(f"Не удалось отредактировать сообщение: {e}")
+        if image_path:
+            photo_file_ids.pop(image_path, None)
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        logger.warning(f"Не удалось отредактировать сообщение: {e}")
     
-    caption = (
-        "👋 <b>Добро пожаловать!</b>\n\n"
-        "⚠️ Для использования бота необходимо подписаться на наши каналы.\n\n"
-        "Пожалуйста, подпишитесь на каналы ниже и нажмите кнопку проверки:"
+    # Редактирование невозможно - отправляем новое сообщение и удаляем старое
+    sent_message = await send_screen(message.chat_id, context, caption, reply_markup, image_path)
+    try:
+        await message.delete()
+    except Exception as e:
+        logger.warning(f"Не удалось удалить сообщение: {e}")
+    return sent_message
+
+
+async def show_document(message, context: ContextTypes.DEFAULT_TYPE, file_data, filename: str,
+                        caption: str, reply_markup: Optional[InlineKeyboardMarkup]):
+    """
+    Заменяет содержимое сообщения документом, при невозможности - отправляет документ заново.
+    file_data - содержимое файла (bytes) или file_id уже загруженного в Telegram документа.
+    """
+    try:
+        return await message.edit_media(
+            InputMediaDocument(file_data, caption=caption, parse_mode=ParseMode.HTML, filename=filename),
+            reply_markup=reply_markup
+        )
+    except Exception as e:
+        logger.warning(f"Не удалось заменить сообщение документом: {e}")
+    
+    sent_message = await context.bot.send_document(
+        chat_id=message.chat_id,
+        document=InputFile(BytesIO(file_data), filename=filename) if isinstance(file_data, bytes) else file_data,
+        caption=caption,
+        reply_markup=reply_markup,
+        parse_mode=ParseMode.HTML
     )
-    image_path = "Preview.png"
+    try:
+        await message.delete()
+    except Exception as e:
+        logger.warning(f"Не удалось удалить сообщение о загрузке: {e}")
+    return sent_message
+
+
+async def get_main_menu(user_id: int, context: ContextTypes.DEFAULT_TYPE):
+    """Создает главное меню - всегда показывает кнопки подписки и проверки"""
+    logger.info(f"🔍 Getting main menu for user {user_id}")
     
-    return caption, reply_markup, image_path
+    # Всегда показываем кнопки подписки и проверки (не проверяем подписку сразу)
+    return get_main_menu_render()
 
 
 async def get_id(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -404,6 +3703,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     # Сохраняем пользователя для рассылки
     add_user(user_id)
+    funnel_stats.record('start')
     
     # Удаляем предыдущее сообщение
     await delete_previous_message(user_id, chat_id, context)
@@ -415,30 +3715,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     image_path = "Preview.png"
     
     # Отправляем изображение с главным меню
-    try:
-        with open(image_path, "rb") as photo:
-            sent_message = await context.bot.send_photo(
-                chat_id=chat_id,
-                photo=photo,
-                caption=caption,
-                reply_markup=reply_markup,
-                parse_mode=ParseMode.HTML
-            )
-    except FileNotFoundError:
-        # Если файл не найден, отправляем текстовое сообщение
-        sent_message = await update.message.reply_text(
-            caption,
-            reply_markup=reply_markup,
-            parse_mode=ParseMode.HTML
-        )
-    except Exception as e:
-        logger.error(f"Ошибка при отправке изображения: {e}")
-        # В случае ошибки отправляем текстовое сообщение
-        sent_message = await update.message.reply_text(
-            caption,
-            reply_markup=reply_markup,
-            parse_mode=ParseMode.HTML
-        )
+    sent_message = await send_screen(chat_id, context, caption, reply_markup, image_path)
     
     # Сохраняем ID отправленного сообщения
     user_messages[user_id] = sent_message.message_id
@@ -452,288 +3729,314 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     
     user_id = query.from_user.id
-    chat_id = query.message.chat_id
     
     # Сохраняем пользователя для рассылки
     add_user(user_id)
     
-    # Пытаемся ответить на callback, игнорируем ошибки если запрос уже обработан
-    try:
-        await query.answer()
-    except Exception as e:
-        logger.warning(f"Ошибка при ответе на callback query: {e}")
-        # Продолжаем выполнение, даже если не удалось ответить
+    # Передаем нажатие в маршрутизатор callback_data (он же отвечает на нажатие)
+    await callback_router.dispatch(update, context)
+
+
+@callback_router.route("copy_id", answer=False)
+async def copy_id_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Показывает пользователю его ID"""
+    query = update.callback_query
     
-    if query.data == "copy_id":
-        # Копируем ID в буфер обмена (показываем пользователю)
-        user_id = query.from_user.id
-        await query.answer(f"Ваш ID: {user_id}\nСкопируйте его и введите на сайте", show_alert=True)
-        return
+    # Копируем ID в буфер обмена (показываем пользователю)
+    user_id = query.from_user.id
+    await answer_query(query, f"Ваш ID: {user_id}\nСкопируйте его и введите на сайте", show_alert=True)
+
+
+@callback_router.route("check_subscription", answer=False)
+async def check_subscription_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Проверяет подписку по нажатию кнопки"""
+    query = update.callback_query
+    user_id = query.from_user.id
+    chat_id = query.message.chat_id
     
-    if query.data == "check_subscription":
-        # Удаляем предыдущее сообщение
-        await delete_previous_message(user_id, chat_id, context)
-        
-        # Показываем сообщение о проверке
-        await query.answer("Проверяем подписку...", show_alert=False)
-        
-        logger.info(f"🔍 User {user_id} requested subscription check")
-        logger.info(f"📋 Channels to check: {['@pro_tweaks'] + CHANNEL_IDS}")
-        
-        # Детальная проверка каждого канала для отображения пользователю
-        detailed_results = []
-        for channel in ['@pro_tweaks'] + CHANNEL_IDS:
-            try:
-                member = await context.bot.get_chat_member(chat_id=channel, user_id=user_id)
-                status = member.status
-                status_str = str(status)
-                # Определяем, подписан ли пользователь на этот канал
-                # ИСПРАВЛЕНО: используем прямое сравнение с enum значениями
-                is_sub = (status == ChatMemberStatus.MEMBER or 
-                         status == ChatMemberStatus.ADMINISTRATOR or 
-                         status == ChatMemberStatus.CREATOR)
-                status_icon = "✅" if is_sub else "❌"
-                detailed_results.append(f"{status_icon} {channel}: '{status_str}'")
-                logger.info(f"📊 Channel {channel}: status = '{status_str}' (subscribed: {is_sub})")
-                if not is_sub:
-                    logger.warning(f"   User is NOT subscribed - status '{status_str}' is not MEMBER, ADMINISTRATOR, or CREATOR")
-            except Exception as e:
-                # При ошибке (включая отсутствие прав у бота) - считаем, что не подписан
-                error_msg = str(e)
-                error_msg_lower = error_msg.lower()
-                
-                # Определяем тип ошибки для более информативного сообщения
-                if "user not found" in error_msg_lower or "chat not found" in error_msg_lower:
-                    error_type = "пользователь не найден"
-                elif "not enough rights" in error_msg_lower or "administrator" in error_msg_lower:
-                    error_type = "бот не админ"
-                else:
-                    error_type = "ошибка доступа"
-                
-                detailed_results.append(f"❌ {channel}: {error_type}")
-                logger.error(f"❌ Channel {channel}: error - {e}")
-                logger.warning(f"   Bot may not have admin rights in channel {channel} or user is not subscribed")
-        
-        is_subscribed = await check_subscription(user_id, context)
-        logger.info(f"📊 Subscription check result for user {user_id}: {is_subscribed}")
-        
-        if is_subscribed:
-            # Если подписан - показываем картинку succes и кнопку скачивания
-            keyboard = [
-                [InlineKeyboardButton("📥 Скачать через бота", callback_data="download_here")]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            caption = (
-                "✅ <b>Отлично!</b>\n\n"
-                "Вы подписаны на все необходимые каналы!\n\n"
-                "Нажмите кнопку ниже для скачивания:"
-            )
-            image_path = "succes.png"
-        else:
-            # Если не подписан - показываем картинку error и кнопки подписки
-            keyboard = []
-            for i, channel_link in enumerate(CHANNEL_LINKS, 1):
-                keyboard.append([InlineKeyboardButton(
-                    f"📢 Подписаться на канал {i}",
-                    url=channel_link
-                )])
-            
-            keyboard.append([InlineKeyboardButton("✅ Проверить подписку", callback_data="check_subscription")])
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            
-            caption = (
-                "❌ <b>Подписка не найдена</b>\n\n"
-                "Пожалуйста, подпишитесь на каналы выше и нажмите кнопку проверки."
-            )
-            image_path = "error.png"
-        
-        # Отправляем изображение с результатом проверки
-        try:
-            with open(image_path, "rb") as photo:
-                sent_message = await context.bot.send_photo(
-                    chat_id=chat_id,
-                    photo=photo,
-                    caption=caption,
-                    reply_markup=reply_markup,
-                    parse_mode=ParseMode.HTML
-                )
-        except FileNotFoundError:
-            # Если файл не найден, отправляем текстовое сообщение
-            sent_message = await query.message.reply_text(
-                caption,
-                reply_markup=reply_markup,
-                parse_mode=ParseMode.HTML
-            )
-        except Exception as e:
-            logger.error(f"Ошибка при отправке изображения: {e}")
-            # В случае ошибки отправляем текстовое сообщение
-            sent_message = await query.message.reply_text(
-                caption,
-                reply_markup=reply_markup,
-                parse_mode=ParseMode.HTML
-            )
-        
-        # Удаляем старое сообщение
+    # Удаляем предыдущее сообщение (текущее будет отредактировано)
+    await delete_previous_message(user_id, chat_id, context, keep_message_id=query.message.message_id)
+    
+    # Показываем сообщение о проверке
+    await answer_query(query, "Проверяем подписку...")
+    
+    logger.info(f"🔍 User {user_id} requested subscription check")
+    is_subscribed = await check_subscription(user_id, context)
+    logger.info(f"📊 Subscription check result for user {user_id}: {is_subscribed}")
+    funnel_stats.record('check')
+    
+    if is_subscribed:
+        funnel_stats.record('pass')
+        # Если подписан - показываем картинку succes и кнопку скачивания
+        reply_markup = get_download_keyboard()
+        caption = render_cache.text('success')
+        image_path = "succes.png"
+    else:
+        # Если не подписан - показываем картинку error и кнопки подписки
+        reply_markup = get_subscribe_keyboard()
+        caption = render_cache.text('error')
+        image_path = "error.png"
+    
+    # Показываем результат проверки на месте текущего сообщения
+    sent_message = await show_screen(query.message, context, caption, reply_markup, image_path)
+    
+    # Сохраняем ID сообщения
+    user_messages[user_id] = sent_message.message_id
+
+
+@callback_router.route("channel_info", answer=False)
+async def channel_info_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Подсказка о подписке на каналы"""
+    await answer_query(update.callback_query, "Пожалуйста, подпишитесь на каналы через кнопки выше", show_alert=True)
+
+
+# ==================== КАТАЛОГ ФАЙЛОВ ====================
+
+# Имя файла установщика для настроек без каталога
+DEFAULT_FILE_NAME = "Pro Tweaker Installer.exe"
+
+# Блокировки первой загрузки файла в Telegram (ID записи -> Lock): пока один пользователь
+# загружает файл, остальные ждут и получают его уже по кэшированному file_id
+_file_upload_locks: Dict[int, asyncio.Lock] = {}
+
+
+def get_file_catalog(config: Mapping) -> List[dict]:
+    """
+    Копия каталога файлов из настроек.
+    
+    Запись: id, name, file_name, version, size, url (источник, если файл задан ссылкой)
+    и file_id (документ в Telegram). Для настроек без каталога возвращается один
+    установщик из file_url и загруженного ранее file_id.
+    """
+    files = config.get('files')
+    if files is not None:
+        return [dict(entry) for entry in files]
+    return [{
+        'id': 1,
+        'name': "Pro Tweaker Installer",
+        'file_name': config.get('file_name') or DEFAULT_FILE_NAME,
+        'version': "",
+        'size': None,
+        'url': config.get('file_url', FILE_URL),
+        'file_id': config.get('file_id')
+    }]
+
+
+def find_file_entry(config: Mapping, entry_id: int) -> Optional[dict]:
+    """Запись каталога по ID"""
+    for entry in get_file_catalog(config):
+        if entry['id'] == entry_id:
+            return entry
+    return None
+
+
+def add_file_entry(name: str, file_name: str, url: Optional[str] = None, file_id: Optional[str] = None,
+                   version: str = "", size: Optional[int] = None) -> Optional[dict]:
+    """Добавляет файл в каталог. Возвращает запись или None при ошибке сохранения"""
+    data = load_config()
+    files = get_file_catalog(data)
+    entry = {
+        'id': max((item['id'] for item in files), default=0) + 1,
+        'name': name,
+        'file_name': file_name,
+        'version': version,
+        'size': size,
+        'url': url,
+        'file_id': file_id
+    }
+    files.append(entry)
+    data['files'] = files
+    return entry if save_data(data) else None
+
+
+def update_file_entry(entry_id: int, **changes) -> bool:
+    """Изменяет поля записи каталога"""
+    data = load_config()
+    files = get_file_catalog(data)
+    for entry in files:
+        if entry['id'] == entry_id:
+            entry.update(changes)
+            data['files'] = files
+            return save_data(data)
+    return False
+
+
+def remove_file_entry(entry_id: int) -> bool:
+    """Удаляет файл из каталога"""
+    data = load_config()
+    files = get_file_catalog(data)
+    remaining = [entry for entry in files if entry['id'] != entry_id]
+    if len(remaining) == len(files):
+        return False
+    data['files'] = remaining
+    return save_data(data)
+
+
+def format_file_size(size: Optional[int]) -> str:
+    """Размер файла в читаемом виде"""
+    if not size:
+        return "размер неизвестен"
+    if size < 1024 * 1024:
+        return f"{size / 1024:.0f} КБ"
+    return f"{size / 1024 / 1024:.1f} МБ"
+
+
+def describe_file_entry(entry: dict) -> str:
+    """Название файла с версией для кнопок и подписей"""
+    if entry.get('version'):
+        return f"{entry['name']} v{entry['version']}"
+    return entry['name']
+
+
+async def fetch_file(url: str) -> Optional[bytes]:
+    """Скачивает файл по ссылке (None, если сервер ответил ошибкой)"""
+    # aiohttp нужен только здесь - импортируем при первой загрузке, а не при запуске бота
+    import aiohttp
+    async with aiohttp.ClientSession() as session:
+        async with session.get(url) as response:
+            if response.status != 200:
+                return None
+            return await response.read()
+
+
+async def deliver_file(screen, context: ContextTypes.DEFAULT_TYPE, entry: dict):
+    """
+    Показывает файл из каталога на месте экрана загрузки.
+    
+    Файл отправляется по кэшированному file_id; по ссылке он скачивается только при первой
+    выдаче (или если Telegram больше не принимает file_id), после чего file_id и размер
+    документа сохраняются в каталоге. Возвращает сообщение с файлом или None, если файл
+    получить не удалось.
+    """
+    caption = f"📥 <b>{describe_file_entry(entry)}</b>\n\nФайл успешно загружен!"
+    reply_markup = get_back_to_main_keyboard()
+    
+    if entry.get('file_id'):
         try:
-            await query.message.delete()
+            return await show_document(screen, context, entry['file_id'], entry['file_name'], caption, reply_markup)
         except Exception as e:
-            logger.warning(f"Не удалось удалить сообщение: {e}")
+            if not entry.get('url'):
+                raise
+            logger.warning(f"Кэшированный файл {entry['name']} недоступен, загружаем заново: {e}")
+    
+    if not entry.get('url'):
+        return None
+    
+    lock = _file_upload_locks.setdefault(entry['id'], asyncio.Lock())
+    async with lock:
+        # Пока ждали блокировку, файл мог загрузить другой пользователь
+        cached = find_file_entry(current_config(), entry['id'])
+        if cached and cached.get('file_id') and cached['file_id'] != entry.get('file_id'):
+            return await show_document(screen, context, cached['file_id'], entry['file_name'], caption, reply_markup)
         
-        # Сохраняем ID нового сообщения
-        user_messages[user_id] = sent_message.message_id
+        # При остановке бота скачивание и загрузка в Telegram ограничены сроком завершения
+        file_data = await shutdown_coordinator.run(fetch_file(entry['url']))
+        if file_data is None:
+            return None
+        sent_message = await shutdown_coordinator.run(
+            show_document(screen, context, file_data, entry['file_name'], caption, reply_markup)
+        )
+        document = getattr(sent_message, 'document', None)
+        if document:
+            update_file_entry(entry['id'], file_id=document.file_id, size=document.file_size or len(file_data))
+            logger.info(f"📎 Файл {entry['name']} загружен в Telegram, дальше выдается по file_id")
+        return sent_message
+
+
+def get_file_choice_keyboard(files: List[dict]) -> InlineKeyboardMarkup:
+    """Клавиатура выбора файла для скачивания"""
+    keyboard = [
+        [InlineKeyboardButton(f"📄 {describe_file_entry(entry)}", callback_data=f"download_file_{entry['id']}")]
+        for entry in files
+    ]
+    keyboard.append([InlineKeyboardButton("🔙 Главное меню", callback_data="main_menu")])
+    return InlineKeyboardMarkup(keyboard)
+
+
+@callback_router.route("download_here")
+async def download_here_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Скачивание файла через Telegram (если файлов несколько - выбор файла)"""
+    await download_file_callback(update, context, None)
+
+
+@callback_router.route("download_file_{entry_id:int}")
+async def download_file_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, entry_id: Optional[int]):
+    """Скачивание выбранного файла из каталога"""
+    query = update.callback_query
+    user_id = query.from_user.id
+    chat_id = query.message.chat_id
     
-    elif query.data == "channel_info":
-        await query.answer("Пожалуйста, подпишитесь на каналы через кнопки выше", show_alert=True)
+    await delete_previous_message(user_id, chat_id, context, keep_message_id=query.message.message_id)
     
-    elif query.data == "download_here":
-        # Скачивание через Telegram
-        await delete_previous_message(user_id, chat_id, context)
-        
-        logger.info(f"🔍 User {user_id} requested download via Telegram")
-        is_subscribed = await check_subscription(user_id, context)
-        logger.info(f"📊 Subscription check result for user {user_id}: {is_subscribed}")
-        
-        if is_subscribed:
-            loading_message_id = None
-            try:
-                try:
-                    with open("download.jpg", "rb") as photo:
-                        loading_message = await context.bot.send_photo(
-                            chat_id=chat_id,
-                            photo=photo,
-                            caption="📥 Загрузка файла..."
-                        )
-                except FileNotFoundError:
-                    loading_message = await query.message.reply_text("📥 Загрузка файла...")
-                loading_message_id = loading_message.message_id
-                
-                async with aiohttp.ClientSession() as session:
-                    async with session.get(FILE_URL) as response:
-                        if response.status == 200:
-                            file_data = await response.read()
-                            file_obj = BytesIO(file_data)
-                            file_obj.name = "Pro Tweaker Installer.exe"
-                            
-                            back_keyboard = [[InlineKeyboardButton("🔙 Главное меню", callback_data="main_menu")]]
-                            back_reply_markup = InlineKeyboardMarkup(back_keyboard)
-                            
-                            sent_message = await context.bot.send_document(
-                                chat_id=chat_id,
-                                document=InputFile(file_obj, filename="Pro Tweaker Installer.exe"),
-                                caption="📥 <b>Файл успешно загружен!</b>",
-                                reply_markup=back_reply_markup,
-                                parse_mode=ParseMode.HTML
-                            )
-                            
-                            if loading_message_id:
-                                try:
-                                    await context.bot.delete_message(chat_id=chat_id, message_id=loading_message_id)
-                                except Exception as e:
-                                    logger.warning(f"Не удалось удалить сообщение о загрузке: {e}")
-                            
-                            try:
-                                await query.message.delete()
-                            except Exception as e:
-                                logger.warning(f"Не удалось удалить исходное сообщение: {e}")
-                            
-                            user_messages[user_id] = sent_message.message_id
-                        else:
-                            if loading_message_id:
-                                try:
-                                    await context.bot.delete_message(chat_id=chat_id, message_id=loading_message_id)
-                                except Exception as e:
-                                    logger.warning(f"Не удалось удалить сообщение о загрузке: {e}")
-                            
-                            error_text = "❌ Ошибка при загрузке файла. Попробуйте позже."
-                            sent_message = await query.message.reply_text(error_text)
-                            user_messages[user_id] = sent_message.message_id
-            except Exception as e:
-                logger.error(f"Ошибка при загрузке файла: {e}")
-                
-                if loading_message_id:
-                    try:
-                        await context.bot.delete_message(chat_id=chat_id, message_id=loading_message_id)
-                    except Exception as e:
-                        logger.warning(f"Не удалось удалить сообщение о загрузке: {e}")
-                
-                error_text = "❌ Произошла ошибка при загрузке файла. Попробуйте позже."
-                sent_message = await query.message.reply_text(error_text)
-                user_messages[user_id] = sent_message.message_id
-        else:
-            keyboard = []
-            for i, channel_link in enumerate(CHANNEL_LINKS, 1):
-                keyboard.append([InlineKeyboardButton(
-                    f"📢 Подписаться на канал {i}",
-                    url=channel_link
-                )])
-            
-            keyboard.append([InlineKeyboardButton("✅ Проверить подписку", callback_data="check_subscription")])
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            
-            text = (
-                "❌ <b>Доступ запрещен</b>\n\n"
-                "Для скачивания файла необходимо подписаться на все каналы."
-            )
-            
-            sent_message = await query.message.reply_text(
-                text,
-                reply_markup=reply_markup,
-                parse_mode=ParseMode.HTML
+    logger.info(f"🔍 User {user_id} requested download via Telegram")
+    is_subscribed = await check_subscription(user_id, context)
+    logger.info(f"📊 Subscription check result for user {user_id}: {is_subscribed}")
+    
+    if is_subscribed:
+        files = get_file_catalog(current_config())
+        if entry_id is None and len(files) > 1:
+            sent_message = await show_screen(
+                query.message, context, "📁 <b>Выберите файл для скачивания:</b>",
+                get_file_choice_keyboard(files), "download.jpg"
             )
-            
-            try:
-                await query.message.delete()
-            except Exception as e:
-                logger.warning(f"Не удалось удалить сообщение: {e}")
-            
             user_messages[user_id] = sent_message.message_id
-    
-    elif query.data.startswith("admin_"):
-        # Перенаправляем админ-коллбэки в админ-обработчик
-        await admin_callback_handler(update, context)
-    
-    elif query.data == "main_menu":
-        # Удаляем предыдущее сообщение
-        await delete_previous_message(user_id, chat_id, context)
+            return
         
-        # Получаем главное меню
-        caption, reply_markup, image_path = await get_main_menu(user_id, context)
+        if entry_id is None:
+            entry = files[0] if files else None
+        else:
+            entry = next((item for item in files if item['id'] == entry_id), None)
         
-        # Отправляем изображение с главным меню
+        screen = query.message
         try:
-            with open(image_path, "rb") as photo:
-                sent_message = await context.bot.send_photo(
-                    chat_id=chat_id,
-                    photo=photo,
-                    caption=caption,
-                    reply_markup=reply_markup,
-                    parse_mode=ParseMode.HTML
-                )
-        except FileNotFoundError:
-            # Если файл не найден, отправляем текстовое сообщение
-            sent_message = await query.message.reply_text(
-                caption,
-                reply_markup=reply_markup,
-                parse_mode=ParseMode.HTML
-            )
+            # Показываем экран загрузки на месте текущего сообщения
+            screen = await show_screen(screen, context, "📥 Загрузка файла...", None, "download.jpg")
+            
+            sent_message = await deliver_file(screen, context, entry) if entry else None
+            if sent_message is not None:
+                screen = sent_message
+                bot_stats.record('downloads')
+                funnel_stats.record('download')
+            else:
+                error_text = "❌ Ошибка при загрузке файла. Попробуйте позже."
+                screen = await show_screen(screen, context, error_text, get_back_to_main_keyboard())
         except Exception as e:
-            logger.error(f"Ошибка при отправке изображения: {e}")
-            # В случае ошибки отправляем текстовое сообщение
-            sent_message = await query.message.reply_text(
-                caption,
-                reply_markup=reply_markup,
-                parse_mode=ParseMode.HTML
-            )
+            logger.error(f"Ошибка при загрузке файла: {e}")
+            
+            error_text = "❌ Произошла ошибка при загрузке файла. Попробуйте позже."
+            screen = await show_screen(screen, context, error_text, get_back_to_main_keyboard())
         
-        # Удаляем старое сообщение
-        try:
-            await query.message.delete()
-        except Exception as e:
-            logger.warning(f"Не удалось удалить сообщение: {e}")
+        user_messages[user_id] = screen.message_id
+    else:
+        reply_markup = get_subscribe_keyboard()
+        
+        text = (
+            "❌ <b>Доступ запрещен</b>\n\n"
+            "Для скачивания файла необходимо подписаться на все каналы."
+        )
         
-        # Сохраняем ID нового сообщения
+        sent_message = await show_screen(query.message, context, text, reply_markup)
         user_messages[user_id] = sent_message.message_id
+
+
+@callback_router.route("main_menu")
+async def main_menu_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Возврат в главное меню"""
+    query = update.callback_query
+    user_id = query.from_user.id
+    chat_id = query.message.chat_id
+    
+    # Удаляем предыдущее сообщение (текущее будет отредактировано)
+    await delete_previous_message(user_id, chat_id, context, keep_message_id=query.message.message_id)
+    
+    # Получаем главное меню
+    caption, reply_markup, image_path = await get_main_menu(user_id, context)
+    
+    # Показываем главное меню на месте текущего сообщения
+    sent_message = await show_screen(query.message, context, caption, reply_markup, image_path)
     
+    # Сохраняем ID сообщения
+    user_messages[user_id] = sent_message.message_id
 
 
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -756,30 +4059,7 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     caption, reply_markup, image_path = await get_main_menu(user_id, context)
     
     # Отправляем изображение с главным меню
-    try:
-        with open(image_path, "rb") as photo:
-            sent_message = await context.bot.send_photo(
-                chat_id=chat_id,
-                photo=photo,
-                caption=caption,
-                reply_markup=reply_markup,
-                parse_mode=ParseMode.HTML
-            )
-    except FileNotFoundError:
-        # Если файл не найден, отправляем текстовое сообщение
-        sent_message = await update.message.reply_text(
-            caption,
-            reply_markup=reply_markup,
-            parse_mode=ParseMode.HTML
-        )
-    except Exception as e:
-        logger.error(f"Ошибка при отправке изображения: {e}")
-        # В случае ошибки отправляем текстовое сообщение
-        sent_message = await update.message.reply_text(
-            caption,
-            reply_markup=reply_markup,
-            parse_mode=ParseMode.HTML
-        )
+    sent_message = await send_screen(chat_id, context, caption, reply_markup, image_path)
     
     # Сохраняем ID отправленного сообщения
     user_messages[user_id] = sent_message.message_id
@@ -800,29 +4080,12 @@ async def admin_panel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await delete_previous_message(user_id, chat_id, context)
     
     # Получаем статистику
-    data = load_data()
-    users_count = len(data.get('users', []))
-    admins_count = len(data.get('admins', []))
-    channels_count = len(data.get('channel_ids', []))
-    banned_count = len(data.get('banned_users', []))
+    users_count = len(users_index)
+    admins_count = len(ADMIN_IDS)
+    channels_count = len(CHANNEL_IDS)
+    banned_count = len(banned_index)
     
-    keyboard = [
-        [InlineKeyboardButton("📊 Статистика", callback_data="admin_stats")],
-        [InlineKeyboardButton("📢 Управление каналами", callback_data="admin_channels")],
-        [InlineKeyboardButton("🔗 Управление ссылками", callback_data="admin_links")],
-        [InlineKeyboardButton("📁 Управление файлами", callback_data="admin_files")],
-        [InlineKeyboardButton("👥 Управление админами", callback_data="admin_admins")],
-        [InlineKeyboardButton("👤 Просмотр пользователей", callback_data="admin_users")],
-        [InlineKeyboardButton("🚫 Бан/Разбан пользователей", callback_data="admin_ban")],
-        [InlineKeyboardButton("📝 Управление текстами", callback_data="admin_texts")],
-        [InlineKeyboardButton("🖼️ Управление изображениями", callback_data="admin_images")],
-        [InlineKeyboardButton("📨 Рассылка", callback_data="admin_broadcast")],
-        [InlineKeyboardButton("📋 Логи действий", callback_data="admin_logs")],
-        [InlineKeyboardButton("⚙️ Настройки бота", callback_data="admin_settings")],
-        [InlineKeyboardButton("💾 Экспорт/Импорт данных", callback_data="admin_export")],
-        [InlineKeyboardButton("🔙 Главное меню", callback_data="main_menu")]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    reply_markup = get_admin_panel_keyboard()
     
     text = (
         "🔐 <b>Расширенная админ-панель</b>\n\n"
@@ -843,24 +4106,75 @@ async def admin_panel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_messages[user_id] = sent_message.message_id
 
 
-async def admin_channels_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Меню управления каналами"""
-    query = update.callback_query
-    user_id = query.from_user.id
+async def restore_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Восстановление данных из снимка (только главный админ).
     
-    if not is_admin(user_id):
-        await query.answer("❌ У вас нет доступа", show_alert=True)
+    /restore - список точек восстановления, /restore N - восстановить точку N.
+    Перед восстановлением текущие данные сохраняются полным снимком.
+    """
+    user_id = update.effective_user.id
+    if user_id != MAIN_ADMIN_ID:
+        await update.message.reply_text("❌ Восстановление доступно только главному администратору.")
+        return
+    
+    points = await asyncio.to_thread(snapshot_store.list_points)
+    if not points:
+        await update.message.reply_text("📭 Снимков данных пока нет")
+        return
+    
+    if not context.args:
+        lines = []
+        for number, (base, delta_count, ts) in enumerate(points[:20], 1):
+            kind = "полный снимок" if delta_count == 0 else f"изменения #{delta_count}"
+            lines.append(f"{number}. {datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M')} - {kind}")
+        await update.message.reply_text(
+            "💾 <b>Точки восстановления</b>\n\n" + "\n".join(lines) +
+            "\n\nДля восстановления отправьте /restore N",
+            parse_mode=ParseMode.HTML
+        )
+        return
+    
+    try:
+        number = int(context.args[0])
+        if number < 1:
+            raise IndexError
+        base, delta_count, ts = points[number - 1]
+    except (ValueError, IndexError):
+        await update.message.reply_text("❌ Неверный номер точки восстановления")
+        return
+    
+    try:
+        restored = await asyncio.to_thread(snapshot_store.restore, base, delta_count)
+        await asyncio.to_thread(snapshot_store.checkpoint, snapshot_data(), True)
+    except Exception as e:
+        logger.error(f"Ошибка при восстановлении снимка: {e}")
+        await update.message.reply_text(f"❌ Ошибка при восстановлении: {str(e)}")
         return
     
-    await query.answer()
+    if save_data(restored):
+        log_action(user_id, f"Восстановил данные из снимка {base} (+{delta_count})")
+        await update.message.reply_text(
+            f"✅ Данные восстановлены на {datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M')}\n"
+            f"👥 Пользователей: {len(restored.get('users', []))}"
+        )
+    else:
+        await update.message.reply_text("❌ Ошибка при сохранении данных")
+
+
+@callback_router.route("admin_channels", admin=True)
+async def admin_channels_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Меню управления каналами"""
+    query = update.callback_query
     
-    data = load_data()
+    data = current_config()
     channels = data.get('channel_ids', [])
     
     keyboard = []
     for i, channel_id in enumerate(channels, 1):
+        icon = "⚠️" if channel_health.is_degraded(channel_id) else "📢"
         keyboard.append([InlineKeyboardButton(
-            f"📢 Канал {i} (ID: {channel_id})",
+            f"{icon} Канал {i} (ID: {channel_id})",
             callback_data=f"admin_channel_edit_{i}"
         )])
     
@@ -870,27 +4184,31 @@ async def admin_channels_menu(update: Update, context: ContextTypes.DEFAULT_TYPE
     ])
     reply_markup = InlineKeyboardMarkup(keyboard)
     
+    degraded = [channel for channel in subscription_channels() if channel_health.is_degraded(channel)]
+    degraded_text = ""
+    if degraded:
+        degraded_text = "⚠️ Бот не может проверять каналы (они пропускаются при проверке подписки):\n"
+        for channel in degraded:
+            reason = channel_health.channels[str(channel)]['reason']
+            degraded_text += f"• <code>{channel}</code>: {html.escape(reason)}\n"
+        degraded_text += "\n"
+    
     text = (
         "📢 <b>Управление каналами</b>\n\n"
         f"Текущие каналы: {len(channels)}\n\n"
+        f"{degraded_text}"
         "Выберите канал для редактирования или добавьте новый:"
     )
     
     await query.message.edit_text(text, reply_markup=reply_markup, parse_mode=ParseMode.HTML)
 
 
+@callback_router.route("admin_links", admin=True)
 async def admin_links_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Меню управления ссылками"""
     query = update.callback_query
-    user_id = query.from_user.id
     
-    if not is_admin(user_id):
-        await query.answer("❌ У вас нет доступа", show_alert=True)
-        return
-    
-    await query.answer()
-    
-    data = load_data()
+    data = current_config()
     links = data.get('channel_links', [])
     
     keyboard = []
@@ -915,77 +4233,159 @@ async def admin_links_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await query.message.edit_text(text, reply_markup=reply_markup, parse_mode=ParseMode.HTML)
 
 
+def render_files_menu() -> tuple:
+    """Текст и кнопки меню управления файлами"""
+    files = get_file_catalog(current_config())
+    
+    keyboard = [
+        [InlineKeyboardButton(f"📄 {describe_file_entry(entry)}", callback_data=f"admin_file_{entry['id']}")]
+        for entry in files
+    ]
+    keyboard.extend([
+        [InlineKeyboardButton("➕ Добавить по ссылке", callback_data="admin_file_add")],
+        [InlineKeyboardButton("📤 Загрузить файл", callback_data="admin_file_upload")],
+        [InlineKeyboardButton("🔙 Назад", callback_data="admin_panel")]
+    ])
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    
+    text = (
+        "📁 <b>Управление файлами</b>\n\n"
+        f"Файлов в каталоге: {len(files)}\n"
+        "Пользователи выбирают файл из списка, если файлов несколько.\n\n"
+        "Выберите файл для редактирования или добавьте новый:"
+    )
+    return text, reply_markup
+
+
+@callback_router.route("admin_files", admin=True)
 async def admin_files_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Меню управления файлами"""
     query = update.callback_query
-    user_id = query.from_user.id
-    
-    if not is_admin(user_id):
-        await query.answer("❌ У вас нет доступа", show_alert=True)
+    text, reply_markup = render_files_menu()
+    await query.message.edit_text(text, reply_markup=reply_markup, parse_mode=ParseMode.HTML)
+
+
+async def send_files_menu(message):
+    """Меню управления файлами новым сообщением (после ввода данных администратором)"""
+    text, reply_markup = render_files_menu()
+    await message.reply_text(text, reply_markup=reply_markup, parse_mode=ParseMode.HTML)
+
+
+@callback_router.route("admin_file_{entry_id:int}", admin=True, answer=False)
+async def admin_file_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, entry_id: int):
+    """Карточка файла из каталога"""
+    query = update.callback_query
+    entry = find_file_entry(current_config(), entry_id)
+    if entry is None:
+        await answer_query(query, "❌ Файл не найден", show_alert=True)
         return
     
-    await query.answer()
-    
-    data = load_data()
-    file_url = data.get('file_url', FILE_URL)
+    await answer_query(query)
     
     keyboard = [
-        [InlineKeyboardButton("📝 Изменить ссылку на файл", callback_data="admin_file_edit")],
-        [InlineKeyboardButton("📤 Загрузить файл", callback_data="admin_file_upload")],
-        [InlineKeyboardButton("🔙 Назад", callback_data="admin_panel")]
+        [InlineKeyboardButton("📝 Изменить ссылку", callback_data=f"admin_file_url_{entry_id}")],
+        [InlineKeyboardButton("🏷️ Изменить версию", callback_data=f"admin_file_version_{entry_id}")]
     ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    if entry.get('url') and entry.get('file_id'):
+        keyboard.append([InlineKeyboardButton("🔄 Загрузить заново по ссылке", callback_data=f"admin_file_reset_{entry_id}")])
+    keyboard.extend([
+        [InlineKeyboardButton("🗑️ Удалить", callback_data=f"admin_file_delete_{entry_id}")],
+        [InlineKeyboardButton("🔙 Назад", callback_data="admin_files")]
+    ])
     
+    source = f"<code>{entry['url']}</code>" if entry.get('url') else "загружен в бота"
+    cached = "✅ в Telegram, выдается без повторной загрузки" if entry.get('file_id') else "⏳ будет загружен при первой выдаче"
     text = (
-        "📁 <b>Управление файлами</b>\n\n"
-        f"Текущая ссылка:\n<code>{file_url}</code>\n\n"
-        "Выберите действие:"
+        f"📄 <b>{describe_file_entry(entry)}</b>\n\n"
+        f"Имя файла: <code>{entry['file_name']}</code>\n"
+        f"Размер: {format_file_size(entry.get('size'))}\n"
+        f"Источник: {source}\n"
+        f"Кэш: {cached}"
     )
     
-    await query.message.edit_text(text, reply_markup=reply_markup, parse_mode=ParseMode.HTML)
+    await query.message.edit_text(text, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode=ParseMode.HTML)
 
 
-async def admin_admins_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Меню управления администраторами"""
+@callback_router.route("admin_file_url_{entry_id:int}", admin=True)
+async def admin_file_url_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, entry_id: int):
+    """Запрашивает новую ссылку на файл"""
     query = update.callback_query
     user_id = query.from_user.id
     
-    if not is_admin(user_id):
-        try:
-            await query.answer("❌ У вас нет доступа", show_alert=True)
-        except:
-            pass
-        return
+    entry = find_file_entry(current_config(), entry_id)
+    if entry is not None:
+        admin_states[user_id] = f"edit_file_url_{entry_id}"
+        await query.message.edit_text(
+            f"📝 <b>Изменение ссылки на файл</b>\n\n"
+            f"Файл: {describe_file_entry(entry)}\n"
+            f"Текущая ссылка: {entry.get('url') or 'нет'}\n\n"
+            f"Отправьте новую ссылку на файл:",
+            parse_mode=ParseMode.HTML
+        )
+
+
+@callback_router.route("admin_file_version_{entry_id:int}", admin=True)
+async def admin_file_version_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, entry_id: int):
+    """Запрашивает новую версию файла"""
+    query = update.callback_query
+    user_id = query.from_user.id
     
-    try:
-        await query.answer()
-    except:
-        pass
+    entry = find_file_entry(current_config(), entry_id)
+    if entry is not None:
+        admin_states[user_id] = f"edit_file_version_{entry_id}"
+        await query.message.edit_text(
+            f"🏷️ <b>Изменение версии</b>\n\n"
+            f"Файл: {entry['name']}\n"
+            f"Текущая версия: {entry.get('version') or 'не указана'}\n\n"
+            f"Отправьте новую версию (например: 2.1) или '-' чтобы убрать ее:",
+            parse_mode=ParseMode.HTML
+        )
+
+
+@callback_router.route("admin_file_reset_{entry_id:int}", admin=True)
+async def admin_file_reset_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, entry_id: int):
+    """Сбрасывает кэшированный file_id: файл заново скачается по ссылке при следующей выдаче"""
+    user_id = update.callback_query.from_user.id
+    if update_file_entry(entry_id, file_id=None, size=None):
+        log_action(user_id, f"Сбросил кэш файла {entry_id}")
+    await admin_file_callback(update, context, entry_id)
+
+
+@callback_router.route("admin_file_delete_{entry_id:int}", admin=True)
+async def admin_file_delete_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, entry_id: int):
+    """Удаляет файл из каталога"""
+    user_id = update.callback_query.from_user.id
+    if remove_file_entry(entry_id):
+        log_action(user_id, f"Удалил файл {entry_id} из каталога")
+    await admin_files_menu(update, context)
+
+
+@callback_router.route("admin_admins", admin=True)
+async def admin_admins_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Меню управления администраторами"""
+    query = update.callback_query
+    user_id = query.from_user.id
     
-    data = load_data()
+    data = current_config()
     admins = data.get('admins', [])
     
+    # Имена всех админов запрашиваются параллельно через общий кэш
+    chats = await chat_info_cache.get_many(context.bot, admins)
+    
     keyboard = []
     for admin_id in admins:
-        try:
-            user = await context.bot.get_chat(admin_id)
+        user = chats.get(admin_id)
+        if user is not None:
             username = user.username if user.username else (user.first_name or f"ID: {admin_id}")
             display_name = f"👤 {username}"
-            if admin_id == user_id:
-                display_name += " (Вы)"
-            keyboard.append([InlineKeyboardButton(
-                display_name,
-                callback_data=f"admin_remove_{admin_id}"
-            )])
-        except Exception as e:
-            logger.warning(f"Не удалось получить информацию о пользователе {admin_id}: {e}")
+        else:
             display_name = f"👤 ID: {admin_id}"
-            if admin_id == user_id:
-                display_name += " (Вы)"
-            keyboard.append([InlineKeyboardButton(
-                display_name,
-                callback_data=f"admin_remove_{admin_id}"
-            )])
+        if admin_id == user_id:
+            display_name += " (Вы)"
+        keyboard.append([InlineKeyboardButton(
+            display_name,
+            callback_data=f"admin_remove_{admin_id}"
+        )])
     
     keyboard.extend([
         [InlineKeyboardButton("➕ Добавить админа", callback_data="admin_add")],
@@ -1015,20 +4415,12 @@ async def admin_admins_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
             pass
 
 
+@callback_router.route("admin_broadcast", admin=True)
 async def admin_broadcast_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Меню рассылки"""
     query = update.callback_query
-    user_id = query.from_user.id
-    
-    if not is_admin(user_id):
-        await query.answer("❌ У вас нет доступа", show_alert=True)
-        return
     
-    await query.answer()
-    
-    # Получаем количество пользователей
-    users = get_all_users()
-    users_count = len(users)
+    users_count = len(users_index)
     
     keyboard = [
         [InlineKeyboardButton("📨 Начать рассылку", callback_data="admin_broadcast_start")],
@@ -1046,28 +4438,21 @@ async def admin_broadcast_menu(update: Update, context: ContextTypes.DEFAULT_TYP
     await query.message.edit_text(text, reply_markup=reply_markup, parse_mode=ParseMode.HTML)
 
 
+@callback_router.route("admin_stats", admin=True)
 async def admin_stats_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Меню статистики"""
     query = update.callback_query
-    user_id = query.from_user.id
-    
-    if not is_admin(user_id):
-        await query.answer("❌ У вас нет доступа", show_alert=True)
-        return
-    
-    await query.answer()
-    
-    data = load_data()
-    users = data.get('users', [])
-    admins = data.get('admins', [])
-    channels = data.get('channel_ids', [])
-    links = data.get('channel_links', [])
-    banned = data.get('banned_users', [])
     
-    # Подсчитываем активных пользователей (тех, кто не забанен)
-    active_users = [u for u in users if u not in banned]
+    # Все значения берутся из счетчиков и индексов, без чтения файла данных
+    users_total = len(users_index)
+    banned_total = len(banned_index)
+    checks_pass = bot_stats.day['sub_pass'].total(7)
+    checks_fail = bot_stats.day['sub_fail'].total(7)
+    checks_total = checks_pass + checks_fail
+    pass_rate = f"{checks_pass * 100 / checks_total:.0f}%" if checks_total else "—"
     
     keyboard = [
+        [InlineKeyboardButton("🎯 Воронка", callback_data="admin_funnel")],
         [InlineKeyboardButton("🔄 Обновить", callback_data="admin_stats")],
         [InlineKeyboardButton("🔙 Назад", callback_data="admin_panel")]
     ]
@@ -1076,34 +4461,88 @@ async def admin_stats_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     text = (
         "📊 <b>Статистика бота</b>\n\n"
         f"👥 <b>Пользователи:</b>\n"
-        f"   • Всего: <b>{len(users)}</b>\n"
-        f"   • Активных: <b>{len(active_users)}</b>\n"
-        f"   • Забанено: <b>{len(banned)}</b>\n\n"
-        f"👤 <b>Администраторы:</b> <b>{len(admins)}</b>\n\n"
+        f"   • Всего: <b>{users_total}</b>\n"
+        f"   • Активных: <b>{bot_stats.active_users()}</b>\n"
+        f"   • Забанено: <b>{banned_total}</b>\n"
+        f"   • Новых сегодня: <b>{bot_stats.day['new_users'].current()}</b> "
+        f"(за час: {bot_stats.minute['new_users'].total()})\n"
+        f"   • DAU: <b>{bot_stats.active_day.current()}</b> "
+        f"(за 5 мин: {bot_stats.active_minute.total(5)})\n\n"
+        f"📈 <b>За 14 дней:</b>\n"
+        f"   • Активные: <code>{sparkline(bot_stats.active_day.values()[-14:])}</code>\n"
+        f"   • Новые: <code>{sparkline(bot_stats.day['new_users'].values()[-14:])}</code>\n\n"
+        f"✅ <b>Проверки подписки (7 дней):</b> {checks_total}, успешных: <b>{pass_rate}</b>\n"
+        f"📥 <b>Скачиваний:</b> сегодня {bot_stats.day['downloads'].current()}, "
+        f"за 7 дней {bot_stats.day['downloads'].total(7)}\n"
+        f"📨 <b>Рассылок (30 дней):</b> {bot_stats.day['broadcasts'].total()}\n\n"
+        f"👤 <b>Администраторы:</b> <b>{len(ADMIN_IDS)}</b>\n\n"
         f"📢 <b>Каналы:</b>\n"
-        f"   • ID каналов: <b>{len(channels)}</b>\n"
-        f"   • Ссылок: <b>{len(links)}</b>\n\n"
-        f"📋 <b>Логи:</b> <b>{len(action_logs)}</b> записей\n\n"
-        f"⏰ <b>Время:</b> {asyncio.get_event_loop().time():.0f}"
+        f"   • ID каналов: <b>{len(CHANNEL_IDS)}</b>\n"
+        f"   • Ссылок: <b>{len(CHANNEL_LINKS)}</b>\n\n"
+        f"📋 <b>Логи:</b> <b>{await action_log.count()}</b> записей\n\n"
+        f"⚡ <b>Обработка кнопок:</b>\n{callback_router.format_stats()}\n\n"
+        f"🔌 <b>Вызовы Telegram:</b>\n{api_guard.format_status()}\n"
+        f"{outbound_scheduler.format_status()}\n\n"
+        f"🔗 <b>Пулы соединений:</b>\n{format_pools_status()}\n\n"
+        f"⏰ <b>Время:</b> {datetime.now().strftime('%Y-%m-%d %H:%M')} "
+        f"(работает {format_uptime(time.time() - bot_stats.started_at)})"
     )
     
     await query.message.edit_text(text, reply_markup=reply_markup, parse_mode=ParseMode.HTML)
 
 
-async def admin_users_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Меню просмотра пользователей"""
+@callback_router.route("admin_funnel", admin=True)
+@callback_router.route("admin_funnel_{days:int}", admin=True)
+async def admin_funnel_menu(update: Update, context: ContextTypes.DEFAULT_TYPE, days: int = 7):
+    """Воронка конверсии"""
     query = update.callback_query
-    user_id = query.from_user.id
     
-    if not is_admin(user_id):
-        await query.answer("❌ У вас нет доступа", show_alert=True)
-        return
+    days = max(1, min(days, FUNNEL_RETENTION_DAYS))
+    stages, channels = funnel_stats.totals(days)
+    
+    lines = []
+    previous = None
+    for stage in FUNNEL_STAGES:
+        count = stages.get(stage, 0)
+        line = f"{FUNNEL_STAGE_NAMES[stage]}: <b>{count}</b>"
+        if previous is not None:
+            line += f" ({count * 100 / previous:.0f}%)" if previous else " (—)"
+        lines.append(line)
+        previous = count
+    
+    channel_lines = []
+    for channel, (passed, total) in sorted(channels.items(), key=lambda item: -item[1][1]):
+        rate = f"{passed * 100 / total:.0f}%" if total else "—"
+        channel_lines.append(f"   • {html.escape(channel)}: {passed}/{total} ({rate})")
+    
+    keyboard = [
+        [
+            InlineKeyboardButton("Сегодня", callback_data="admin_funnel_1"),
+            InlineKeyboardButton("7 дней", callback_data="admin_funnel_7"),
+            InlineKeyboardButton("30 дней", callback_data="admin_funnel_30")
+        ],
+        [InlineKeyboardButton("📤 Экспорт CSV", callback_data="admin_funnel_csv")],
+        [InlineKeyboardButton("🔙 Назад", callback_data="admin_stats")]
+    ]
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    
+    text = (
+        f"🎯 <b>Воронка конверсии</b> (дней: {days})\n\n"
+        + "\n".join(lines)
+        + "\n\n📢 <b>Подписка по каналам:</b>\n"
+        + ("\n".join(channel_lines) if channel_lines else "   Нет данных")
+    )
     
-    await query.answer()
+    await query.message.edit_text(text, reply_markup=reply_markup, parse_mode=ParseMode.HTML)
+
+
+@callback_router.route("admin_users", admin=True)
+async def admin_users_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Меню просмотра пользователей"""
+    query = update.callback_query
     
-    data = load_data()
-    users = data.get('users', [])
-    banned = data.get('banned_users', [])
+    users_total = len(users_index)
+    banned_total = len(banned_index)
     
     keyboard = [
         [InlineKeyboardButton("🔍 Поиск пользователя", callback_data="admin_user_search")],
@@ -1114,28 +4553,21 @@ async def admin_users_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     text = (
         "👤 <b>Просмотр пользователей</b>\n\n"
-        f"👥 Всего пользователей: <b>{len(users)}</b>\n"
-        f"🚫 Забанено: <b>{len(banned)}</b>\n"
-        f"✅ Активных: <b>{len(users) - len(banned)}</b>\n\n"
+        f"👥 Всего пользователей: <b>{users_total}</b>\n"
+        f"🚫 Забанено: <b>{banned_total}</b>\n"
+        f"✅ Активных: <b>{bot_stats.active_users()}</b>\n\n"
         "Выберите действие:"
     )
     
     await query.message.edit_text(text, reply_markup=reply_markup, parse_mode=ParseMode.HTML)
 
 
+@callback_router.route("admin_ban", admin=True)
 async def admin_ban_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Меню бана/разбана пользователей"""
     query = update.callback_query
-    user_id = query.from_user.id
-    
-    if not is_admin(user_id):
-        await query.answer("❌ У вас нет доступа", show_alert=True)
-        return
     
-    await query.answer()
-    
-    data = load_data()
-    banned = data.get('banned_users', [])
+    banned_count = len(banned_index)
     
     keyboard = [
         [InlineKeyboardButton("🚫 Забанить пользователя", callback_data="admin_ban_add")],
@@ -1147,25 +4579,19 @@ async def admin_ban_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     text = (
         "🚫 <b>Бан/Разбан пользователей</b>\n\n"
-        f"Забанено пользователей: <b>{len(banned)}</b>\n\n"
+        f"Забанено пользователей: <b>{banned_count}</b>\n\n"
         "Выберите действие:"
     )
     
     await query.message.edit_text(text, reply_markup=reply_markup, parse_mode=ParseMode.HTML)
 
 
+@callback_router.route("admin_texts", admin=True)
 async def admin_texts_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Меню управления текстами"""
     query = update.callback_query
-    user_id = query.from_user.id
     
-    if not is_admin(user_id):
-        await query.answer("❌ У вас нет доступа", show_alert=True)
-        return
-    
-    await query.answer()
-    
-    data = load_data()
+    data = current_config()
     messages = data.get('messages', {})
     
     keyboard = [
@@ -1186,18 +4612,12 @@ async def admin_texts_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await query.message.edit_text(text, reply_markup=reply_markup, parse_mode=ParseMode.HTML)
 
 
+@callback_router.route("admin_images", admin=True)
 async def admin_images_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Меню управления изображениями"""
     query = update.callback_query
-    user_id = query.from_user.id
-    
-    if not is_admin(user_id):
-        await query.answer("❌ У вас нет доступа", show_alert=True)
-        return
     
-    await query.answer()
-    
-    data = load_data()
+    data = current_config()
     images = data.get('images', {})
     
     keyboard = [
@@ -1219,55 +4639,65 @@ async def admin_images_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await query.message.edit_text(text, reply_markup=reply_markup, parse_mode=ParseMode.HTML)
 
 
-async def admin_logs_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
+# Записей журнала на одной странице
+LOGS_PAGE_SIZE = 10
+
+
+@callback_router.route("admin_logs", admin=True)
+async def admin_logs_menu(update: Update, context: ContextTypes.DEFAULT_TYPE, page: int = 0):
     """Меню логов действий"""
     query = update.callback_query
-    user_id = query.from_user.id
-    
-    if not is_admin(user_id):
-        await query.answer("❌ У вас нет доступа", show_alert=True)
-        return
-    
-    await query.answer()
     
-    # Показываем последние 10 логов
-    recent_logs = action_logs[-10:] if len(action_logs) > 10 else action_logs
+    # Показываем одну страницу журнала (от новых записей к старым)
+    total = await action_log.count()
+    pages = max(1, (total + LOGS_PAGE_SIZE - 1) // LOGS_PAGE_SIZE)
+    page = min(max(page, 0), pages - 1)
+    recent_logs = await action_log.run(action_log.page, page * LOGS_PAGE_SIZE, LOGS_PAGE_SIZE)
     logs_text = ""
-    for log in reversed(recent_logs):
+    for log in recent_logs:
         timestamp = log.get('timestamp', 'N/A')
         action = log.get('action', 'N/A')
         admin_id = log.get('admin_id', 'N/A')
         logs_text += f"⏰ {timestamp}\n📝 {action}\n👤 Admin: {admin_id}\n\n"
     
-    keyboard = [
+    navigation = []
+    if page > 0:
+        navigation.append(InlineKeyboardButton("⬅️ Новее", callback_data=f"admin_logs_page_{page - 1}"))
+    if page < pages - 1:
+        navigation.append(InlineKeyboardButton("Старее ➡️", callback_data=f"admin_logs_page_{page + 1}"))
+    
+    keyboard = [navigation] if navigation else []
+    keyboard.extend([
         [InlineKeyboardButton("🔄 Обновить", callback_data="admin_logs")],
         [InlineKeyboardButton("🗑️ Очистить логи", callback_data="admin_logs_clear")],
         [InlineKeyboardButton("💾 Экспорт логов", callback_data="admin_logs_export")],
+        [InlineKeyboardButton("💾 За 24 часа", callback_data="admin_logs_export_day"),
+         InlineKeyboardButton("💾 Мои действия", callback_data="admin_logs_export_mine")],
         [InlineKeyboardButton("🔙 Назад", callback_data="admin_panel")]
-    ]
+    ])
     reply_markup = InlineKeyboardMarkup(keyboard)
     
     text = (
         "📋 <b>Логи действий</b>\n\n"
-        f"Всего записей: <b>{len(action_logs)}</b>\n\n"
+        f"Всего записей: <b>{total}</b> (страница {page + 1} из {pages})\n\n"
         f"<b>Последние действия:</b>\n\n{logs_text if logs_text else 'Логов пока нет'}"
     )
     
     await query.message.edit_text(text, reply_markup=reply_markup, parse_mode=ParseMode.HTML)
 
 
+@callback_router.route("admin_logs_page_{page:int}", admin=True)
+async def admin_logs_page_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, page: int):
+    """Листание журнала действий"""
+    await admin_logs_menu(update, context, page=page)
+
+
+@callback_router.route("admin_settings", admin=True)
 async def admin_settings_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Меню настроек бота"""
     query = update.callback_query
-    user_id = query.from_user.id
     
-    if not is_admin(user_id):
-        await query.answer("❌ У вас нет доступа", show_alert=True)
-        return
-    
-    await query.answer()
-    
-    data = load_data()
+    data = current_config()
     settings = data.get('settings', {})
     
     auto_delete = settings.get('auto_delete_messages', False)
@@ -1290,20 +4720,15 @@ async def admin_settings_menu(update: Update, context: ContextTypes.DEFAULT_TYPE
     await query.message.edit_text(text, reply_markup=reply_markup, parse_mode=ParseMode.HTML)
 
 
+@callback_router.route("admin_export", admin=True)
 async def admin_export_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Меню экспорта/импорта данных"""
     query = update.callback_query
-    user_id = query.from_user.id
-    
-    if not is_admin(user_id):
-        await query.answer("❌ У вас нет доступа", show_alert=True)
-        return
-    
-    await query.answer()
     
     keyboard = [
-        [InlineKeyboardButton("💾 Экспорт данных (JSON)", callback_data="admin_export_json")],
-        [InlineKeyboardButton("📥 Импорт данных", callback_data="admin_import_data")],
+        [InlineKeyboardButton("💾 Экспорт данных (NDJSON)", callback_data="admin_export_json")],
+        [InlineKeyboardButton("📥 Импорт (объединить)", callback_data="admin_import_data")],
+        [InlineKeyboardButton("♻️ Импорт (заменить)", callback_data="admin_import_replace")],
         [InlineKeyboardButton("🔄 Резервная копия", callback_data="admin_backup")],
         [InlineKeyboardButton("🔙 Назад", callback_data="admin_panel")]
     ]
@@ -1320,156 +4745,195 @@ async def admin_export_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await query.message.edit_text(text, reply_markup=reply_markup, parse_mode=ParseMode.HTML)
 
 
-async def admin_callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обработчик callback для админ-панели"""
+# ==================== CALLBACK-МАРШРУТЫ АДМИН-ПАНЕЛИ ====================
+
+# Маршруты, которые только переводят админа в состояние ввода: callback_data -> (состояние, текст запроса)
+ADMIN_PROMPTS = {
+    "admin_channel_add": (
+        "add_channel",
+        "➕ <b>Добавление канала</b>\n\n"
+        "Отправьте ID канала (например: -1001234567890):"
+    ),
+    "admin_link_add": (
+        "add_link",
+        "➕ <b>Добавление ссылки</b>\n\n"
+        "Отправьте ссылку на канал (например: https://t.me/channel):"
+    ),
+    "admin_file_add": (
+        "add_file",
+        "➕ <b>Добавление файла</b>\n\n"
+        "Отправьте ссылку на файл.\n"
+        "Можно указать название и версию: <code>Название | ссылка | версия</code>"
+    ),
+    "admin_file_upload": (
+        "upload_file",
+        "📤 <b>Загрузка файла</b>\n\n"
+        "Отправьте файл, который хотите добавить в каталог.\n"
+        "В подписи можно указать название и версию: <code>Название | версия</code>"
+    ),
+    "admin_ban_add": (
+        "ban_user",
+        "🚫 <b>Забанить пользователя</b>\n\n"
+        "Отправьте ID пользователя для бана:"
+    ),
+    "admin_ban_remove": (
+        "unban_user",
+        "✅ <b>Разбанить пользователя</b>\n\n"
+        "Отправьте ID пользователя для разбана:"
+    ),
+    "admin_user_search": (
+        "search_user",
+        "🔍 <b>Поиск пользователя</b>\n\n"
+        "Отправьте ID, @username или начало имени пользователя:"
+    ),
+    "admin_text_welcome": (
+        "edit_text_welcome",
+        "✏️ <b>Редактирование приветствия</b>\n\n"
+        "Отправьте новый текст приветствия:"
+    ),
+    "admin_text_success": (
+        "edit_text_success",
+        "✏️ <b>Редактирование текста успеха</b>\n\n"
+        "Отправьте новый текст:"
+    ),
+    "admin_text_error": (
+        "edit_text_error",
+        "✏️ <b>Редактирование текста ошибки</b>\n\n"
+        "Отправьте новый текст:"
+    ),
+    "admin_image_preview": (
+        "upload_image_preview",
+        "🖼️ <b>Загрузка Preview.png</b>\n\n"
+        "Отправьте изображение:"
+    ),
+    "admin_image_success": (
+        "upload_image_success",
+        "🖼️ <b>Загрузка succes.png</b>\n\n"
+        "Отправьте изображение:"
+    ),
+    "admin_image_error": (
+        "upload_image_error",
+        "🖼️ <b>Загрузка error.png</b>\n\n"
+        "Отправьте изображение:"
+    ),
+    "admin_image_download": (
+        "upload_image_download",
+        "🖼️ <b>Загрузка download.jpg</b>\n\n"
+        "Отправьте изображение:"
+    ),
+    "admin_import_data": (
+        "import_data_merge",
+        "📥 <b>Импорт данных (объединение)</b>\n\n"
+        "Отправьте файл экспорта (.ndjson.gz) или JSON файл с данными.\n"
+        "Пользователи, баны, админы и логи будут добавлены к текущим без дубликатов."
+    ),
+    "admin_import_replace": (
+        "import_data_replace",
+        "♻️ <b>Импорт данных (замена)</b>\n\n"
+        "Отправьте файл экспорта (.ndjson.gz) или JSON файл с данными.\n"
+        "Разделы, которые есть в файле, полностью заменят текущие. "
+        "Главный админ и вы останетесь администраторами."
+    ),
+}
+
+
+def register_admin_prompt(callback_data: str, state: str, text: str):
+    """Регистрирует маршрут, который переводит админа в состояние ввода"""
+    async def admin_prompt_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        query = update.callback_query
+        admin_states[query.from_user.id] = state
+        await query.message.edit_text(text, parse_mode=ParseMode.HTML)
+    
+    callback_router.add(callback_data, admin_prompt_callback, admin=True)
+
+
+for _callback_data, (_state, _text) in ADMIN_PROMPTS.items():
+    register_admin_prompt(_callback_data, _state, _text)
+
+
+@callback_router.route("admin_panel", admin=True)
+async def admin_panel_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Возврат в главное меню админ-панели"""
     query = update.callback_query
     
-    if not query:
-        return
+    # Получаем статистику
+    users_count = len(users_index)
+    admins_count = len(ADMIN_IDS)
+    channels_count = len(CHANNEL_IDS)
+    banned_count = len(banned_index)
     
+    reply_markup = get_admin_panel_keyboard()
+    text = (
+        "🔐 <b>Расширенная админ-панель</b>\n\n"
+        f"📊 <b>Быстрая статистика:</b>\n"
+        f"👥 Пользователей: <b>{users_count}</b>\n"
+        f"👤 Админов: <b>{admins_count}</b>\n"
+        f"📢 Каналов: <b>{channels_count}</b>\n"
+        f"🚫 Забанено: <b>{banned_count}</b>\n\n"
+        "Выберите действие:"
+    )
+    await query.message.edit_text(text, reply_markup=reply_markup, parse_mode=ParseMode.HTML)
+
+
+@callback_router.route("admin_link_edit_{index:int}", admin=True)
+async def admin_link_edit_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, index: int):
+    """Запрашивает новую ссылку вместо выбранной"""
+    query = update.callback_query
     user_id = query.from_user.id
-    chat_id = query.message.chat_id
-    
-    if not is_admin(user_id):
-        try:
-            await query.answer("❌ У вас нет доступа", show_alert=True)
-        except Exception as e:
-            logger.warning(f"Ошибка при ответе на callback query: {e}")
-        return
-    
-    # Пытаемся ответить на callback, игнорируем ошибки если запрос уже обработан
-    try:
-        await query.answer()
-    except Exception as e:
-        logger.warning(f"Ошибка при ответе на callback query: {e}")
-        # Продолжаем выполнение, даже если не удалось ответить
-    
-    data = query.data
-    
-    if data == "admin_panel":
-        # Получаем статистику
-        data_obj = load_data()
-        users_count = len(data_obj.get('users', []))
-        admins_count = len(data_obj.get('admins', []))
-        channels_count = len(data_obj.get('channel_ids', []))
-        banned_count = len(data_obj.get('banned_users', []))
-        
-        keyboard = [
-            [InlineKeyboardButton("📊 Статистика", callback_data="admin_stats")],
-            [InlineKeyboardButton("📢 Управление каналами", callback_data="admin_channels")],
-            [InlineKeyboardButton("🔗 Управление ссылками", callback_data="admin_links")],
-            [InlineKeyboardButton("📁 Управление файлами", callback_data="admin_files")],
-            [InlineKeyboardButton("👥 Управление админами", callback_data="admin_admins")],
-            [InlineKeyboardButton("👤 Просмотр пользователей", callback_data="admin_users")],
-            [InlineKeyboardButton("🚫 Бан/Разбан пользователей", callback_data="admin_ban")],
-            [InlineKeyboardButton("📝 Управление текстами", callback_data="admin_texts")],
-            [InlineKeyboardButton("🖼️ Управление изображениями", callback_data="admin_images")],
-            [InlineKeyboardButton("📨 Рассылка", callback_data="admin_broadcast")],
-            [InlineKeyboardButton("📋 Логи действий", callback_data="admin_logs")],
-            [InlineKeyboardButton("⚙️ Настройки бота", callback_data="admin_settings")],
-            [InlineKeyboardButton("💾 Экспорт/Импорт данных", callback_data="admin_export")],
-            [InlineKeyboardButton("🔙 Главное меню", callback_data="main_menu")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        text = (
-            "🔐 <b>Расширенная админ-панель</b>\n\n"
-            f"📊 <b>Быстрая статистика:</b>\n"
-            f"👥 Пользователей: <b>{users_count}</b>\n"
-            f"👤 Админов: <b>{admins_count}</b>\n"
-            f"📢 Каналов: <b>{channels_count}</b>\n"
-            f"🚫 Забанено: <b>{banned_count}</b>\n\n"
-            "Выберите действие:"
-        )
-        await query.message.edit_text(text, reply_markup=reply_markup, parse_mode=ParseMode.HTML)
-    
-    elif data == "admin_channels":
-        await admin_channels_menu(update, context)
-    
-    elif data == "admin_links":
-        await admin_links_menu(update, context)
-    
-    elif data == "admin_files":
-        await admin_files_menu(update, context)
-    
-    elif data == "admin_admins":
-        await admin_admins_menu(update, context)
-    
-    elif data == "admin_broadcast":
-        await admin_broadcast_menu(update, context)
     
-    elif data == "admin_stats":
-        await admin_stats_menu(update, context)
-    
-    elif data == "admin_users":
-        await admin_users_menu(update, context)
-    
-    elif data == "admin_ban":
-        await admin_ban_menu(update, context)
-    
-    elif data == "admin_texts":
-        await admin_texts_menu(update, context)
-    
-    elif data == "admin_images":
-        await admin_images_menu(update, context)
-    
-    elif data == "admin_logs":
-        await admin_logs_menu(update, context)
-    
-    elif data == "admin_settings":
-        await admin_settings_menu(update, context)
-    
-    elif data == "admin_export":
-        await admin_export_menu(update, context)
-    
-    elif data.startswith("admin_channel_add"):
-        admin_states[user_id] = "add_channel"
-        await query.message.edit_text(
-            "➕ <b>Добавление канала</b>\n\n"
-            "Отправьте ID канала (например: -1001234567890):",
-            parse_mode=ParseMode.HTML
-        )
-    
-    elif data.startswith("admin_link_edit_"):
-        link_index = int(data.split("_")[-1]) - 1
-        data_obj = load_data()
-        links = data_obj.get('channel_links', [])
-        if 0 <= link_index < len(links):
-            admin_states[user_id] = f"edit_link_{link_index}"
-            await query.message.edit_text(
-                f"✏️ <b>Редактирование ссылки</b>\n\n"
-                f"Текущая ссылка: {links[link_index]}\n\n"
-                f"Отправьте новую ссылку или 'удалить' для удаления:",
-                parse_mode=ParseMode.HTML
-            )
-    
-    elif data.startswith("admin_link_add"):
-        admin_states[user_id] = "add_link"
+    link_index = index - 1
+    data_obj = current_config()
+    links = data_obj.get('channel_links', [])
+    if 0 <= link_index < len(links):
+        admin_states[user_id] = f"edit_link_{link_index}"
         await query.message.edit_text(
-            "➕ <b>Добавление ссылки</b>\n\n"
-            "Отправьте ссылку на канал (например: https://t.me/channel):",
+            f"✏️ <b>Редактирование ссылки</b>\n\n"
+            f"Текущая ссылка: {links[link_index]}\n\n"
+            f"Отправьте новую ссылку или 'удалить' для удаления:",
             parse_mode=ParseMode.HTML
         )
+
+
+@callback_router.route("admin_channel_edit_{index:int}", admin=True)
+async def admin_channel_edit_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, index: int):
+    """Запрашивает новый ID вместо выбранного канала"""
+    query = update.callback_query
+    user_id = query.from_user.id
     
-    elif data.startswith("admin_file_edit"):
-        admin_states[user_id] = "edit_file_url"
+    channel_index = index - 1
+    data_obj = current_config()
+    channels = data_obj.get('channel_ids', [])
+    if 0 <= channel_index < len(channels):
+        admin_states[user_id] = f"edit_channel_{channel_index}"
         await query.message.edit_text(
-            "📝 <b>Изменение ссылки на файл</b>\n\n"
-            "Отправьте новую ссылку на файл:",
+            f"✏️ <b>Редактирование канала</b>\n\n"
+            f"Текущий ID: {channels[channel_index]}\n\n"
+            f"Отправьте новый ID канала или 'удалить' для удаления:",
             parse_mode=ParseMode.HTML
         )
+
+
+@callback_router.route("admin_add", admin=True)
+async def admin_add_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Запрашивает пользователя для добавления в администраторы"""
+    query = update.callback_query
+    user_id = query.from_user.id
     
-    elif data.startswith("admin_file_upload"):
-        admin_states[user_id] = "upload_file"
+    admin_states[user_id] = "add_admin"
+    try:
         await query.message.edit_text(
-            "📤 <b>Загрузка файла</b>\n\n"
-            "Отправьте файл, который хотите использовать:",
+            "➕ <b>Добавление администратора</b>\n\n"
+            "Отправьте одним из способов:\n"
+            "• ID пользователя (число)\n"
+            "• Переслать сообщение от пользователя\n"
+            "• Ответить на сообщение пользователя\n\n"
+            "Для отмены отправьте /admin",
             parse_mode=ParseMode.HTML
         )
-    
-    elif data.startswith("admin_add"):
-        admin_states[user_id] = "add_admin"
+    except Exception as e:
+        logger.warning(f"Не удалось обновить сообщение: {e}")
         try:
-            await query.message.edit_text(
+            sent_msg = await query.message.reply_text(
                 "➕ <b>Добавление администратора</b>\n\n"
                 "Отправьте одним из способов:\n"
                 "• ID пользователя (число)\n"
@@ -1478,285 +4942,614 @@ async def admin_callback_handler(update: Update, context: ContextTypes.DEFAULT_T
                 "Для отмены отправьте /admin",
                 parse_mode=ParseMode.HTML
             )
-        except Exception as e:
-            logger.warning(f"Не удалось обновить сообщение: {e}")
             try:
-                sent_msg = await query.message.reply_text(
-                    "➕ <b>Добавление администратора</b>\n\n"
-                    "Отправьте одним из способов:\n"
-                    "• ID пользователя (число)\n"
-                    "• Переслать сообщение от пользователя\n"
-                    "• Ответить на сообщение пользователя\n\n"
-                    "Для отмены отправьте /admin",
-                    parse_mode=ParseMode.HTML
-                )
-                try:
-                    await query.message.delete()
-                except:
-                    pass
+                await query.message.delete()
             except:
                 pass
+        except:
+            pass
+
+
+@callback_router.route("admin_remove_{admin_id:int}", admin=True, answer=False)
+async def admin_remove_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, admin_id: int):
+    """Удаляет выбранного администратора"""
+    query = update.callback_query
+    user_id = query.from_user.id
     
-    elif data.startswith("admin_remove_"):
-        admin_id = int(data.split("_")[-1])
-        
-        # Нельзя удалить самого себя
-        if admin_id == user_id:
-            try:
-                await query.answer("❌ Вы не можете удалить самого себя", show_alert=True)
-            except:
-                pass
-            return
-        
-        if remove_admin(admin_id):
-            try:
-                await query.answer("✅ Администратор удален", show_alert=True)
-            except:
-                pass
-            await admin_admins_menu(update, context)
-        else:
-            try:
-                await query.answer("❌ Ошибка при удалении", show_alert=True)
-            except:
-                pass
+    # Нельзя удалить самого себя
+    if admin_id == user_id:
+        await answer_query(query, "❌ Вы не можете удалить самого себя", show_alert=True)
+        return
     
-    elif data.startswith("admin_channel_edit_"):
-        channel_index = int(data.split("_")[-1]) - 1
-        data_obj = load_data()
-        channels = data_obj.get('channel_ids', [])
-        if 0 <= channel_index < len(channels):
-            admin_states[user_id] = f"edit_channel_{channel_index}"
-            await query.message.edit_text(
-                f"✏️ <b>Редактирование канала</b>\n\n"
-                f"Текущий ID: {channels[channel_index]}\n\n"
-                f"Отправьте новый ID канала или 'удалить' для удаления:",
-                parse_mode=ParseMode.HTML
-            )
+    if remove_admin(admin_id):
+        await answer_query(query, "✅ Администратор удален", show_alert=True)
+        await admin_admins_menu(update, context)
+    else:
+        await answer_query(query, "❌ Ошибка при удалении", show_alert=True)
+
+
+@callback_router.route("admin_broadcast_start", admin=True)
+async def admin_broadcast_start_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Переводит админа в режим ввода сообщения для рассылки"""
+    query = update.callback_query
+    user_id = query.from_user.id
     
-    elif data.startswith("admin_broadcast_start"):
-        admin_states[user_id] = "broadcast"
-        log_action(user_id, "Начал рассылку")
-        await query.message.edit_text(
-            "📨 <b>Рассылка</b>\n\n"
-            "Отправьте сообщение, которое хотите разослать всем пользователям:",
-            parse_mode=ParseMode.HTML
-        )
+    admin_states[user_id] = "broadcast"
+    log_action(user_id, "Начал рассылку")
+    await query.message.edit_text(
+        "📨 <b>Рассылка</b>\n\n"
+        "Отправьте сообщение, которое хотите разослать всем пользователям:",
+        parse_mode=ParseMode.HTML
+    )
+
+
+@callback_router.route("admin_ban_list", admin=True)
+async def admin_ban_list_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, cursor: Optional[str] = None):
+    """Список забаненных пользователей (постранично)"""
+    query = update.callback_query
     
-    elif data.startswith("admin_ban_add"):
-        admin_states[user_id] = "ban_user"
-        await query.message.edit_text(
-            "🚫 <b>Забанить пользователя</b>\n\n"
-            "Отправьте ID пользователя для бана:",
-            parse_mode=ParseMode.HTML
-        )
+    try:
+        banned, navigation = render_id_page(banned_index, cursor, "admin_ban_list_")
+    except ValueError:
+        banned, navigation = render_id_page(banned_index, None, "admin_ban_list_")
     
-    elif data.startswith("admin_ban_remove"):
-        admin_states[user_id] = "unban_user"
-        await query.message.edit_text(
-            "✅ <b>Разбанить пользователя</b>\n\n"
-            "Отправьте ID пользователя для разбана:",
-            parse_mode=ParseMode.HTML
+    if banned:
+        banned_text = "\n".join([f"• <code>{uid}</code>" for uid in banned])
+    else:
+        banned_text = "Нет забаненных пользователей"
+    
+    keyboard = [navigation] if navigation else []
+    keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data="admin_ban")])
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    await query.message.edit_text(
+        f"🚫 <b>Забаненные пользователи</b>\n\nВсего: {len(banned_index)}\n\n{banned_text}",
+        reply_markup=reply_markup,
+        parse_mode=ParseMode.HTML
+    )
+
+
+@callback_router.route("admin_ban_list_{cursor}", admin=True)
+async def admin_ban_list_page_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, cursor: str):
+    """Листание списка забаненных"""
+    await admin_ban_list_callback(update, context, cursor=cursor)
+
+
+@callback_router.route("admin_user_list", admin=True)
+async def admin_user_list_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, cursor: Optional[str] = None):
+    """Список пользователей (постранично)"""
+    query = update.callback_query
+    
+    try:
+        users, navigation = render_id_page(users_index, cursor, "admin_user_list_")
+    except ValueError:
+        users, navigation = render_id_page(users_index, None, "admin_user_list_")
+    
+    if users:
+        users_text = "\n".join([f"• <code>{uid}</code>" for uid in users])
+    else:
+        users_text = "Нет пользователей"
+    
+    keyboard = [navigation] if navigation else []
+    keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data="admin_users")])
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    await query.message.edit_text(
+        f"👥 <b>Список пользователей</b>\n\nВсего: {len(users_index)}\n\n{users_text}",
+        reply_markup=reply_markup,
+        parse_mode=ParseMode.HTML
+    )
+
+
+@callback_router.route("admin_user_list_{cursor}", admin=True)
+async def admin_user_list_page_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, cursor: str):
+    """Листание списка пользователей"""
+    await admin_user_list_callback(update, context, cursor=cursor)
+
+
+@callback_router.route("admin_text_view", admin=True)
+async def admin_text_view_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Просмотр сохраненных текстов"""
+    query = update.callback_query
+    
+    data_obj = current_config()
+    messages = data_obj.get('messages', {})
+    texts = "\n".join([f"• <b>{key}</b>: {value[:50]}..." for key, value in list(messages.items())[:10]])
+    if not texts:
+        texts = "Нет сохраненных текстов"
+    
+    keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data="admin_texts")]]
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    await query.message.edit_text(
+        f"📋 <b>Сохраненные тексты</b>\n\n{texts}",
+        reply_markup=reply_markup,
+        parse_mode=ParseMode.HTML
+    )
+
+
+@callback_router.route("admin_image_view", admin=True)
+async def admin_image_view_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Просмотр сохраненных изображений"""
+    query = update.callback_query
+    
+    data_obj = current_config()
+    images = data_obj.get('images', {})
+    images_text = "\n".join([f"• <b>{key}</b>" for key in list(images.keys())[:10]])
+    if not images_text:
+        images_text = "Нет сохраненных изображений"
+    
+    keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data="admin_images")]]
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    await query.message.edit_text(
+        f"📋 <b>Сохраненные изображения</b>\n\n{images_text}",
+        reply_markup=reply_markup,
+        parse_mode=ParseMode.HTML
+    )
+
+
+@callback_router.route("admin_logs_clear", admin=True, answer=False)
+async def admin_logs_clear_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Очистка логов действий"""
+    query = update.callback_query
+    user_id = query.from_user.id
+    
+    await action_log.run(action_log.clear)
+    log_action(user_id, "Очистил логи")
+    await answer_query(query, "✅ Логи очищены", show_alert=True)
+    await admin_logs_menu(update, context)
+
+
+async def send_logs_export(update: Update, context: ContextTypes.DEFAULT_TYPE, admin_id: Optional[int] = None,
+                           since: Optional[int] = None, caption: str = "📋 Логи действий"):
+    """Выгружает журнал действий с фильтром, не загружая всю историю в память"""
+    query = update.callback_query
+    user_id = query.from_user.id
+    chat_id = query.message.chat_id
+    
+    # Записи пишутся во временный файл (в памяти только до 1 МБ) в потоке журнала
+    with tempfile.SpooledTemporaryFile(max_size=1024 * 1024) as logs_file:
+        written = await action_log.run(action_log.export, logs_file, admin_id, since)
+        if not written:
+            await answer_query(query, "❌ Нет логов для экспорта", show_alert=True)
+            return
+        await answer_query(query)
+        logs_file.seek(0)
+        await context.bot.send_document(
+            chat_id=chat_id,
+            document=InputFile(logs_file, filename="logs.json"),
+            caption=f"{caption} ({written})"
         )
+    log_action(user_id, "Экспортировал логи")
+
+
+@callback_router.route("admin_logs_export", admin=True, answer=False)
+async def admin_logs_export_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Экспорт логов действий"""
+    await send_logs_export(update, context)
+
+
+@callback_router.route("admin_logs_export_day", admin=True, answer=False)
+async def admin_logs_export_day_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Экспорт логов за последние 24 часа"""
+    since = int(time.time()) - 24 * 3600
+    await send_logs_export(update, context, since=since, caption="📋 Логи действий за 24 часа")
+
+
+@callback_router.route("admin_logs_export_mine", admin=True, answer=False)
+async def admin_logs_export_mine_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Экспорт действий текущего администратора"""
+    admin_id = update.callback_query.from_user.id
+    await send_logs_export(update, context, admin_id=admin_id, caption="📋 Ваши действия")
+
+
+@callback_router.route("admin_funnel_csv", admin=True)
+async def admin_funnel_csv_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Экспорт воронки конверсии в CSV"""
+    query = update.callback_query
+    
+    csv_data = funnel_stats.to_csv()
+    await context.bot.send_document(
+        chat_id=query.message.chat_id,
+        document=InputFile(BytesIO(csv_data), filename="funnel.csv"),
+        caption="🎯 Воронка конверсии по дням"
+    )
+    log_action(query.from_user.id, "Экспортировал воронку конверсии")
+
+
+@callback_router.route("admin_setting_autodelete", admin=True)
+async def admin_setting_autodelete_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Переключает автоудаление сообщений"""
+    user_id = update.callback_query.from_user.id
+    
+    data_obj = load_config()
+    settings = data_obj.get('settings', {})
+    settings['auto_delete_messages'] = not settings.get('auto_delete_messages', False)
+    data_obj['settings'] = settings
+    save_data(data_obj)
+    log_action(user_id, f"Изменил автоудаление: {settings['auto_delete_messages']}")
+    await admin_settings_menu(update, context)
+
+
+@callback_router.route("admin_setting_subscription", admin=True)
+async def admin_setting_subscription_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Переключает требование подписки"""
+    user_id = update.callback_query.from_user.id
+    
+    data_obj = load_config()
+    settings = data_obj.get('settings', {})
+    settings['require_subscription'] = not settings.get('require_subscription', True)
+    data_obj['settings'] = settings
+    save_data(data_obj)
+    log_action(user_id, f"Изменил требование подписки: {settings['require_subscription']}")
+    await admin_settings_menu(update, context)
+
+
+# Максимальный размер одной части экспорта (лимит Telegram на документ - 50 МБ)
+EXPORT_PART_SIZE = 45 * 1024 * 1024
+
+# Списки данных, которые выгружаются по одной записи на элемент
+EXPORT_LIST_KEYS = {'users': 'user', 'banned_users': 'ban', 'admins': 'admin'}
+
+
+def iter_export_records(data: dict):
+    """Записи экспорта: настройки, затем по одной записи на пользователя, бан, администратора и лог"""
+    config = {key: value for key, value in data.items() if key not in EXPORT_LIST_KEYS}
+    yield {'type': 'config', 'data': config}
+    for key, record_type in EXPORT_LIST_KEYS.items():
+        for item_id in data.get(key, []):
+            yield {'type': record_type, 'id': item_id}
+    for entry in action_log.entries():
+        yield {'type': 'log', 'entry': entry}
+
+
+def write_export_parts(data: dict, part_size: int = EXPORT_PART_SIZE) -> List[tuple]:
+    """
+    Пишет экспорт в сжатые gzip NDJSON-файлы (по одной JSON-записи на строку).
+    
+    Выполняется в потоке журнала: записи журнала не добавляются во время экспорта,
+    поэтому выгрузка согласована с переданным снимком данных. Файлы хранятся во
+    временных файлах (в памяти только до 1 МБ); при превышении part_size начинается
+    новая часть. Возвращает список (файл, количество записей).
+    """
+    parts = []
+    raw = gz = None
+    count = 0
+    try:
+        for record in iter_export_records(data):
+            if gz is None:
+                raw = tempfile.SpooledTemporaryFile(max_size=1024 * 1024)
+                gz = gzip.GzipFile(fileobj=raw, mode='wb')
+                count = 0
+            gz.write(json.dumps(record, ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
+            gz.write(b"\n")
+            count += 1
+            if raw.tell() >= part_size:
+                gz.close()
+                raw.seek(0)
+                parts.append((raw, count))
+                raw = gz = None
+        if gz is not None:
+            gz.close()
+            raw.seek(0)
+            parts.append((raw, count))
+    except Exception:
+        if raw is not None:
+            raw.close()
+        for part_file, _ in parts:
+            part_file.close()
+        raise
+    return parts
+
+
+async def send_data_export(update: Update, context: ContextTypes.DEFAULT_TYPE, filename_prefix: str, caption: str):
+    """Отправляет экспорт всех данных бота одним или несколькими файлами .ndjson.gz"""
+    query = update.callback_query
+    chat_id = query.message.chat_id
+    await answer_query(query, "⏳ Готовим выгрузку...")
+    
+    # Снимок данных - новый словарь из файла, дальнейшие изменения его не затрагивают
+    data_obj = load_data()
+    parts = await action_log.run(write_export_parts, data_obj)
+    try:
+        for number, (part_file, count) in enumerate(parts, 1):
+            suffix = f"_part{number}" if len(parts) > 1 else ""
+            part_caption = f"{caption} ({count} записей)"
+            if len(parts) > 1:
+                part_caption += f", часть {number}/{len(parts)}"
+            await context.bot.send_document(
+                chat_id=chat_id,
+                document=InputFile(part_file, filename=f"{filename_prefix}{suffix}.ndjson.gz"),
+                caption=part_caption
+            )
+    finally:
+        for part_file, _ in parts:
+            part_file.close()
+
+
+@callback_router.route("admin_export_json", admin=True, answer=False)
+async def admin_export_json_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Экспорт всех данных бота"""
+    user_id = update.callback_query.from_user.id
+    await shutdown_coordinator.run(send_data_export(update, context, "bot_data_export", "💾 Экспорт данных бота"))
+    log_action(user_id, "Экспортировал данные")
+
+
+@callback_router.route("admin_backup", admin=True, answer=False)
+async def admin_backup_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Отправляет резервную копию данных"""
+    user_id = update.callback_query.from_user.id
+    filename_prefix = f"backup_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+    await shutdown_coordinator.run(send_data_export(update, context, filename_prefix, "🔄 Резервная копия данных"))
+    log_action(user_id, "Создал резервную копию")
+
+
+# Как часто обновлять сообщение с прогрессом импорта (секунды)
+IMPORT_PROGRESS_INTERVAL = 3
+
+# Ожидаемые типы настроек в файле импорта
+IMPORT_CONFIG_TYPES = {
+    'channel_ids': list,
+    'channel_links': list,
+    'file_url': str,
+    'files': list,
+    'messages': dict,
+    'images': dict,
+    'settings': dict
+}
+
+
+def iter_legacy_records(data):
+    """Записи импорта из JSON-файла старого формата (один объект со всеми данными)"""
+    if not isinstance(data, dict):
+        raise ValueError("ожидался JSON-объект с данными бота")
+    config = {key: value for key, value in data.items() if key not in EXPORT_LIST_KEYS and key != 'logs'}
+    yield {'type': 'config', 'data': config}
+    for key, record_type in EXPORT_LIST_KEYS.items():
+        items = data.get(key, [])
+        if not isinstance(items, list):
+            raise ValueError(f"поле '{key}' должно быть списком")
+        for item_id in items:
+            yield {'type': record_type, 'id': item_id}
+    for entry in data.get('logs', []) or []:
+        yield {'type': 'log', 'entry': entry}
+
+
+class DataImport:
+    """
+    Потоковый разбор и проверка файла импорта.
     
-    elif data.startswith("admin_ban_list"):
-        data_obj = load_data()
-        banned = data_obj.get('banned_users', [])
-        if banned:
-            banned_text = "\n".join([f"• <code>{uid}</code>" for uid in banned[:50]])
-            if len(banned) > 50:
-                banned_text += f"\n\n... и еще {len(banned) - 50} пользователей"
+    Принимает файл экспорта (gzip NDJSON или несжатый NDJSON) и JSON старого формата.
+    Каждая запись проверяется отдельно: ошибочные пропускаются и попадают в отчет,
+    повторяющиеся ID отбрасываются. ID копятся в массивах int64 и в конце разбора
+    превращаются в CompactIdSet - в памяти нет списков и множеств из int.
+    Разбор выполняется в отдельном потоке, прогресс доступен через read_bytes / total_bytes.
+    """
+
+    MAX_ERRORS = 10
+
+    def __init__(self, total_bytes: int):
+        self.total_bytes = total_bytes
+        self.read_bytes = 0
+        self.config: Dict = {}
+        self.ids: Dict[str, CompactIdSet] = {key: CompactIdSet() for key in EXPORT_LIST_KEYS}
+        self._raw_ids = {key: array('q') for key in EXPORT_LIST_KEYS}
+        self._id_keys = {record_type: key for key, record_type in EXPORT_LIST_KEYS.items()}
+        self.logs: List[Dict] = []
+        self.records = 0
+        self.invalid = 0
+        self.duplicates = 0
+        self.errors: List[str] = []
+
+    def _error(self, line: int, message: str):
+        self.invalid += 1
+        if len(self.errors) < self.MAX_ERRORS:
+            self.errors.append(f"строка {line}: {message}" if line else message)
+
+    @staticmethod
+    def _is_id(value) -> bool:
+        return isinstance(value, int) and not isinstance(value, bool) and -2 ** 63 <= value < 2 ** 63
+
+    def _add_config(self, config, line: int):
+        if not isinstance(config, dict):
+            self._error(line, "настройки должны быть объектом")
+            return
+        for key, value in config.items():
+            expected = IMPORT_CONFIG_TYPES.get(key)
+            if expected and not isinstance(value, expected):
+                self._error(line, f"поле '{key}' имеет неверный тип")
+            elif key == 'channel_ids' and not all(self._is_id(item) for item in value):
+                self._error(line, "channel_ids должны быть числами")
+            elif key == 'channel_links' and not all(isinstance(item, str) for item in value):
+                self._error(line, "channel_links должны быть строками")
+            else:
+                self.config[key] = value
+
+    def add_record(self, record, line: int = 0):
+        """Проверяет запись и добавляет ее в результат"""
+        if not isinstance(record, dict):
+            self._error(line, "запись не является объектом")
+            return
+        record_type = record.get('type')
+        if record_type == 'config':
+            self._add_config(record.get('data'), line)
+        elif record_type in self._id_keys:
+            item_id = record.get('id')
+            if not self._is_id(item_id):
+                self._error(line, f"неверный ID: {item_id!r}")
+                return
+            self._raw_ids[self._id_keys[record_type]].append(item_id)
+        elif record_type == 'log':
+            entry = record.get('entry')
+            if (not isinstance(entry, dict) or not self._is_id(entry.get('admin_id'))
+                    or not isinstance(entry.get('action'), str)):
+                self._error(line, "неверная запись лога")
+                return
+            self.logs.append(entry)
+        else:
+            self._error(line, f"неизвестный тип записи: {record_type!r}")
+            return
+        self.records += 1
+
+    def _parse_ndjson(self, stream, raw):
+        for line_number, line in enumerate(stream, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                self._error(line_number, "некорректный JSON")
+                continue
+            self.add_record(record, line_number)
+            if line_number % 1000 == 0:
+                self.read_bytes = raw.tell()
+
+    def parse(self, fileobj):
+        """Разбирает файл (выполняется в отдельном потоке)"""
+        head = fileobj.read(2)
+        fileobj.seek(0)
+        if head == b"\x1f\x8b":
+            with gzip.GzipFile(fileobj=fileobj, mode='rb') as stream:
+                self._parse_ndjson(stream, fileobj)
         else:
-            banned_text = "Нет забаненных пользователей"
-        
-        keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data="admin_ban")]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await query.message.edit_text(
-            f"🚫 <b>Забаненные пользователи</b>\n\n{banned_text}",
-            reply_markup=reply_markup,
-            parse_mode=ParseMode.HTML
-        )
-    
-    elif data.startswith("admin_user_search"):
-        admin_states[user_id] = "search_user"
-        await query.message.edit_text(
-            "🔍 <b>Поиск пользователя</b>\n\n"
-            "Отправьте ID пользователя для поиска:",
-            parse_mode=ParseMode.HTML
-        )
+            # NDJSON начинается с записи с полем type, иначе это JSON старого формата
+            first_line = fileobj.readline(1024 * 1024)
+            fileobj.seek(0)
+            try:
+                first = json.loads(first_line)
+            except ValueError:
+                first = None
+            if isinstance(first, dict) and 'type' in first:
+                self._parse_ndjson(fileobj, fileobj)
+            else:
+                for record in iter_legacy_records(json.load(fileobj)):
+                    self.add_record(record)
+        self._collect_ids()
+        self.read_bytes = self.total_bytes
+
+    def _collect_ids(self):
+        """Сортирует собранные ID в множества и считает повторы"""
+        for key, raw in self._raw_ids.items():
+            self.ids[key] = self.ids[key].union(CompactIdSet(raw))
+            self.duplicates += len(raw) - len(self.ids[key])
+            self._raw_ids[key] = array('q')
+
+    def progress_text(self) -> str:
+        percent = self.read_bytes * 100 // self.total_bytes if self.total_bytes else 100
+        return f"📥 <b>Импорт данных</b>\n\nОбработано: {percent}% ({self.records} записей)"
+
+
+def merge_unique(current: list, new: list) -> list:
+    """Объединяет списки, сохраняя порядок и отбрасывая повторы"""
+    seen = set(current)
+    result = list(current)
+    for item in new:
+        if item not in seen:
+            seen.add(item)
+            result.append(item)
+    return result
+
+
+def apply_import(data: dict, parsed: DataImport, replace: bool, admin_id: int) -> Dict[str, int]:
+    """
+    Применяет импорт к данным бота и возвращает количество добавленных элементов.
     
-    elif data.startswith("admin_user_list"):
-        data_obj = load_data()
-        users = data_obj.get('users', [])
-        if users:
-            users_text = "\n".join([f"• <code>{uid}</code>" for uid in users[:50]])
-            if len(users) > 50:
-                users_text += f"\n\n... и еще {len(users) - 50} пользователей"
+    - replace: разделы, которые есть в файле, заменяют текущие; остальные не меняются
+    - merge: списки объединяются без повторов, словари обновляются, строки заменяются
+    Списки пользователей и банов объединяются как CompactIdSet с текущими
+    (load_users_data) и кладутся в data для save_data.
+    Главный админ и админ, выполняющий импорт, всегда остаются в списке админов.
+    """
+    for key, value in parsed.config.items():
+        current = data.get(key)
+        if replace or current is None:
+            data[key] = value
+        elif isinstance(value, list) and isinstance(current, list):
+            data[key] = merge_unique(current, value)
+        elif isinstance(value, dict) and isinstance(current, dict):
+            current.update(value)
         else:
-            users_text = "Нет пользователей"
-        
-        keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data="admin_users")]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await query.message.edit_text(
-            f"👥 <b>Список пользователей</b>\n\nВсего: {len(users)}\n\n{users_text}",
-            reply_markup=reply_markup,
-            parse_mode=ParseMode.HTML
-        )
-    
-    elif data.startswith("admin_text_welcome"):
-        admin_states[user_id] = "edit_text_welcome"
-        await query.message.edit_text(
-            "✏️ <b>Редактирование приветствия</b>\n\n"
-            "Отправьте новый текст приветствия:",
-            parse_mode=ParseMode.HTML
-        )
-    
-    elif data.startswith("admin_text_success"):
-        admin_states[user_id] = "edit_text_success"
-        await query.message.edit_text(
-            "✏️ <b>Редактирование текста успеха</b>\n\n"
-            "Отправьте новый текст:",
-            parse_mode=ParseMode.HTML
-        )
+            data[key] = value
+    
+    added = {}
+    users_data = load_users_data()
+    for key in USERS_KEYS:
+        ids = parsed.ids[key]
+        current = users_data[key]
+        if not len(ids):
+            added[key] = 0
+            continue
+        data[key] = ids if replace else current.union(ids)
+        added[key] = data[key].difference_count(current)
     
-    elif data.startswith("admin_text_error"):
-        admin_states[user_id] = "edit_text_error"
-        await query.message.edit_text(
-            "✏️ <b>Редактирование текста ошибки</b>\n\n"
-            "Отправьте новый текст:",
-            parse_mode=ParseMode.HTML
-        )
+    admins = data.get('admins', [])
+    imported_admins = parsed.ids['admins'].tolist()
+    if replace and imported_admins:
+        data['admins'] = imported_admins
+    else:
+        data['admins'] = merge_unique(admins, imported_admins)
+    added['admins'] = len(set(data['admins']) - set(admins))
     
-    elif data.startswith("admin_text_view"):
-        data_obj = load_data()
-        messages = data_obj.get('messages', {})
-        texts = "\n".join([f"• <b>{key}</b>: {value[:50]}..." for key, value in list(messages.items())[:10]])
-        if not texts:
-            texts = "Нет сохраненных текстов"
+    data['admins'] = merge_unique(data.get('admins', []), [MAIN_ADMIN_ID, admin_id])
+    return added
+
+
+async def import_data_file(message, context: ContextTypes.DEFAULT_TYPE, user_id: int, replace: bool):
+    """Загружает, проверяет и применяет файл импорта, показывая прогресс"""
+    status_msg = await message.reply_text("📥 <b>Импорт данных</b>\n\nЗагрузка файла...", parse_mode=ParseMode.HTML)
+    
+    # Файл хранится во временном файле (в памяти только до 1 МБ) и читается потоково
+    with tempfile.SpooledTemporaryFile(max_size=1024 * 1024) as import_file:
+        file = await context.bot.get_file(message.document.file_id)
+        await file.download_to_memory(out=import_file)
+        parsed = DataImport(import_file.tell())
+        import_file.seek(0)
         
-        keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data="admin_texts")]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await query.message.edit_text(
-            f"📋 <b>Сохраненные тексты</b>\n\n{texts}",
-            reply_markup=reply_markup,
-            parse_mode=ParseMode.HTML
-        )
-    
-    elif data.startswith("admin_image_preview"):
-        admin_states[user_id] = "upload_image_preview"
-        await query.message.edit_text(
-            "🖼️ <b>Загрузка Preview.png</b>\n\n"
-            "Отправьте изображение:",
-            parse_mode=ParseMode.HTML
-        )
-    
-    elif data.startswith("admin_image_success"):
-        admin_states[user_id] = "upload_image_success"
-        await query.message.edit_text(
-            "🖼️ <b>Загрузка succes.png</b>\n\n"
-            "Отправьте изображение:",
-            parse_mode=ParseMode.HTML
-        )
-    
-    elif data.startswith("admin_image_error"):
-        admin_states[user_id] = "upload_image_error"
-        await query.message.edit_text(
-            "🖼️ <b>Загрузка error.png</b>\n\n"
-            "Отправьте изображение:",
-            parse_mode=ParseMode.HTML
-        )
+        task = asyncio.ensure_future(asyncio.to_thread(parsed.parse, import_file))
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=IMPORT_PROGRESS_INTERVAL)
+            if done:
+                break
+            try:
+                await status_msg.edit_text(parsed.progress_text(), parse_mode=ParseMode.HTML)
+            except BadRequest:
+                pass
+        task.result()
     
-    elif data.startswith("admin_image_download"):
-        admin_states[user_id] = "upload_image_download"
-        await query.message.edit_text(
-            "🖼️ <b>Загрузка download.jpg</b>\n\n"
-            "Отправьте изображение:",
-            parse_mode=ParseMode.HTML
-        )
+    keyboard = InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Назад", callback_data="admin_export")]])
+    errors_text = "".join(f"\n• {html.escape(error)}" for error in parsed.errors)
     
-    elif data.startswith("admin_image_view"):
-        data_obj = load_data()
-        images = data_obj.get('images', {})
-        images_text = "\n".join([f"• <b>{key}</b>" for key in list(images.keys())[:10]])
-        if not images_text:
-            images_text = "Нет сохраненных изображений"
-        
-        keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data="admin_images")]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await query.message.edit_text(
-            f"📋 <b>Сохраненные изображения</b>\n\n{images_text}",
-            reply_markup=reply_markup,
+    if not parsed.records:
+        await status_msg.edit_text(
+            "❌ <b>В файле нет корректных записей</b>" + errors_text,
+            reply_markup=keyboard,
             parse_mode=ParseMode.HTML
         )
+        return
     
-    elif data.startswith("admin_logs_clear"):
-        action_logs.clear()
-        log_action(user_id, "Очистил логи")
-        await query.answer("✅ Логи очищены", show_alert=True)
-        await admin_logs_menu(update, context)
-    
-    elif data.startswith("admin_logs_export"):
-        if action_logs:
-            logs_json = json.dumps(action_logs, ensure_ascii=False, indent=2)
-            logs_file = BytesIO(logs_json.encode('utf-8'))
-            logs_file.name = "logs.json"
-            await context.bot.send_document(
-                chat_id=chat_id,
-                document=InputFile(logs_file, filename="logs.json"),
-                caption="📋 Логи действий"
-            )
-            log_action(user_id, "Экспортировал логи")
-        else:
-            await query.answer("❌ Нет логов для экспорта", show_alert=True)
-    
-    elif data.startswith("admin_setting_autodelete"):
-        data_obj = load_data()
-        settings = data_obj.get('settings', {})
-        settings['auto_delete_messages'] = not settings.get('auto_delete_messages', False)
-        data_obj['settings'] = settings
-        save_data(data_obj)
-        log_action(user_id, f"Изменил автоудаление: {settings['auto_delete_messages']}")
-        await admin_settings_menu(update, context)
-    
-    elif data.startswith("admin_setting_subscription"):
-        data_obj = load_data()
-        settings = data_obj.get('settings', {})
-        settings['require_subscription'] = not settings.get('require_subscription', True)
-        data_obj['settings'] = settings
-        save_data(data_obj)
-        log_action(user_id, f"Изменил требование подписки: {settings['require_subscription']}")
-        await admin_settings_menu(update, context)
-    
-    elif data.startswith("admin_export_json"):
-        data_obj = load_data()
-        export_data = json.dumps(data_obj, ensure_ascii=False, indent=2)
-        export_file = BytesIO(export_data.encode('utf-8'))
-        export_file.name = "bot_data_export.json"
-        await context.bot.send_document(
-            chat_id=chat_id,
-            document=InputFile(export_file, filename="bot_data_export.json"),
-            caption="💾 Экспорт данных бота"
-        )
-        log_action(user_id, "Экспортировал данные")
+    data = load_config()
+    added = apply_import(data, parsed, replace, user_id)
+    if not save_data(data):
+        await status_msg.edit_text("❌ Ошибка при сохранении данных", reply_markup=keyboard)
+        return
+    logs_added = 0
+    if parsed.logs:
+        logs_added = await action_log.run(action_log.import_entries, parsed.logs, replace)
     
-    elif data.startswith("admin_import_data"):
-        admin_states[user_id] = "import_data"
-        await query.message.edit_text(
-            "📥 <b>Импорт данных</b>\n\n"
-            "Отправьте JSON файл с данными:",
-            parse_mode=ParseMode.HTML
-        )
+    mode = "замена" if replace else "объединение"
+    log_action(user_id, f"Импортировал данные ({mode}, записей: {parsed.records})")
+    admin_states[user_id] = None
     
-    elif data.startswith("admin_backup"):
-        data_obj = load_data()
-        backup_data = json.dumps(data_obj, ensure_ascii=False, indent=2)
-        backup_file = BytesIO(backup_data.encode('utf-8'))
-        backup_file.name = f"backup_{int(asyncio.get_event_loop().time())}.json"
-        await context.bot.send_document(
-            chat_id=chat_id,
-            document=InputFile(backup_file, filename=backup_file.name),
-            caption="🔄 Резервная копия данных"
-        )
-        log_action(user_id, "Создал резервную копию")
+    text = (
+        f"✅ <b>Данные импортированы</b> ({mode})\n\n"
+        f"📄 Записей в файле: <b>{parsed.records}</b>\n"
+        f"👥 Новых пользователей: <b>{added['users']}</b>\n"
+        f"🚫 Новых банов: <b>{added['banned_users']}</b>\n"
+        f"👤 Новых админов: <b>{added['admins']}</b>\n"
+        f"📋 Добавлено логов: <b>{logs_added}</b>\n"
+        f"🔁 Повторов пропущено: <b>{parsed.duplicates}</b>\n"
+        f"⚠️ Ошибочных записей: <b>{parsed.invalid}</b>"
+        + errors_text
+    )
+    await status_msg.edit_text(text, reply_markup=keyboard, parse_mode=ParseMode.HTML)
 
 
 async def handle_admin_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -1777,7 +5570,7 @@ async def handle_admin_message(update: Update, context: ContextTypes.DEFAULT_TYP
     if state == "add_channel":
         try:
             channel_id = int(message.text)
-            data = load_data()
+            data = load_config()
             channels = data.get('channel_ids', [])
             if channel_id not in channels:
                 channels.append(channel_id)
@@ -1799,7 +5592,7 @@ async def handle_admin_message(update: Update, context: ContextTypes.DEFAULT_TYP
             channel_index = int(state.split("_")[-1])
             text = message.text.lower()
             if text == "удалить":
-                data = load_data()
+                data = load_config()
                 channels = data.get('channel_ids', [])
                 if 0 <= channel_index < len(channels):
                     removed = channels.pop(channel_index)
@@ -1812,7 +5605,7 @@ async def handle_admin_message(update: Update, context: ContextTypes.DEFAULT_TYP
                         await message.reply_text("❌ Ошибка при сохранении")
             else:
                 channel_id = int(message.text)
-                data = load_data()
+                data = load_config()
                 channels = data.get('channel_ids', [])
                 if 0 <= channel_index < len(channels):
                     channels[channel_index] = channel_id
@@ -1830,7 +5623,7 @@ async def handle_admin_message(update: Update, context: ContextTypes.DEFAULT_TYP
         link_index = int(state.split("_")[-1])
         text = message.text.lower()
         if text == "удалить":
-            data = load_data()
+            data = load_config()
             links = data.get('channel_links', [])
             if 0 <= link_index < len(links):
                 removed = links.pop(link_index)
@@ -1844,7 +5637,7 @@ async def handle_admin_message(update: Update, context: ContextTypes.DEFAULT_TYP
         else:
             link = message.text
             if link.startswith("http"):
-                data = load_data()
+                data = load_config()
                 links = data.get('channel_links', [])
                 if 0 <= link_index < len(links):
                     links[link_index] = link
@@ -1861,7 +5654,7 @@ async def handle_admin_message(update: Update, context: ContextTypes.DEFAULT_TYP
     elif state == "add_link":
         link = message.text
         if link.startswith("http"):
-            data = load_data()
+            data = load_config()
             links = data.get('channel_links', [])
             if link not in links:
                 links.append(link)
@@ -1877,20 +5670,51 @@ async def handle_admin_message(update: Update, context: ContextTypes.DEFAULT_TYP
         else:
             await message.reply_text("❌ Неверный формат ссылки")
     
-    elif state == "edit_file_url":
-        file_url = message.text
+    elif state == "add_file":
+        parts = [part.strip() for part in (message.text or "").split("|")]
+        if len(parts) == 1:
+            parts = [None] + parts
+        file_url = parts[1] if len(parts) > 1 else ""
+        if file_url.startswith("http"):
+            file_name = unquote(file_url.rstrip("/").rsplit("/", 1)[-1]) or DEFAULT_FILE_NAME
+            name = parts[0] or file_name.rsplit(".", 1)[0]
+            version = parts[2] if len(parts) > 2 else ""
+            entry = add_file_entry(name, file_name, url=file_url, version=version)
+            if entry:
+                log_action(user_id, f"Добавил файл {describe_file_entry(entry)}")
+                admin_states[user_id] = None
+                await message.reply_text(f"✅ Файл <b>{describe_file_entry(entry)}</b> добавлен!", parse_mode=ParseMode.HTML)
+                await send_files_menu(message)
+            else:
+                await message.reply_text("❌ Ошибка при сохранении")
+        else:
+            await message.reply_text("❌ Неверный формат ссылки")
+    
+    elif state.startswith("edit_file_url_"):
+        entry_id = int(state.rsplit("_", 1)[1])
+        file_url = message.text or ""
         if file_url.startswith("http"):
-            data = load_data()
-            data['file_url'] = file_url
-            if save_data(data):
+            # Новая ссылка - новый файл: старый file_id больше не подходит
+            if update_file_entry(entry_id, url=file_url, file_id=None, size=None):
+                log_action(user_id, f"Изменил ссылку на файл {entry_id}")
                 admin_states[user_id] = None
                 await message.reply_text("✅ Ссылка на файл обновлена!")
-                await admin_files_menu(update, context)
+                await send_files_menu(message)
             else:
                 await message.reply_text("❌ Ошибка при сохранении")
         else:
             await message.reply_text("❌ Неверный формат ссылки")
     
+    elif state.startswith("edit_file_version_"):
+        entry_id = int(state.rsplit("_", 1)[1])
+        version = (message.text or "").strip()
+        if update_file_entry(entry_id, version="" if version == "-" else version):
+            admin_states[user_id] = None
+            await message.reply_text("✅ Версия файла обновлена!")
+            await send_files_menu(message)
+        else:
+            await message.reply_text("❌ Ошибка при сохранении")
+    
     elif state == "add_admin":
         try:
             admin_id = None
@@ -1926,11 +5750,11 @@ async def handle_admin_message(update: Update, context: ContextTypes.DEFAULT_TYP
             if add_admin(admin_id):
                 log_action(user_id, f"Добавил администратора {admin_id}")
                 admin_states[user_id] = None
-                try:
-                    user_info = await context.bot.get_chat(admin_id)
+                user_info = await chat_info_cache.get(context.bot, admin_id)
+                if user_info is not None:
                     username = user_info.username if user_info.username else f"ID: {admin_id}"
                     await message.reply_text(f"✅ Администратор <b>{username}</b> (ID: {admin_id}) добавлен!", parse_mode=ParseMode.HTML)
-                except:
+                else:
                     await message.reply_text(f"✅ Администратор (ID: {admin_id}) добавлен!")
                 await admin_admins_menu(update, context)
             else:
@@ -1955,15 +5779,19 @@ async def handle_admin_message(update: Update, context: ContextTypes.DEFAULT_TYP
     
     elif state == "upload_file":
         if message.document:
-            file = await context.bot.get_file(message.document.file_id)
-            # Сохраняем информацию о файле
-            data = load_data()
-            data['file_id'] = message.document.file_id
-            data['file_name'] = message.document.file_name
-            if save_data(data):
+            document = message.document
+            file_name = document.file_name or DEFAULT_FILE_NAME
+            # Название и версия из подписи: "Название | версия"
+            parts = [part.strip() for part in (message.caption or "").split("|")]
+            name = parts[0] or file_name.rsplit(".", 1)[0]
+            version = parts[1] if len(parts) > 1 else ""
+            # Файл уже в Telegram - выдается пользователям по file_id без повторной загрузки
+            entry = add_file_entry(name, file_name, file_id=document.file_id, version=version, size=document.file_size)
+            if entry:
+                log_action(user_id, f"Загрузил файл {describe_file_entry(entry)}")
                 admin_states[user_id] = None
-                await message.reply_text("✅ Файл загружен и сохранен!")
-                await admin_files_menu(update, context)
+                await message.reply_text("✅ Файл загружен и добавлен в каталог!")
+                await send_files_menu(message)
             else:
                 await message.reply_text("❌ Ошибка при сохранении")
         else:
@@ -1996,38 +5824,66 @@ async def handle_admin_message(update: Update, context: ContextTypes.DEFAULT_TYP
             await message.reply_text("❌ Неверный формат ID пользователя")
     
     elif state == "search_user":
+        query_text = (message.text or "").strip()
+        if not query_text:
+            await message.reply_text("❌ Отправьте ID, @username или имя пользователя")
+            return
+        
         try:
-            search_id = int(message.text)
-            data = load_data()
-            users = data.get('users', [])
-            banned = data.get('banned_users', [])
-            
-            is_user = search_id in users
-            is_banned = search_id in banned
-            
-            text = (
-                f"🔍 <b>Информация о пользователе</b>\n\n"
-                f"🆔 ID: <code>{search_id}</code>\n"
-                f"👤 В базе: {'✅ Да' if is_user else '❌ Нет'}\n"
-                f"🚫 Статус: {'Забанен' if is_banned else 'Активен'}\n"
-            )
-            
-            try:
-                user_info = await context.bot.get_chat(search_id)
-                text += f"📛 Имя: {user_info.first_name or 'N/A'}\n"
+            search_id = int(query_text)
+        except ValueError:
+            search_id = None
+        
+        if search_id is None:
+            # Поиск по username и имени в локальном индексе профилей
+            found = user_profiles.search(query_text)
+            if not found:
+                await message.reply_text("❌ Пользователи не найдены")
+                return
+            if len(found) > 1:
+                lines = []
+                for found_id in found:
+                    profile = user_profiles.get(found_id)
+                    name = " ".join(part for part in (profile[1], profile[2]) if part) or "N/A"
+                    username = f" @{profile[0]}" if profile[0] else ""
+                    lines.append(f"• <code>{found_id}</code> {html.escape(name)}{username}")
+                await message.reply_text(
+                    f"🔍 <b>Найдено пользователей: {len(found)}</b>\n\n" + "\n".join(lines) +
+                    "\n\nОтправьте ID для подробной информации",
+                    parse_mode=ParseMode.HTML
+                )
+                return
+            search_id = found[0]
+        
+        is_user = search_id in users_index
+        is_banned = search_id in banned_index
+        
+        text = (
+            f"🔍 <b>Информация о пользователе</b>\n\n"
+            f"🆔 ID: <code>{search_id}</code>\n"
+            f"👤 В базе: {'✅ Да' if is_user else '❌ Нет'}\n"
+            f"🚫 Статус: {'Забанен' if is_banned else 'Активен'}\n"
+        )
+        
+        profile_text = format_user_profile(search_id)
+        if profile_text:
+            text += profile_text
+        else:
+            # Профиля нет локально - запрашиваем Telegram (через общий кэш)
+            user_info = await chat_info_cache.get(context.bot, search_id)
+            if user_info is not None:
+                text += f"📛 Имя: {html.escape(user_info.first_name or 'N/A')}\n"
                 if user_info.username:
                     text += f"👤 Username: @{user_info.username}\n"
-            except:
+            else:
                 text += "⚠️ Не удалось получить информацию о пользователе\n"
-            
-            admin_states[user_id] = None
-            await message.reply_text(text, parse_mode=ParseMode.HTML)
-            await admin_users_menu(update, context)
-        except ValueError:
-            await message.reply_text("❌ Неверный формат ID пользователя")
+        
+        admin_states[user_id] = None
+        await message.reply_text(text, parse_mode=ParseMode.HTML)
+        await admin_users_menu(update, context)
     
     elif state == "edit_text_welcome":
-        data = load_data()
+        data = load_config()
         messages = data.get('messages', {})
         messages['welcome'] = message.text
         data['messages'] = messages
@@ -2038,7 +5894,7 @@ async def handle_admin_message(update: Update, context: ContextTypes.DEFAULT_TYP
             await admin_texts_menu(update, context)
     
     elif state == "edit_text_success":
-        data = load_data()
+        data = load_config()
         messages = data.get('messages', {})
         messages['success'] = message.text
         data['messages'] = messages
@@ -2049,7 +5905,7 @@ async def handle_admin_message(update: Update, context: ContextTypes.DEFAULT_TYP
             await admin_texts_menu(update, context)
     
     elif state == "edit_text_error":
-        data = load_data()
+        data = load_config()
         messages = data.get('messages', {})
         messages['error'] = message.text
         data['messages'] = messages
@@ -2063,7 +5919,8 @@ async def handle_admin_message(update: Update, context: ContextTypes.DEFAULT_TYP
         if message.photo:
             file = await context.bot.get_file(message.photo[-1].file_id)
             await file.download_to_drive("Preview.png")
-            data = load_data()
+            remember_photo("Preview.png", message)
+            data = load_config()
             images = data.get('images', {})
             images['preview'] = message.photo[-1].file_id
             data['images'] = images
@@ -2079,7 +5936,8 @@ async def handle_admin_message(update: Update, context: ContextTypes.DEFAULT_TYP
         if message.photo:
             file = await context.bot.get_file(message.photo[-1].file_id)
             await file.download_to_drive("succes.png")
-            data = load_data()
+            remember_photo("succes.png", message)
+            data = load_config()
             images = data.get('images', {})
             images['success'] = message.photo[-1].file_id
             data['images'] = images
@@ -2095,7 +5953,8 @@ async def handle_admin_message(update: Update, context: ContextTypes.DEFAULT_TYP
         if message.photo:
             file = await context.bot.get_file(message.photo[-1].file_id)
             await file.download_to_drive("error.png")
-            data = load_data()
+            remember_photo("error.png", message)
+            data = load_config()
             images = data.get('images', {})
             images['error'] = message.photo[-1].file_id
             data['images'] = images
@@ -2111,7 +5970,8 @@ async def handle_admin_message(update: Update, context: ContextTypes.DEFAULT_TYP
         if message.photo:
             file = await context.bot.get_file(message.photo[-1].file_id)
             await file.download_to_drive("download.jpg")
-            data = load_data()
+            remember_photo("download.jpg", message)
+            data = load_config()
             images = data.get('images', {})
             images['download'] = message.photo[-1].file_id
             data['images'] = images
@@ -2123,34 +5983,29 @@ async def handle_admin_message(update: Update, context: ContextTypes.DEFAULT_TYP
         else:
             await message.reply_text("❌ Пожалуйста, отправьте изображение")
     
-    elif state == "import_data":
+    elif state in ("import_data_merge", "import_data_replace"):
         if message.document:
             try:
-                file = await context.bot.get_file(message.document.file_id)
-                file_data = await file.download_as_bytearray()
-                import_data = json.loads(file_data.decode('utf-8'))
-                
-                # Сохраняем импортированные данные
-                if save_data(import_data):
-                    log_action(user_id, "Импортировал данные")
-                    admin_states[user_id] = None
-                    await message.reply_text("✅ Данные успешно импортированы!")
-                    await admin_export_menu(update, context)
-                else:
-                    await message.reply_text("❌ Ошибка при импорте данных")
+                await shutdown_coordinator.run(
+                    import_data_file(message, context, user_id, replace=(state == "import_data_replace"))
+                )
             except Exception as e:
                 logger.error(f"Ошибка при импорте: {e}")
                 await message.reply_text(f"❌ Ошибка при импорте: {str(e)}")
         else:
-            await message.reply_text("❌ Пожалуйста, отправьте JSON файл")
+            await message.reply_text("❌ Пожалуйста, отправьте файл экспорта (.ndjson.gz) или JSON файл")
     
     elif state == "broadcast":
         admin_states[user_id] = None
         
-        # Получаем всех пользователей
-        users = get_all_users()
+        if broadcast_running():
+            await message.reply_text("⏳ Предыдущая рассылка еще идет. Дождитесь ее завершения.")
+            return
+        
+        # Количество пользователей для рассылки
+        users_total = len(users_index)
         
-        if not users:
+        if not users_total:
             await message.reply_text(
                 "❌ <b>Нет пользователей для рассылки</b>\n\n"
                 "Пока нет пользователей, которые взаимодействовали с ботом.",
@@ -2162,80 +6017,385 @@ async def handle_admin_message(update: Update, context: ContextTypes.DEFAULT_TYP
         # Отправляем сообщение о начале рассылки
         status_msg = await message.reply_text(
             f"📨 <b>Рассылка начата</b>\n\n"
-            f"Пользователей для рассылки: {len(users)}\n"
+            f"Пользователей для рассылки: {users_total}\n"
             f"Отправка сообщений...",
             parse_mode=ParseMode.HTML
         )
         
-        sent_count = 0
-        failed_count = 0
-        
         # Копируем сообщение для рассылки
-        broadcast_text = message.text or message.caption or ""
-        broadcast_photo = None
-        broadcast_document = None
-        
+        content = {'text': message.text or message.caption or "", 'photo': None, 'document': None}
         if message.photo:
-            broadcast_photo = message.photo[-1].file_id
+            content['photo'] = message.photo[-1].file_id
         elif message.document:
-            broadcast_document = message.document.file_id
+            content['document'] = message.document.file_id
         
-        # Отправляем сообщение всем пользователям
-        for user_id_target in users:
-            try:
-                if broadcast_photo:
-                    # Отправляем фото
-                    await context.bot.send_photo(
-                        chat_id=user_id_target,
-                        photo=broadcast_photo,
-                        caption=broadcast_text,
-                        parse_mode=ParseMode.HTML if broadcast_text else None
-                    )
-                elif broadcast_document:
-                    # Отправляем документ
-                    await context.bot.send_document(
-                        chat_id=user_id_target,
-                        document=broadcast_document,
-                        caption=broadcast_text,
-                        parse_mode=ParseMode.HTML if broadcast_text else None
-                    )
-                else:
-                    # Отправляем текстовое сообщение
-                    await context.bot.send_message(
-                        chat_id=user_id_target,
-                        text=broadcast_text,
-                        parse_mode=ParseMode.HTML
-                    )
-                sent_count += 1
-            except Exception as e:
-                failed_count += 1
-                logger.warning(f"Не удалось отправить сообщение пользователю {user_id_target}: {e}")
-                # Удаляем пользователя из списка, если он заблокировал бота
-                if "blocked" in str(e).lower() or "chat not found" in str(e).lower():
-                    data = load_data()
-                    users_list = data.get('users', [])
-                    if user_id_target in users_list:
-                        users_list.remove(user_id_target)
-                        data['users'] = users_list
-                        save_data(data)
+        broadcast = {
+            'chat_id': chat_id,
+            'status_message_id': status_msg.message_id,
+            'content': content,
+            'cursor': None,
+            'sent': 0,
+            'failed': 0,
+            'total': users_total
+        }
         
-        # Обновляем статус рассылки
-        await status_msg.edit_text(
-            f"✅ <b>Рассылка завершена!</b>\n\n"
-            f"📊 Статистика:\n"
-            f"✅ Отправлено: {sent_count}\n"
-            f"❌ Ошибок: {failed_count}\n"
-            f"👥 Всего пользователей: {len(users)}",
+        # Рассылка идет в фоне, бот тем временем отвечает пользователям.
+        # При остановке бота она прерывается и продолжается после перезапуска
+        start_broadcast(context.application, broadcast)
+
+
+# ==================== РАССЫЛКА ====================
+
+# Файл с позицией незавершенной рассылки
+BROADCAST_CHECKPOINT_FILE = "broadcast_checkpoint.json"
+
+# Как часто сохранять позицию рассылки (количество сообщений)
+BROADCAST_CHECKPOINT_EVERY = 200
+
+# Сколько сообщений рассылки отправляется одновременно
+BROADCAST_BATCH_SIZE = OUTBOUND_BULK_IN_FLIGHT
+
+# Текущая рассылка (одновременно идет только одна - позиция хранится в одном файле)
+_broadcast_task: Optional[asyncio.Task] = None
+
+
+def save_broadcast_checkpoint(broadcast: dict):
+    """Сохраняет позицию рассылки"""
+    try:
+        _write_bytes_atomic(BROADCAST_CHECKPOINT_FILE, json_dumps(broadcast))
+    except Exception as e:
+        logger.error(f"Ошибка при сохранении позиции рассылки: {e}")
+
+
+def load_broadcast_checkpoint() -> Optional[dict]:
+    """Позиция незавершенной рассылки (None, если ее нет)"""
+    try:
+        if os.path.exists(BROADCAST_CHECKPOINT_FILE):
+            with open(BROADCAST_CHECKPOINT_FILE, 'rb') as f:
+                return json_loads(f.read())
+    except Exception as e:
+        logger.error(f"Ошибка при загрузке позиции рассылки: {e}")
+    return None
+
+
+def clear_broadcast_checkpoint():
+    """Удаляет позицию завершенной рассылки"""
+    try:
+        os.remove(BROADCAST_CHECKPOINT_FILE)
+    except FileNotFoundError:
+        pass
+
+
+async def send_broadcast_message(bot, chat_id: int, content: dict):
+    """Отправляет сообщение рассылки одному пользователю"""
+    text = content.get('text') or ""
+    if content.get('photo'):
+        # Отправляем фото
+        await bot.send_photo(
+            chat_id=chat_id,
+            photo=content['photo'],
+            caption=text,
+            parse_mode=ParseMode.HTML if text else None
+        )
+    elif content.get('document'):
+        # Отправляем документ
+        await bot.send_document(
+            chat_id=chat_id,
+            document=content['document'],
+            caption=text,
+            parse_mode=ParseMode.HTML if text else None
+        )
+    else:
+        # Отправляем текстовое сообщение
+        await bot.send_message(
+            chat_id=chat_id,
+            text=text,
             parse_mode=ParseMode.HTML
         )
+
+
+async def update_broadcast_status(bot, broadcast: dict, title: str,
+                                  reply_markup: Optional[InlineKeyboardMarkup] = None):
+    """Обновляет сообщение со статусом рассылки у администратора"""
+    try:
+        await bot.edit_message_text(
+            chat_id=broadcast['chat_id'],
+            message_id=broadcast['status_message_id'],
+            text=(
+                f"{title}\n\n"
+                f"📊 Статистика:\n"
+                f"✅ Отправлено: {broadcast['sent']}\n"
+                f"❌ Ошибок: {broadcast['failed']}\n"
+                f"👥 Всего пользователей: {broadcast['total']}"
+            ),
+            parse_mode=ParseMode.HTML,
+            reply_markup=reply_markup
+        )
+    except Exception as e:
+        logger.warning(f"Не удалось обновить статус рассылки: {e}")
+
+
+def broadcast_method(content: dict) -> str:
+    """Метод Bot API, которым отправляется сообщение рассылки"""
+    if content.get('photo'):
+        return 'sendPhoto'
+    if content.get('document'):
+        return 'sendDocument'
+    return 'sendMessage'
+
+
+async def send_broadcast_batch(bot, broadcast: dict, batch: List[int]) -> List[int]:
+    """
+    Отправляет сообщение рассылки группе пользователей одновременно.
+    Возвращает пользователей, которым сообщение не отправлялось из-за открытого автомата
+    защиты - их нужно повторить, а не считать ошибкой.
+    """
+    # Рассылка уступает бюджет вызовов ответам пользователям и проверкам подписки
+    with outbound_class(PRIORITY_BULK):
+        results = await asyncio.gather(
+            *(send_broadcast_message(bot, target, broadcast['content']) for target in batch),
+            return_exceptions=True
+        )
+    retry = []
+    blocked = []
+    for target, result in zip(batch, results):
+        if not isinstance(result, BaseException):
+            broadcast['sent'] += 1
+            continue
+        if isinstance(result, CircuitOpenError):
+            retry.append(target)
+            continue
+        broadcast['failed'] += 1
+        logger.warning(f"Не удалось отправить сообщение пользователю {target}: {result}")
+        # Пользователей, заблокировавших бота, удаляем из списка одной пачкой
+        if "blocked" in str(result).lower() or "chat not found" in str(result).lower():
+            blocked.append(target)
+    if blocked:
+        remove_users(blocked)
+    return retry
+
+
+async def run_broadcast(bot, broadcast: dict) -> bool:
+    """
+    Рассылает сообщение пользователям с ID больше broadcast['cursor'] по возрастанию,
+    группами по BROADCAST_BATCH_SIZE одновременных отправок.
+    
+    Позиция периодически сохраняется в BROADCAST_CHECKPOINT_FILE. При остановке бота
+    рассылка сохраняет позицию и прерывается, после перезапуска она продолжается
+    (resume_broadcast_job). Возвращает True, если рассылка завершена.
+    """
+    # Пользователи до cursor обработаны, кроме pending - им сообщение еще не отправлялось,
+    # потому что Telegram не принимал сообщения (открыт автомат защиты)
+    pending = list(broadcast.get('pending') or [])
+    unsaved = 0
+    while True:
+        if shutdown_coordinator.requested:
+            broadcast['pending'] = pending
+            save_broadcast_checkpoint(broadcast)
+            await update_broadcast_status(
+                bot, broadcast,
+                "⏸️ <b>Рассылка приостановлена</b> - бот перезапускается, она продолжится автоматически"
+            )
+            logger.info(f"⏸️ Рассылка приостановлена на пользователе {broadcast['cursor']}")
+            return False
+        
+        if pending:
+            batch = pending
+        else:
+            # Следующая группа читается из множества по курсору - список всех ID не строится
+            users = users_index.ensure()
+            start = 0 if broadcast['cursor'] is None else users.bisect_right(broadcast['cursor'])
+            batch = users.slice(start, start + BROADCAST_BATCH_SIZE)
+            if not batch:
+                break
+            broadcast['cursor'] = batch[-1]
+        pending = await send_broadcast_batch(bot, broadcast, batch)
+        broadcast['pending'] = pending
+        
+        if pending:
+            # Ждем, пока автомат защиты пропустит пробный вызов, и повторяем тех же пользователей
+            method = broadcast_method(broadcast['content'])
+            logger.warning(f"⏳ Рассылка ждет восстановления {method}, не отправлено: {len(pending)}")
+            while api_guard.is_open(method) and not shutdown_coordinator.requested:
+                await asyncio.sleep(1)
+            continue
         
-        # Возвращаемся в меню рассылки через 3 секунды
-        await asyncio.sleep(3)
-        await admin_broadcast_menu(update, context)
+        unsaved += len(batch)
+        if unsaved >= BROADCAST_CHECKPOINT_EVERY:
+            save_broadcast_checkpoint(broadcast)
+            unsaved = 0
+    
+    clear_broadcast_checkpoint()
+    bot_stats.record('broadcasts')
+    
+    # Обновляем статус рассылки
+    await update_broadcast_status(
+        bot, broadcast, "✅ <b>Рассылка завершена!</b>",
+        InlineKeyboardMarkup([[InlineKeyboardButton("🔙 К рассылке", callback_data="admin_broadcast")]])
+    )
+    return True
+
+
+def broadcast_running() -> bool:
+    """Идет ли сейчас рассылка"""
+    return _broadcast_task is not None and not _broadcast_task.done()
+
+
+def start_broadcast(application: Application, broadcast: dict):
+    """Запускает рассылку фоновой задачей (Application дожидается ее при остановке)"""
+    global _broadcast_task
+    _broadcast_task = application.create_task(run_broadcast(application.bot, broadcast))
+
+
+async def resume_broadcast_job(context: ContextTypes.DEFAULT_TYPE):
+    """Продолжает рассылку, прерванную перезапуском бота"""
+    broadcast = load_broadcast_checkpoint()
+    if not broadcast:
+        return
+    logger.info(f"▶️ Продолжаем рассылку с пользователя {broadcast.get('cursor')}")
+    await update_broadcast_status(context.bot, broadcast, "▶️ <b>Рассылка продолжена после перезапуска</b>")
+    start_broadcast(context.application, broadcast)
+
+
+# ==================== ОСТАНОВКА ====================
+
+# Сколько секунд ждать завершения текущей работы при остановке
+SHUTDOWN_DEADLINE = 20
+
+
+def flush_buffers():
+    """Сохраняет на диск все накопленное в памяти состояние"""
+    flush_users_data()
+    save_runtime_state()
+    user_profiles.save()
+    bot_stats.save()
+    funnel_stats.save()
+    channel_health.save()
+
+
+class ShutdownCoordinator:
+    """
+    Плавная остановка бота по SIGTERM/SIGINT.
+    
+    - После сигнала прием обновлений прекращается, PTB дожидается обработки уже
+      полученных; буферы сохраняются в post_shutdown, когда обработка закончена
+    - Рассылка проверяет requested, сохраняет позицию и завершается
+    - Долгие операции обработчиков запускаются через run() (скачивание и загрузка файлов,
+      экспорт и импорт данных) и отменяются, если не успели завершиться за
+      SHUTDOWN_DEADLINE секунд; остальные вызовы Telegram ограничены API_TIMEOUTS
+    """
+
+    def __init__(self, deadline: float = SHUTDOWN_DEADLINE):
+        self.deadline = deadline
+        self.requested = False
+        self._tasks = set()
+        self._expired = set()
+        self._watchdog = None
+
+    def install(self, app: Application):
+        """Перехватывает сигналы остановки (на Windows остается стандартная обработка PTB)"""
+        # run_polling уже установил свои обработчики SIGINT/SIGTERM (они сразу завершают цикл
+        # через SystemExit); add_signal_handler заменяет их на плавную остановку
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, self.request, app)
+            except (NotImplementedError, RuntimeError):
+                return
+
+    def request(self, app: Application):
+        """Начинает остановку"""
+        if self.requested:
+            return
+        self.requested = True
+        logger.info(f"🛑 Сигнал остановки: новые обновления не принимаются, "
+                    f"ждем завершения текущей работы до {self.deadline:.0f} с")
+        self._watchdog = asyncio.get_running_loop().create_task(self._expire())
+        app.stop_running()
+
+    async def _expire(self):
+        await asyncio.sleep(self.deadline)
+        if self._tasks:
+            logger.warning(f"⏱️ Срок остановки истек, прерываем незавершенную работу: {len(self._tasks)}")
+        for task in list(self._tasks):
+            self._expired.add(task)
+            task.cancel()
+
+    async def run(self, coro):
+        """Выполняет долгую операцию, которую можно прервать по истечении срока остановки"""
+        task = asyncio.ensure_future(coro)
+        self._tasks.add(task)
+        try:
+            return await task
+        except asyncio.CancelledError:
+            if task in self._expired:
+                # Обработчик получает обычную ошибку, а не отмену - иначе остановится обработка обновлений
+                raise TimeoutError("операция прервана при остановке бота")
+            raise
+        finally:
+            self._tasks.discard(task)
+            self._expired.discard(task)
+
+
+shutdown_coordinator = ShutdownCoordinator()
+
+
+# ==================== ЗАПУСК ====================
+
+class StartupTimer:
+    """Замеряет этапы запуска и выводит разбивку по времени"""
+
+    def __init__(self, started_at: float):
+        self.started_at = started_at
+        self._last = started_at
+        self.phases: List[tuple] = []
+
+    def mark(self, phase: str):
+        """Завершает этап phase"""
+        now = time.perf_counter()
+        self.phases.append((phase, now - self._last))
+        self._last = now
+
+    def report(self):
+        total = (self._last - self.started_at) * 1000
+        breakdown = ", ".join(f"{phase} {seconds * 1000:.0f} мс" for phase, seconds in self.phases)
+        logger.info(f"⏱️ Запуск за {total:.0f} мс: {breakdown}")
+
+
+startup_timer = StartupTimer(STARTUP_STARTED_AT)
+
+# Меню команд бота
+BOT_COMMANDS = [
+    BotCommand("start", "🚀 Запустить бота"),
+    BotCommand("admin", "🔐 Админ-панель (только для администраторов)")
+]
+
+
+async def register_bot_commands_job(context: ContextTypes.DEFAULT_TYPE):
+    """Устанавливает меню команд в фоне после запуска, если оно отличается от текущего"""
+    try:
+        current = await context.bot.get_my_commands()
+        if list(current) == BOT_COMMANDS:
+            return
+        await context.bot.set_my_commands(BOT_COMMANDS)
+        logger.info("Меню команд установлено")
+    except Exception as e:
+        logger.warning(f"Не удалось установить меню команд (это не критично): {e}")
+        logger.info("Бот продолжит работу без установки команд меню")
+
+
+async def warm_caches_job(context: ContextTypes.DEFAULT_TYPE):
+    """Заранее собирает меню и загружает списки пользователей, пока нет нагрузки"""
+    get_main_menu_render()
+    get_admin_panel_keyboard()
+    get_download_keyboard()
+    get_back_to_main_keyboard()
+    load_users_data()
 
 
 def main():
     """Основная функция запуска бота"""
+    startup_timer.mark("импорт и настройки")
     # Исправление для Python 3.10+ на Windows: устанавливаем политику event loop
     if sys.platform == 'win32':
         asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
@@ -2260,40 +6420,141 @@ def main():
         logger.error("BOT_TOKEN не установлен! Установите переменную окружения BOT_TOKEN.")
         return
     
-    # Создаем приложение с установкой меню команд
     async def post_init(app: Application) -> None:
-        """Устанавливает меню команд после инициализации"""
-        commands = [
-            BotCommand("start", "🚀 Запустить бота"),
-            BotCommand("admin", "🔐 Админ-панель (только для администраторов)")
-        ]
+        """Завершает замер запуска; меню команд и прогрев кэшей выполняются в фоне после старта"""
+        startup_timer.mark("подключение к Telegram")
+        startup_timer.report()
+        shutdown_coordinator.install(app)
+        if app.job_queue:
+            app.job_queue.run_once(register_bot_commands_job, when=1)
+            app.job_queue.run_once(warm_caches_job, when=0)
+            app.job_queue.run_once(resume_broadcast_job, when=2)
+        else:
+            await register_bot_commands_job(CallbackContext(app))
+    
+    # Отдельные пулы соединений: getUpdates, ответы и загрузки файлов (размеры и таймауты задаются в .env).
+    # Таймауты ответа для отдельных методов задаются в API_TIMEOUTS
+    http_version = "1.1"
+    if TELEGRAM_HTTP2:
+        if h2 is None:
+            logger.warning("TELEGRAM_HTTP2=1, но пакет h2 не установлен - используется HTTP/1.1")
+        else:
+            http_version = "2"
+    media_request = MeteredRequest(
+        "загрузки",
+        connection_pool_size=TELEGRAM_MEDIA_POOL_SIZE,
+        pool_timeout=TELEGRAM_POOL_TIMEOUT,
+        read_timeout=TELEGRAM_READ_TIMEOUT,
+        write_timeout=TELEGRAM_WRITE_TIMEOUT,
+        connect_timeout=TELEGRAM_CONNECT_TIMEOUT,
+        media_write_timeout=TELEGRAM_MEDIA_WRITE_TIMEOUT,
+        http_version=http_version
+    )
+    request = GuardedRequest(
+        "ответы",
+        connection_pool_size=TELEGRAM_POOL_SIZE,
+        pool_timeout=TELEGRAM_POOL_TIMEOUT,
+        media_request=media_request,
+        read_timeout=TELEGRAM_READ_TIMEOUT,
+        write_timeout=TELEGRAM_WRITE_TIMEOUT,
+        connect_timeout=TELEGRAM_CONNECT_TIMEOUT,
+        media_write_timeout=TELEGRAM_MEDIA_WRITE_TIMEOUT,
+        http_version=http_version
+    )
+    get_updates_request = MeteredRequest(
+        "getUpdates",
+        connection_pool_size=1,
+        pool_timeout=None,
+        read_timeout=TELEGRAM_POLL_READ_TIMEOUT,
+        connect_timeout=TELEGRAM_CONNECT_TIMEOUT
+    )
+    logger.info(f"🔗 Пулы соединений: ответы {TELEGRAM_POOL_SIZE}, загрузки {TELEGRAM_MEDIA_POOL_SIZE}, "
+                f"getUpdates 1 (HTTP/{http_version})")
+    
+    async def post_shutdown(app: Application) -> None:
+        """Сохраняет оперативное состояние, последние изменения данных и дописывает журнал действий"""
+        flush_buffers()
         try:
-            await app.bot.set_my_commands(commands)
-            logger.info("Меню команд установлено")
+            snapshot_store.checkpoint(snapshot_data())
         except Exception as e:
-            logger.warning(f"Не удалось установить меню команд (это не критично): {e}")
-            logger.info("Бот продолжит работу без установки команд меню")
-    
-    # Создаем приложение с настройками таймаутов
-    from telegram.request import HTTPXRequest
-    
-    # Создаем request с увеличенными таймаутами
-    request = HTTPXRequest(
-        connection_pool_size=8,
-        read_timeout=60.0,
-        write_timeout=60.0,
-        connect_timeout=60.0
+            logger.error(f"Ошибка при создании снимка данных: {e}")
+        action_log.close()
+    
+    # Восстанавливаем последние сообщения, состояния админов и профили пользователей
+    load_runtime_state()
+    user_profiles.load()
+    bot_stats.load()
+    funnel_stats.load()
+    channel_health.load()
+    startup_timer.mark("оперативное состояние")
+    
+    application = (
+        Application.builder()
+        .token(token)
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .request(request)
+        .get_updates_request(get_updates_request)
+        .build()
     )
     
-    application = Application.builder().token(token).post_init(post_init).request(request).build()
+    # Периодически сохраняем оперативное состояние
+    if application.job_queue:
+        application.job_queue.run_repeating(
+            persist_runtime_state_job,
+            interval=RUNTIME_STATE_SAVE_INTERVAL,
+            first=RUNTIME_STATE_SAVE_INTERVAL
+        )
+        application.job_queue.run_repeating(
+            persist_user_profiles_job,
+            interval=USER_PROFILES_SAVE_INTERVAL,
+            first=USER_PROFILES_SAVE_INTERVAL
+        )
+        application.job_queue.run_repeating(
+            persist_stats_job,
+            interval=STATS_SAVE_INTERVAL,
+            first=STATS_SAVE_INTERVAL
+        )
+        application.job_queue.run_repeating(
+            persist_funnel_job,
+            interval=STATS_SAVE_INTERVAL,
+            first=STATS_SAVE_INTERVAL
+        )
+        application.job_queue.run_repeating(
+            users_flush_job,
+            interval=USERS_FLUSH_INTERVAL,
+            first=USERS_FLUSH_INTERVAL
+        )
+        application.job_queue.run_repeating(
+            config_watch_job,
+            interval=CONFIG_RELOAD_INTERVAL,
+            first=CONFIG_RELOAD_INTERVAL
+        )
+        application.job_queue.run_repeating(
+            snapshot_job,
+            interval=SNAPSHOT_INTERVAL,
+            first=10
+        )
+        application.job_queue.run_repeating(
+            channel_health_job,
+            interval=CHANNEL_HEALTH_INTERVAL,
+            first=3
+        )
+    else:
+        logger.warning("JobQueue недоступен - оперативное состояние сохраняется только при остановке")
     
     # Регистрируем обработчики
+    # Группа -1 выполняется раньше остальных и только запоминает профиль отправителя
+    application.add_handler(TypeHandler(Update, track_user_profile), group=-1)
+    application.add_error_handler(error_handler)
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("getid", get_id))
     application.add_handler(CommandHandler("admin", admin_panel))
+    application.add_handler(CommandHandler("restore", restore_command))
     application.add_handler(CallbackQueryHandler(button_callback))
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
     application.add_handler(MessageHandler(filters.Document.ALL | filters.PHOTO, handle_admin_message))
+    startup_timer.mark("приложение и обработчики")
     
     # Запускаем бота
     logger.info("Бот запущен...")
@@ -2318,4 +6579,7 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    if "--benchmark-storage" in sys.argv:
+        benchmark_storage()
+    else:
+        main()
\ No newline at end of file
@@ -0,0 +1,9 @@
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# bot.py читает и пишет файлы данных в текущем каталоге - тесты работают во временном
+os.chdir(tempfile.mkdtemp(prefix="bot-tests-"))
@@ -0,0 +1,34 @@
+import asyncio
+import threading
+
+import bot
+
+
+def test_store_does_not_start_thread_until_used(tmp_path):
+    before = {thread.name for thread in threading.enumerate()}
+    store = bot.ActionLogStore(str(tmp_path / "logs"))
+    assert store._executor is None
+    assert {thread.name for thread in threading.enumerate()} == before
+    store.close()
+
+
+def test_count_and_rotation_are_kept_by_log_thread(tmp_path):
+    directory = str(tmp_path / "logs")
+
+    async def scenario():
+        store = bot.ActionLogStore(directory, segment_size=3, max_segments=2)
+        for number in range(10):
+            store.append(1, f"действие {number}")
+        # Счетчик читается в потоке журнала после всех добавленных записей
+        assert await store.count() == 7  # самый старый сегмент из 3 записей удален
+        page = await store.run(store.page, 0, 2)
+        assert [entry['action'] for entry in page] == ["действие 9", "действие 8"]
+        store.close()
+        
+        reopened = bot.ActionLogStore(directory, segment_size=3, max_segments=2)
+        assert await reopened.count() == 7
+        reopened.append(2, "после перезапуска")
+        assert await reopened.count() == 8
+        reopened.close()
+
+    asyncio.run(scenario())
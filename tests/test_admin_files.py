@@ -0,0 +1,32 @@
+import asyncio
+from types import SimpleNamespace
+
+import bot
+
+
+class FakeMessage:
+    def __init__(self, text):
+        self.text = text
+        self.replies = []
+
+    async def reply_text(self, text, reply_markup=None, parse_mode=None):
+        self.replies.append((text, reply_markup))
+
+
+def test_files_menu_is_sent_after_editing_entry_from_message(monkeypatch):
+    monkeypatch.setattr(bot, 'is_admin', lambda user_id: True)
+    entry = bot.add_file_entry("Tweaker", "tweaker.exe", url="https://example.com/tweaker.exe")
+    bot.admin_states[1] = f"edit_file_version_{entry['id']}"
+    message = FakeMessage("2.0")
+    update = SimpleNamespace(effective_user=SimpleNamespace(id=1), effective_chat=SimpleNamespace(id=1),
+                             message=message, callback_query=None)
+
+    asyncio.run(bot.handle_admin_message(update, None))
+
+    assert message.replies[0][0] == "✅ Версия файла обновлена!"
+    text, reply_markup = message.replies[1]
+    assert "Управление файлами" in text
+    buttons = [button.callback_data for row in reply_markup.inline_keyboard for button in row]
+    assert f"admin_file_{entry['id']}" in buttons
+    assert bot.find_file_entry(bot.current_config(), entry['id'])['version'] == "2.0"
+    assert bot.admin_states.get(1) is None
@@ -0,0 +1,73 @@
+import bot
+
+
+def test_least_recently_used_entry_is_evicted():
+    store = bot.BoundedStore(max_size=2, ttl=60)
+    store[1] = "a"
+    store[2] = "b"
+    assert store[1] == "a"  # 1 становится недавно использованной
+    store[3] = "c"
+    assert 2 not in store
+    assert store.get(1) == "a" and store.get(3) == "c"
+    assert len(store) == 2
+
+
+def test_expired_entries_are_missing(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(bot.time, 'time', lambda: now[0])
+    store = bot.BoundedStore(max_size=10, ttl=60)
+    store['old'] = 1
+    now[0] += 30
+    store['new'] = 2
+    now[0] += 40
+    assert 'old' not in store
+    assert store.get('new') == 2
+    now[0] += 60
+    assert store.purge_expired() == 1
+    assert len(store) == 0
+
+
+def test_none_deletes_and_dirty_flag():
+    store = bot.BoundedStore(max_size=10, ttl=60)
+    assert not store.dirty
+    store['key'] = "value"
+    assert store.dirty
+    store.dirty = False
+    store['key'] = None
+    assert 'key' not in store
+    assert store.dirty
+    assert store.pop('missing', "default") == "default"
+
+
+def test_records_round_trip_skips_expired(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(bot.time, 'time', lambda: now[0])
+    store = bot.BoundedStore(max_size=10, ttl=60)
+    store[1] = "a"
+    store[2] = "b"
+    records = store.to_records()
+    restored = bot.BoundedStore(max_size=1, ttl=60)
+    restored.load_records(records)
+    # Ограничение размера действует и при загрузке - остается самая свежая запись
+    assert len(restored) == 1 and restored.get(2) == "b"
+    assert not restored.dirty
+    now[0] += 120
+    empty = bot.BoundedStore(max_size=10, ttl=60)
+    empty.load_records(records)
+    assert len(empty) == 0
+
+
+def test_failed_runtime_state_write_keeps_changes_dirty(monkeypatch):
+    def failing_write(state):
+        raise OSError("disk full")
+
+    bot.user_messages[7] = 70
+    monkeypatch.setattr(bot, 'write_runtime_state', failing_write)
+    assert bot.save_runtime_state() is False
+    assert bot.user_messages.dirty
+
+    written = []
+    monkeypatch.setattr(bot, 'write_runtime_state', written.append)
+    assert bot.save_runtime_state() is True
+    assert [7, 70] in [record[:2] for record in written[0]['user_messages']]
+    assert not bot.user_messages.dirty
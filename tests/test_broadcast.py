@@ -0,0 +1,99 @@
+import asyncio
+
+from telegram.error import Forbidden
+
+import bot
+
+
+def make_broadcast(total):
+    return {'chat_id': 1, 'status_message_id': 1, 'cursor': None, 'sent': 0, 'failed': 0, 'total': total,
+            'content': {'text': "hi", 'photo': None, 'document': None}}
+
+
+class FakeBot:
+    def __init__(self, fail_first=0):
+        self.fail_first = fail_first
+        self.sent = []
+
+    async def send_message(self, chat_id, text, parse_mode=None):
+        if self.fail_first:
+            self.fail_first -= 1
+            raise bot.CircuitOpenError('sendMessage')
+        self.sent.append(chat_id)
+
+    async def edit_message_text(self, **kwargs):
+        pass
+
+
+def setup_broadcast(monkeypatch, users):
+    checkpoints = []
+    monkeypatch.setattr(bot, 'save_broadcast_checkpoint', lambda broadcast: checkpoints.append(dict(broadcast)))
+    monkeypatch.setattr(bot, 'clear_broadcast_checkpoint', lambda: None)
+    monkeypatch.setattr(bot.users_index, 'ensure', lambda: bot.CompactIdSet(users))
+    return checkpoints
+
+
+def test_open_circuit_does_not_skip_users(monkeypatch):
+    setup_broadcast(monkeypatch, range(1, 11))
+    fake = FakeBot(fail_first=6)
+    broadcast = make_broadcast(10)
+    assert asyncio.run(bot.run_broadcast(fake, broadcast))
+    assert sorted(fake.sent) == list(range(1, 11))
+    assert broadcast['sent'] == 10
+    assert broadcast['failed'] == 0
+
+
+def test_shutdown_keeps_pending_users_in_checkpoint(monkeypatch):
+    checkpoints = setup_broadcast(monkeypatch, range(1, 11))
+    fake = FakeBot(fail_first=2)
+    monkeypatch.setattr(bot.api_guard, 'is_open', lambda key: True)
+
+    async def scenario():
+        task = asyncio.create_task(bot.run_broadcast(fake, make_broadcast(10)))
+        await asyncio.sleep(0.05)
+        bot.shutdown_coordinator.requested = True
+        return await task
+
+    try:
+        assert asyncio.run(scenario()) is False
+    finally:
+        bot.shutdown_coordinator.requested = False
+    saved = checkpoints[-1]
+    assert saved['cursor'] == 4
+    assert sorted(saved['pending']) == [1, 2]
+
+    # После перезапуска сначала отправляются отложенные пользователи, затем остальные
+    monkeypatch.setattr(bot.api_guard, 'is_open', lambda key: False)
+    resumed = FakeBot()
+    assert asyncio.run(bot.run_broadcast(resumed, saved))
+    assert sorted(resumed.sent) == [1, 2] + list(range(5, 11))
+
+
+def test_targets_are_read_in_batches_from_cursor(monkeypatch):
+    users = bot.CompactIdSet(range(1, 101))
+    setup_broadcast(monkeypatch, ())
+    monkeypatch.setattr(bot.users_index, 'ensure', lambda: users)
+    slices = []
+    original = bot.CompactIdSet.slice
+    monkeypatch.setattr(bot.CompactIdSet, 'slice', lambda self, start, end: (slices.append(end - start),
+                                                                              original(self, start, end))[1])
+    removed = []
+    monkeypatch.setattr(bot, 'remove_users', lambda ids: removed.append(list(ids)))
+
+    class BlockedBot(FakeBot):
+        async def send_message(self, chat_id, text, parse_mode=None):
+            if chat_id % 10 == 0:
+                raise Forbidden("Forbidden: bot was blocked by the user")
+            if chat_id == 51:
+                users.add(1001)  # новый пользователь за курсором тоже получит рассылку
+            self.sent.append(chat_id)
+
+    fake = BlockedBot()
+    broadcast = make_broadcast(100)
+    assert asyncio.run(bot.run_broadcast(fake, broadcast))
+    assert max(slices) == bot.BROADCAST_BATCH_SIZE
+    assert 1001 in fake.sent
+    assert broadcast['failed'] == 10
+    # Заблокировавшие бота удаляются одной пачкой на группу отправок
+    assert all(len(batch) <= bot.BROADCAST_BATCH_SIZE for batch in removed)
+    assert sorted(sum(removed, [])) == list(range(10, 101, 10))
@@ -0,0 +1,95 @@
+import asyncio
+import itertools
+from types import SimpleNamespace
+
+import pytest
+
+import bot
+
+query_ids = itertools.count(1)
+
+
+async def handler(update, context, **params):
+    return params
+
+
+def make_router():
+    router = bot.CallbackRouter()
+    router.add("admin_stats", handler)
+    router.add("admin_file_{entry_id:int}", handler)
+    router.add("admin_file_url_{entry_id:int}", handler)
+    router.add("admin_user_list_{cursor}", handler)
+    return router
+
+
+def test_resolve_exact_and_parametrized_routes():
+    router = make_router()
+    route, params = router.resolve("admin_stats")
+    assert route.pattern == "admin_stats" and params == {}
+    route, params = router.resolve("admin_file_12")
+    assert route.pattern == "admin_file_{entry_id:int}" and params == {'entry_id': 12}
+    # Самый длинный префикс выигрывает
+    route, params = router.resolve("admin_file_url_7")
+    assert route.pattern == "admin_file_url_{entry_id:int}" and params == {'entry_id': 7}
+    route, params = router.resolve("admin_user_list_>15")
+    assert params == {'cursor': ">15"}
+
+
+def test_resolve_rejects_unknown_and_unparsable_data():
+    router = make_router()
+    assert router.resolve("admin_file_") is None
+    assert router.resolve("admin_file_abc") is None
+    assert router.resolve("unknown") is None
+
+
+def test_duplicate_routes_are_rejected():
+    router = make_router()
+    with pytest.raises(ValueError):
+        router.add("admin_stats", handler)
+    with pytest.raises(ValueError):
+        router.add("admin_file_{other:int}", handler)
+
+
+class FakeQuery:
+    def __init__(self, data, user_id):
+        self.id = str(next(query_ids))
+        self.data = data
+        self.from_user = SimpleNamespace(id=user_id)
+        self.answers = []
+
+    async def answer(self, text=None, show_alert=False):
+        self.answers.append((text, show_alert))
+
+
+def dispatch(router, data, user_id=1):
+    query = FakeQuery(data, user_id)
+    asyncio.run(router.dispatch(SimpleNamespace(callback_query=query), None))
+    return query
+
+
+def test_each_press_is_answered_once(monkeypatch):
+    monkeypatch.setattr(bot, 'is_admin', lambda user_id: user_id == 1)
+    calls = []
+    router = bot.CallbackRouter()
+
+    async def menu(update, context):
+        calls.append("menu")
+
+    async def remove(update, context):
+        await bot.answer_query(update.callback_query, "✅ Удалено", show_alert=True)
+        await menu(update, context)
+
+    async def silent(update, context):
+        pass
+
+    router.add("menu", menu, admin=True)
+    router.add("remove", remove, admin=True, answer=False)
+    router.add("silent", silent, answer=False)
+
+    assert dispatch(router, "menu").answers == [(None, False)]
+    assert dispatch(router, "remove").answers == [("✅ Удалено", True)]
+    assert dispatch(router, "silent").answers == [(None, False)]
+    assert dispatch(router, "unknown").answers == [(None, False)]
+    denied = dispatch(router, "menu", user_id=2)
+    assert denied.answers == [("❌ У вас нет доступа", True)]
+    assert calls == ["menu", "menu"]
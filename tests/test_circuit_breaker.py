@@ -0,0 +1,101 @@
+import asyncio
+
+from telegram.error import BadRequest, TimedOut
+from telegram.request import HTTPXRequest, RequestData
+
+import bot
+
+
+def test_breaker_opens_after_consecutive_failures():
+    breaker = bot.CircuitBreaker('sendMessage', failure_threshold=3, reset_timeout=30)
+    for _ in range(2):
+        assert breaker.allow()
+        breaker.failure()
+    assert breaker.state == 'closed'
+    breaker.failure()
+    assert breaker.state == 'open'
+    assert breaker.is_open()
+    assert not breaker.allow()
+    assert breaker.trips == 1
+
+
+def test_success_resets_failure_count():
+    breaker = bot.CircuitBreaker('sendMessage', failure_threshold=2)
+    breaker.failure()
+    breaker.success()
+    breaker.failure()
+    assert breaker.state == 'closed'
+
+
+def test_half_open_allows_single_probe():
+    breaker = bot.CircuitBreaker('getChatMember', failure_threshold=1, reset_timeout=30)
+    breaker.failure()
+    breaker.opened_at -= 31
+    assert not breaker.is_open()
+    assert breaker.allow()
+    assert breaker.state == 'half-open'
+    assert breaker.is_open()
+    assert not breaker.allow()
+
+    breaker.success()
+    assert breaker.state == 'closed'
+    assert breaker.allow()
+
+
+def test_failed_probe_reopens():
+    breaker = bot.CircuitBreaker('getChatMember', failure_threshold=1, reset_timeout=30)
+    breaker.failure()
+    breaker.opened_at -= 31
+    assert breaker.allow()
+    breaker.failure()
+    assert breaker.state == 'open'
+    assert breaker.is_open()
+
+
+def test_cancelled_probe_can_be_retried():
+    breaker = bot.CircuitBreaker('getChatMember', failure_threshold=1, reset_timeout=30)
+    breaker.failure()
+    breaker.opened_at -= 31
+    assert breaker.allow()
+    breaker.cancel()
+    assert breaker.allow()
+
+
+def test_channel_keys():
+    assert bot.ApiGuard.channel_key(-1001) == "chat:-1001"
+    assert bot.ApiGuard.channel_key("@Pro_Tweaks") == "chat:@pro_tweaks"
+    assert bot.ApiGuard.channel_key(12345) is None
+    assert bot.ApiGuard.channel_key(None) is None
+
+
+def test_dependency_failures():
+    assert bot.is_dependency_failure(TimedOut())
+    assert not bot.is_dependency_failure(BadRequest("message is not modified"))
+    assert not bot.is_dependency_failure(bot.PoolExhaustedError("busy"))
+
+
+def test_pool_exhaustion_does_not_trip_breaker(monkeypatch):
+    monkeypatch.setattr(bot, 'api_guard', bot.ApiGuard())
+
+    async def slow_request(self, *args, **kwargs):
+        await asyncio.sleep(0.3)
+        return 200, b'{"ok": true, "result": true}'
+
+    monkeypatch.setattr(HTTPXRequest, 'do_request', slow_request)
+    request = bot.GuardedRequest("тест", connection_pool_size=1, pool_timeout=0.05)
+
+    async def scenario():
+        url = "https://api.telegram.org/botTOKEN/sendMessage"
+        return await asyncio.gather(
+            *(request.post(url, RequestData()) for _ in range(bot.CIRCUIT_FAILURE_THRESHOLD + 1)),
+            return_exceptions=True
+        )
+
+    try:
+        results = asyncio.run(scenario())
+    finally:
+        bot.connection_pools.remove(request)
+    exhausted = [r for r in results if isinstance(r, bot.PoolExhaustedError)]
+    assert len(exhausted) == bot.CIRCUIT_FAILURE_THRESHOLD
+    assert request.timeouts == bot.CIRCUIT_FAILURE_THRESHOLD
+    assert bot.api_guard.breaker('sendMessage').state == 'closed'
@@ -0,0 +1,77 @@
+import pytest
+
+import bot
+
+
+def test_normalizes_unsorted_input():
+    ids = bot.CompactIdSet([5, 3, 5, 1])
+    assert ids.tolist() == [1, 3, 5]
+    assert len(ids) == 3
+    assert 3 in ids
+    assert 4 not in ids
+
+
+def test_add_and_discard_are_buffered_until_compaction():
+    ids = bot.CompactIdSet([1, 3])
+    ids.add(2)
+    ids.discard(3)
+    ids.add(3)
+    ids.discard(1)
+    assert 2 in ids
+    assert 1 not in ids
+    assert ids.tolist() == [2, 3]
+    ids.compact()
+    assert ids.tolist() == [2, 3]
+
+
+def test_ordered_reads():
+    ids = bot.CompactIdSet([10, 20, 30, 40])
+    assert ids.bisect_left(20) == 1
+    assert ids.bisect_right(20) == 2
+    assert ids.slice(1, 3) == [20, 30]
+
+
+def test_set_counts():
+    users = bot.CompactIdSet(range(10))
+    banned = bot.CompactIdSet([2, 4, 100])
+    assert users.intersection_count(banned) == 2
+    assert users.difference_count(banned) == 8
+
+
+def test_serializer_round_trip():
+    serializer = bot.Int64IdsSerializer()
+    data = {'users': bot.CompactIdSet([3, 1, 2]), 'banned_users': bot.CompactIdSet([])}
+    loaded = serializer.loads(serializer.dumps(data))
+    assert loaded['users'].tolist() == [1, 2, 3]
+    assert loaded['banned_users'].tolist() == []
+
+
+def test_truncated_file_is_rejected():
+    serializer = bot.Int64IdsSerializer()
+    raw = serializer.dumps({'users': bot.CompactIdSet(range(100))})
+    with pytest.raises(ValueError):
+        serializer.loads(raw[:-16])
+
+
+def test_from_buffer_does_not_scan_the_file(monkeypatch):
+    raw = bot.Int64IdsSerializer().dumps({'users': bot.CompactIdSet(range(1000))})
+
+    def fail(*args, **kwargs):
+        raise AssertionError("файл не должен проверяться при загрузке")
+
+    monkeypatch.setattr(bot.CompactIdSet, '_normalize', staticmethod(fail))
+    loaded = bot.Int64IdsSerializer().loads(raw)
+    assert len(loaded['users']) == 1000
+    assert 999 in loaded['users']
+
+
+def test_frozen_copy_is_not_affected_by_later_changes():
+    ids = bot.CompactIdSet([1, 2, 3])
+    frozen = ids.frozen()
+    ids.add(4)
+    ids.discard(1)
+    ids.compact()
+    assert frozen.tolist() == [1, 2, 3]
+    assert ids.difference(frozen) == [4]
+    assert frozen.difference(ids) == [1]
+    assert ids.frozen().difference(ids) == []
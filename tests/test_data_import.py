@@ -0,0 +1,79 @@
+import gzip
+import json
+from io import BytesIO
+
+import bot
+
+
+def parse(raw: bytes) -> bot.DataImport:
+    data_import = bot.DataImport(len(raw))
+    data_import.parse(BytesIO(raw))
+    return data_import
+
+
+def ndjson(records) -> bytes:
+    return "".join(json.dumps(record) + "\n" for record in records).encode('utf-8')
+
+
+def test_gzip_export_is_validated_per_record():
+    raw = gzip.compress(ndjson([
+        {'type': 'config', 'data': {'file_url': "https://example.com", 'channel_ids': [-100, "bad"]}},
+        {'type': 'user', 'id': 1},
+        {'type': 'user', 'id': 1},
+        {'type': 'user', 'id': True},
+        {'type': 'ban', 'id': 2},
+        {'type': 'log', 'entry': {'admin_id': 1, 'action': "x", 'ts': 5}},
+        {'type': 'log', 'entry': {'admin_id': "1", 'action': "x"}},
+        {'type': 'unknown'},
+    ]) + b"{broken\n")
+    result = parse(raw)
+    assert result.config == {'file_url': "https://example.com"}
+    assert {key: ids.tolist() for key, ids in result.ids.items()} == {'users': [1], 'banned_users': [2], 'admins': []}
+    assert result.duplicates == 1
+    assert len(result.logs) == 1
+    assert result.invalid == 5
+    assert result.errors[0] == "строка 1: channel_ids должны быть числами"
+    assert "строка 9: некорректный JSON" in result.errors
+    assert result.read_bytes == result.total_bytes
+
+
+def test_plain_ndjson_and_legacy_json():
+    plain = parse(ndjson([{'type': 'admin', 'id': 7}]))
+    assert plain.ids['admins'].tolist() == [7]
+    
+    legacy = parse(json.dumps({'users': [3, 3, 4], 'banned_users': [], 'admins': [7],
+                               'settings': {}, 'logs': [{'admin_id': 7, 'action': "y"}]}).encode('utf-8'))
+    assert legacy.ids['users'].tolist() == [3, 4]
+    assert legacy.duplicates == 1
+    assert legacy.config == {'settings': {}}
+    assert len(legacy.logs) == 1
+
+
+def test_error_list_is_capped():
+    result = parse(ndjson([{'type': 'user', 'id': "x"}] * 20))
+    assert result.invalid == 20
+    assert len(result.errors) == bot.DataImport.MAX_ERRORS
+
+
+def test_out_of_range_id_is_rejected():
+    result = parse(ndjson([{'type': 'user', 'id': 2 ** 63}, {'type': 'user', 'id': 1}]))
+    assert result.invalid == 1
+    assert result.ids['users'].tolist() == [1]
+
+
+def test_apply_import_merges_id_sets(monkeypatch):
+    current = {'users': bot.CompactIdSet([1, 2, 3]), 'banned_users': bot.CompactIdSet([9])}
+    monkeypatch.setattr(bot, 'load_users_data', lambda: current)
+    parsed = parse(ndjson([{'type': 'user', 'id': item} for item in (3, 4, 5)] + [{'type': 'admin', 'id': 42}]))
+    data = {'admins': [bot.MAIN_ADMIN_ID]}
+    added = bot.apply_import(data, parsed, replace=False, admin_id=7)
+    assert added == {'users': 2, 'banned_users': 0, 'admins': 1}
+    assert isinstance(data['users'], bot.CompactIdSet)
+    assert data['users'].tolist() == [1, 2, 3, 4, 5]
+    assert 'banned_users' not in data
+    assert data['admins'] == [bot.MAIN_ADMIN_ID, 42, 7]
+    
+    replaced = {'admins': [bot.MAIN_ADMIN_ID]}
+    added = bot.apply_import(replaced, parsed, replace=True, admin_id=7)
+    assert replaced['users'].tolist() == [3, 4, 5]
+    assert added['users'] == 2
@@ -0,0 +1,38 @@
+import asyncio
+
+from telegram.request import HTTPXRequest, RequestData
+
+import bot
+
+
+def test_timeouts_from_environment_are_per_method_defaults(monkeypatch):
+    monkeypatch.setattr(bot, 'api_guard', bot.ApiGuard())
+    monkeypatch.setattr(bot, 'TELEGRAM_CONNECT_TIMEOUT', 4.0)
+    monkeypatch.setattr(bot, 'TELEGRAM_READ_TIMEOUT', 25.0)
+    calls = {}
+
+    async def fake_request(self, url, method, request_data=None, read_timeout=None, write_timeout=None,
+                           connect_timeout=None, pool_timeout=None):
+        calls[url.rsplit('/', 1)[-1]] = (read_timeout, connect_timeout)
+        return 200, b'{"ok": true, "result": true}'
+
+    monkeypatch.setattr(HTTPXRequest, 'do_request', fake_request)
+    request = bot.GuardedRequest("тест", connection_pool_size=1, pool_timeout=1.0)
+
+    async def scenario():
+        for method in ("getChatMember", "sendDocument", "setMyCommands"):
+            await request.post(f"https://api.telegram.org/botTOKEN/{method}", RequestData())
+        await request.post("https://api.telegram.org/botTOKEN/getChat", RequestData(),
+                           read_timeout=1.0, connect_timeout=30.0)
+
+    try:
+        asyncio.run(scenario())
+    finally:
+        bot.connection_pools.remove(request)
+    # Соединение ждется не дольше таймаута из окружения и не дольше таймаута ответа метода
+    assert calls['getChatMember'] == (bot.API_TIMEOUTS['getChatMember'], bot.API_TIMEOUTS['getChatMember'])
+    assert calls['sendDocument'] == (bot.API_TIMEOUTS['sendDocument'], 4.0)
+    # Методы без своего таймаута получают таймаут ответа из окружения
+    assert calls['setMyCommands'] == (25.0, 4.0)
+    # Явно заданные вызывающим таймауты не переопределяются
+    assert calls['getChat'] == (1.0, 30.0)
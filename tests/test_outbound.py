@@ -0,0 +1,98 @@
+import asyncio
+import time
+
+import bot
+
+
+def test_interactive_call_preempts_running_broadcast(monkeypatch):
+    scheduler = bot.OutboundScheduler(rate=50, burst=1)
+    monkeypatch.setattr(bot, 'outbound_scheduler', scheduler)
+    monkeypatch.setattr(bot, 'save_broadcast_checkpoint', lambda broadcast: None)
+    monkeypatch.setattr(bot, 'clear_broadcast_checkpoint', lambda: None)
+    users = bot.CompactIdSet(range(1, 101))
+    monkeypatch.setattr(bot.users_index, 'ensure', lambda: users)
+    sent = []
+
+    class FakeBot:
+        async def send_message(self, chat_id, text, parse_mode=None):
+            async with bot.outbound_scheduler.slot(bot.outbound_priority.get()):
+                sent.append(chat_id)
+
+        async def edit_message_text(self, **kwargs):
+            pass
+
+    broadcast = {'chat_id': 1, 'status_message_id': 1, 'cursor': None, 'sent': 0, 'failed': 0, 'total': 100,
+                 'content': {'text': "hi", 'photo': None, 'document': None}}
+
+    async def scenario():
+        task = asyncio.create_task(bot.run_broadcast(FakeBot(), broadcast))
+        await asyncio.sleep(0.2)
+        started = time.monotonic()
+        async with scheduler.slot(bot.PRIORITY_INTERACTIVE):
+            waited = time.monotonic() - started
+        in_progress = len(sent)
+        await task
+        return waited, in_progress
+
+    waited, in_progress = asyncio.run(scenario())
+    assert 0 < in_progress < 100
+    # Ответ не ждет оставшиеся ~80 сообщений рассылки (~1.6 с при 50 вызовах в секунду)
+    assert waited < 0.1
+    assert broadcast['sent'] == 100
+
+
+def test_only_message_sending_methods_use_the_budget():
+    scheduler = bot.OutboundScheduler(rate=1, burst=1)
+
+    async def scenario():
+        async with scheduler.slot(bot.PRIORITY_INTERACTIVE):
+            pass
+        started = time.monotonic()
+        for _ in range(20):
+            async with scheduler.slot(bot.PRIORITY_CHECKS, limited=False):
+                pass
+        return time.monotonic() - started
+
+    assert asyncio.run(scenario()) < 0.1
+    assert scheduler.waits[bot.PRIORITY_CHECKS][0] == 0
+    assert 'getChatMember' not in bot.RATE_LIMITED_METHODS
+    assert 'sendMessage' in bot.RATE_LIMITED_METHODS
+
+
+def test_waiting_calls_are_granted_by_priority_with_fair_share():
+    scheduler = bot.OutboundScheduler(rate=200, burst=1, fair_share=3)
+    order = []
+
+    async def call(priority, name):
+        await scheduler.acquire(priority)
+        order.append(name)
+
+    async def scenario():
+        await scheduler.acquire(bot.PRIORITY_INTERACTIVE)  # бюджет исчерпан, дальше все ждут в очередях
+        calls = [(bot.PRIORITY_BULK, f"b{i}") for i in range(3)]
+        calls += [(bot.PRIORITY_CHECKS, f"c{i}") for i in range(2)]
+        calls += [(bot.PRIORITY_INTERACTIVE, f"i{i}") for i in range(3)]
+        await asyncio.gather(*(call(priority, name) for priority, name in calls))
+
+    asyncio.run(scenario())
+    # Каждый третий вызов отдается самому низкому ждущему классу
+    assert order == ["i0", "i1", "b0", "i2", "c0", "b1", "c1", "b2"]
+
+
+def test_bulk_calls_are_limited_in_flight():
+    scheduler = bot.OutboundScheduler(rate=1000, burst=100, bulk_in_flight=2)
+    active = []
+    peak = []
+
+    async def send():
+        async with scheduler.slot(bot.PRIORITY_BULK):
+            active.append(1)
+            peak.append(len(active))
+            await asyncio.sleep(0.01)
+            active.pop()
+
+    async def scenario():
+        await asyncio.gather(*(send() for _ in range(6)))
+
+    asyncio.run(scenario())
+    assert max(peak) == 2
@@ -0,0 +1,45 @@
+import asyncio
+
+import pytest
+
+import bot
+
+
+class FakeApp:
+    def __init__(self):
+        self.stopped = False
+
+    def stop_running(self):
+        self.stopped = True
+
+
+def test_tracked_work_is_cancelled_after_deadline():
+    coordinator = bot.ShutdownCoordinator(deadline=0.05)
+    app = FakeApp()
+
+    async def scenario():
+        work = asyncio.create_task(coordinator.run(asyncio.sleep(5)))
+        await asyncio.sleep(0)
+        coordinator.request(app)
+        with pytest.raises(TimeoutError):
+            await work
+
+    asyncio.run(scenario())
+    assert coordinator.requested
+    assert app.stopped
+
+
+def test_work_finishing_before_deadline_is_kept():
+    coordinator = bot.ShutdownCoordinator(deadline=0.2)
+
+    async def job():
+        await asyncio.sleep(0.05)
+        return "done"
+
+    async def scenario():
+        work = asyncio.create_task(coordinator.run(job()))
+        await asyncio.sleep(0)
+        coordinator.request(FakeApp())
+        return await work
+
+    assert asyncio.run(scenario()) == "done"
@@ -0,0 +1,69 @@
+import pytest
+
+import bot
+
+
+def make_data(users, banned=(), **settings):
+    data = {'admins': [1], 'settings': settings}
+    data['users'] = bot.CompactIdSet(users).frozen()
+    data['banned_users'] = bot.CompactIdSet(banned).frozen()
+    return data
+
+
+@pytest.fixture
+def store(tmp_path):
+    return bot.SnapshotStore(str(tmp_path), compact_deltas=2, keep=2)
+
+
+def test_deltas_hold_only_changes(store):
+    assert store.checkpoint(make_data([1, 2, 3])) == 'full'
+    assert store.checkpoint(make_data([1, 2, 3])) == 'unchanged'
+    assert store.checkpoint(make_data([2, 3, 4], mode='on')) == 'delta'
+    base, count, _ = store.list_points()[0]
+    assert count == 1
+    delta = store._read_deltas(base)[0]
+    assert delta['lists'] == {'users': {'add': [4], 'remove': [1]}}
+    assert delta['set'] == {'settings': {'mode': 'on'}}
+
+
+def test_unchanged_sets_are_compared_by_reference(store, monkeypatch):
+    users = bot.CompactIdSet(range(1000))
+    data = make_data([])
+    data['users'] = users.frozen()
+    store.checkpoint(data)
+    monkeypatch.setattr(bot.CompactIdSet, 'tolist', lambda self: pytest.fail("списки не должны строиться"))
+    data = make_data([])
+    data['users'] = users.frozen()
+    assert store.checkpoint(data) == 'unchanged'
+
+
+def test_restore_each_point(store):
+    store.checkpoint(make_data([1]))
+    store.checkpoint(make_data([1, 2]))
+    store.checkpoint(make_data([2, 3], banned=[1]))
+    points = store.list_points()
+    assert [count for _, count, _ in points] == [2, 1, 0]
+    restored = [store.restore(base, count) for base, count, _ in points]
+    assert [state['users'].tolist() for state in restored] == [[2, 3], [1, 2], [1]]
+    assert restored[0]['banned_users'].tolist() == [1]
+
+
+def test_compaction_starts_new_full_snapshot_and_prunes(store):
+    for users in ([1], [1, 2], [1, 2, 3], [4], [5], [6], [7]):
+        store.checkpoint(make_data(users))
+    bases = store._bases()
+    assert len(bases) == 2
+    base, count, _ = store.list_points()[0]
+    assert base == bases[-1]
+    assert store.restore(base, count)['users'].tolist() == [7]
+
+
+def test_resume_continues_chain_after_restart(store, tmp_path):
+    store.checkpoint(make_data([1]))
+    store.checkpoint(make_data([1, 2]))
+    restarted = bot.SnapshotStore(str(tmp_path), compact_deltas=5, keep=2)
+    assert restarted.checkpoint(make_data([1, 2])) == 'unchanged'
+    assert restarted.checkpoint(make_data([2])) == 'delta'
+    base, count, _ = restarted.list_points()[0]
+    assert count == 2
+    assert restarted.restore(base, count)['users'].tolist() == [2]
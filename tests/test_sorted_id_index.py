@@ -0,0 +1,52 @@
+import pytest
+
+import bot
+
+
+@pytest.fixture
+def index(monkeypatch):
+    ids = bot.CompactIdSet([5, 1, 9, 3, 7, -2])
+    monkeypatch.setattr(bot, 'load_users_data', lambda: {'users': ids, 'banned_users': bot.CompactIdSet()})
+    return bot.SortedIdIndex('users'), ids
+
+
+def test_pages_follow_cursors(index):
+    index, _ = index
+    assert index.page_after(None, 3) == [-2, 1, 3]
+    assert index.page_after(3, 3) == [5, 7, 9]
+    assert index.page_after(9, 3) == []
+    assert index.page_before(5, 3) == [-2, 1, 3]
+    assert index.page_before(1, 3) == [-2]
+    assert index.has_after(7) and not index.has_after(9)
+    assert index.has_before(1) and not index.has_before(-2)
+
+
+def test_cursor_is_stable_when_ids_change(index):
+    index, ids = index
+    first = index.page_after(None, 3)
+    ids.add(2)
+    ids.discard(5)
+    # Следующая страница начинается строго после последнего показанного ID
+    assert index.page_after(first[-1], 3) == [7, 9]
+    assert len(index) == 6
+    assert 2 in index and 5 not in index
+
+
+def test_cursor_encoding_round_trip():
+    for direction, value in (("n", 0), ("p", 123456789012), ("n", -1002209682372)):
+        cursor = bot.encode_cursor(direction, value)
+        assert len(cursor) <= 12
+        assert bot.decode_cursor(cursor) == (direction, value)
+    with pytest.raises(ValueError):
+        bot.decode_cursor("x12")
+
+
+def test_render_id_page_navigation(index, monkeypatch):
+    index, _ = index
+    monkeypatch.setattr(bot, 'LIST_PAGE_SIZE', 2)
+    ids, navigation = bot.render_id_page(index, None, "list_")
+    assert ids == [-2, 1]
+    assert [button.callback_data for button in navigation] == ["list_" + bot.encode_cursor('n', 1)]
+    ids, navigation = bot.render_id_page(index, bot.encode_cursor('n', 1), "list_")
+    assert ids == [3, 5]
+    assert len(navigation) == 2
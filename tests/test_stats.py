@@ -0,0 +1,18 @@
+import bot
+
+
+def test_unique_users_are_not_recounted_after_restart():
+    series = bot.UniqueRingSeries(86400, 30)
+    now = 86400 * 100 + 10
+    series.add_unique(1, now)
+    series.add_unique(2, now)
+
+    restored = bot.UniqueRingSeries(86400, 30)
+    restored.load_dict(bot.json_loads(bot.json_dumps(series.to_dict())))
+    restored.add_unique(1, now + 60)
+    restored.add_unique(3, now + 60)
+    assert restored.values(now + 60)[-1] == 3
+
+    # В новом интервале пользователи снова учитываются
+    restored.add_unique(1, now + 86400)
+    assert restored.values(now + 86400)[-2:] == [3, 1]
@@ -0,0 +1,40 @@
+import asyncio
+from types import SimpleNamespace
+
+from telegram.constants import ChatMemberStatus
+
+import bot
+
+
+class FakeBot:
+    def __init__(self):
+        self.lookups = []
+
+    async def get_chat_member(self, chat_id, user_id):
+        self.lookups.append(chat_id)
+        return SimpleNamespace(status=ChatMemberStatus.LEFT)
+
+
+class FakeQuery:
+    def __init__(self, user_id):
+        self.from_user = SimpleNamespace(id=user_id)
+        self.message = SimpleNamespace(chat_id=user_id, message_id=10)
+        self.id = f"query-{user_id}"
+
+    async def answer(self, text=None, show_alert=False):
+        pass
+
+
+def test_subscription_button_looks_up_each_channel_once(monkeypatch):
+    async def fake_show_screen(message, context, caption, reply_markup, image_path=None):
+        return SimpleNamespace(message_id=11)
+
+    monkeypatch.setattr(bot, 'show_screen', fake_show_screen)
+    fake_bot = FakeBot()
+    context = SimpleNamespace(bot=fake_bot)
+    update = SimpleNamespace(callback_query=FakeQuery(42))
+
+    asyncio.run(bot.check_subscription_callback(update, context))
+
+    assert sorted(fake_bot.lookups, key=str) == sorted(bot.subscription_channels(), key=str)
+    assert bot.user_messages[42] == 11
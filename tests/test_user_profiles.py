@@ -0,0 +1,88 @@
+import json
+import os
+
+import pytest
+
+import bot
+
+
+@pytest.fixture
+def files(tmp_path, monkeypatch):
+    monkeypatch.setattr(bot, 'USER_PROFILES_FILE', str(tmp_path / "profiles.json"))
+    monkeypatch.setattr(bot, 'USER_PROFILES_JOURNAL', str(tmp_path / "profiles.changes.ndjson"))
+    return tmp_path
+
+
+def test_search_sees_buffered_keys_and_renames(monkeypatch):
+    monkeypatch.setattr(bot.UserProfileStore, 'KEY_BUFFER_LIMIT', 2)
+    store = bot.UserProfileStore()
+    store.touch(1, "alice", "Alice", "Smith", "ru")
+    store.touch(2, "bob", "Bob", None, "en")
+    store.touch(3, "alfred", None, None, None)
+    assert store.search("al") == [3, 1]
+    store.touch(1, "carol", "Carol", "Smith", "ru")
+    assert store.search("al") == [3]
+    assert store.search("@car") == [1]
+    assert store.search("smith") == [1]
+    store.touch(1, "alice", "Alice", "Smith", "ru")
+    assert store.search("al") == [3, 1]
+    assert store.search("car") == []
+
+
+def test_only_changed_profiles_are_persisted(files):
+    store = bot.UserProfileStore()
+    for user_id in range(1, 11):
+        store.touch(user_id, f"user{user_id}", None, None, None)
+    full, records = store.snapshot()
+    assert full and len(records) == 10
+    bot.UserProfileStore.write(full, records)
+    assert store.snapshot() is None
+    
+    store.touch(3, "renamed", None, None, None)
+    full, records = store.snapshot()
+    assert not full and [record[0] for record in records] == [3]
+    bot.UserProfileStore.write(full, records)
+    
+    reloaded = bot.UserProfileStore()
+    reloaded.load()
+    assert len(reloaded) == 10
+    assert reloaded.get(3)[0] == "renamed"
+    assert reloaded.search("renamed") == [3]
+
+
+def test_journal_is_compacted_into_main_file(files):
+    store = bot.UserProfileStore()
+    for user_id in range(1, 5):
+        store.touch(user_id, None, "Name", None, None)
+    bot.UserProfileStore.write(*store.snapshot())
+    for user_id in range(1, 5):
+        store.touch(user_id, None, "Other", None, None)
+        full, records = store.snapshot()
+        bot.UserProfileStore.write(full, records)
+    # Журнал дорос до числа профилей - последнее сохранение было полным
+    assert full
+    assert not os.path.exists(bot.USER_PROFILES_JOURNAL)
+    with open(bot.USER_PROFILES_FILE, encoding='utf-8') as f:
+        assert {record[2] for record in json.load(f)} == {"Other"}
+
+
+def test_stale_journal_is_ignored(files):
+    store = bot.UserProfileStore()
+    store.touch(1, "old", None, None, None)
+    bot.UserProfileStore.write(*store.snapshot())
+    store.touch(2, "second", None, None, None)
+    bot.UserProfileStore.write(*store.snapshot())
+    # Сбой между записью основного файла и удалением журнала
+    with open(bot.USER_PROFILES_JOURNAL, 'w', encoding='utf-8') as f:
+        f.write(json.dumps([[1, "stale", None, None, None, 0, 0]]) + "\n")
+    os.utime(bot.USER_PROFILES_JOURNAL, (0, 0))
+    store.touch(1, "new", None, None, None)
+    full, records = store.snapshot()
+    assert full
+    with open(bot.USER_PROFILES_FILE + ".tmp", 'w', encoding='utf-8') as f:
+        json.dump(records, f)
+    os.replace(bot.USER_PROFILES_FILE + ".tmp", bot.USER_PROFILES_FILE)
+    
+    reloaded = bot.UserProfileStore()
+    reloaded.load()
+    assert reloaded.get(1)[0] == "new"
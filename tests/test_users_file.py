@@ -0,0 +1,75 @@
+import asyncio
+import os
+
+import pytest
+
+import bot
+
+
+def test_lists_are_reread_only_by_the_watcher(monkeypatch):
+    bot.save_users_data({'users': [1, 2], 'banned_users': []})
+    assert bot.load_users_data()['users'].tolist() == [1, 2]
+    
+    # Правка файла извне: загрузка его не проверяет, это делает config_watch_job
+    raw = bot.users_serializer.dumps({'users': bot.CompactIdSet([7]), 'banned_users': bot.CompactIdSet([])})
+    bot._write_bytes_atomic(bot.USERS_FILE, raw)
+    os.utime(bot.USERS_FILE, (0, 0))
+    monkeypatch.setattr(os.path, 'getmtime', lambda path: pytest.fail("stat на каждой загрузке"))
+    assert bot.load_users_data()['users'].tolist() == [1, 2]
+    monkeypatch.undo()
+    
+    version = bot.data_version
+    assert bot.reload_users_data()
+    assert bot.data_version == version + 1
+    assert bot.load_users_data()['users'].tolist() == [7]
+    assert not bot.reload_users_data()
+
+
+def test_legacy_lists_are_merged_into_existing_users_file():
+    bot.save_users_data({'users': [10, 11, 12, 13], 'banned_users': [20]})
+    # Старый bot_data.json со списками (устаревший деплой или резервная копия)
+    config = dict(bot.current_config(), users=[6653101277, 11], banned_users=[21])
+    with open(bot.DATA_FILE, 'wb') as f:
+        f.write(bot.json_dumps(config))
+    assert bot.reload_config(force=True)
+    assert bot.get_all_users() == [10, 11, 12, 13, 6653101277]
+    assert bot.load_users_data()['banned_users'].tolist() == [20, 21]
+    with open(bot.DATA_FILE, 'rb') as f:
+        assert 'users' not in bot.json_loads(f.read())
+    # Файл списков тоже содержит объединение
+    loaded = bot.users_serializer.load_path(bot.USERS_FILE)
+    assert list(loaded['users']) == [10, 11, 12, 13, 6653101277]
+
+
+def test_single_changes_are_written_in_batches(monkeypatch):
+    bot.save_users_data({'users': [1], 'banned_users': []})
+    writes = []
+    original = bot._write_bytes_atomic
+    monkeypatch.setattr(bot, '_write_bytes_atomic', lambda path, payload: (writes.append(path), original(path, payload)))
+    
+    for user_id in range(2, 50):
+        assert bot.add_user(user_id)
+    assert bot.ban_user(5)
+    assert bot.remove_users([3, 4, 999]) == 2
+    assert writes == []
+    assert 49 in bot.users_index and 3 not in bot.users_index
+    
+    asyncio.run(bot.users_flush_job(None))
+    assert writes == [bot.USERS_FILE]
+    loaded = bot.users_serializer.load_path(bot.USERS_FILE)
+    assert len(loaded['users']) == 47
+    assert list(loaded['banned_users']) == [5]
+    # Без новых изменений файл не переписывается
+    asyncio.run(bot.users_flush_job(None))
+    bot.flush_users_data()
+    assert writes == [bot.USERS_FILE]
+
+
+def test_older_snapshot_does_not_overwrite_newer_file():
+    bot.save_users_data({'users': [1], 'banned_users': []})
+    bot.add_user(2)
+    stale = bot._users_snapshot()
+    bot.add_user(3)
+    bot.flush_users_data()
+    assert not bot._write_users_file(*stale)
+    assert list(bot.users_serializer.load_path(bot.USERS_FILE)['users']) == [1, 2, 3]